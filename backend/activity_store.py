@@ -0,0 +1,218 @@
+import datetime
+import logging
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from database import Activity, ActivityStream
+from garmin_sync import summarize_activity, SINGLE_FLIGHT
+from raw_archive import RawArchive
+
+logger = logging.getLogger(__name__)
+
+# First sync of a new athlete downloads this much history (enough for the CTL warmup)
+BACKFILL_DAYS = 102
+# Every delta sync re-asks this many days before the newest stored activity, so activities that reach
+# Garmin late with an earlier date (second device, watch synced days later, manual entry) are still picked up
+SYNC_LOOKBACK_DAYS = 7
+# Skip the Garmin delta call if the athlete was synced less than this many minutes ago
+SYNC_INTERVAL_MINUTES = 5
+
+# Columns a re-fetched activity overwrites
+ACTIVITY_COLUMNS = ["start_time_local", "date", "activity_type", "summary", "synced_at"]
+
+# Format: { email: datetime of last successful delta sync }
+_LAST_SYNC = {}
+
+
+def upsert_activities(db: Session, rows):
+    """
+    Writes activities rows, replacing existing (user_email, activity_id) ones in the same statement, so two
+    workers syncing the same athlete cannot hit uq_activities_user_activity. The caller commits.
+    Dialects without ON CONFLICT fall back to delete + insert.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(Activity)
+        stmt = stmt.on_conflict_do_update(index_elements=["user_email", "activity_id"],
+                                          set_={c: stmt.excluded[c] for c in ACTIVITY_COLUMNS})
+        db.execute(stmt, rows)
+        return
+    for row in rows:
+        db.query(Activity).filter(Activity.user_email == row["user_email"], Activity.activity_id == row["activity_id"]).delete(synchronize_session=False)
+    db.execute(insert(Activity), rows)
+
+
+class ActivityStore:
+    """Local copy of each athlete's Garmin activities, kept up to date with delta syncs."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def latest_start(self, user_email: str):
+        """startTimeLocal of the newest stored activity, or None."""
+        return self.db.query(func.max(Activity.start_time_local)).filter(
+            Activity.user_email == user_email
+        ).scalar()
+
+    def sync(self, gm, force=False):
+        """
+        Asks Garmin for activities from SYNC_LOOKBACK_DAYS before the newest stored one onwards, stores the new ones
+        and updates the ones Garmin has revised since. Returns the number of new activities, or None if Garmin
+        could not be reached.
+        Concurrent syncs of the same athlete share one run (and one set of inserts).
+        """
+        return SINGLE_FLIGHT.do((gm.email, "activity_sync", None), self._sync, gm, force)
+
+    def _sync(self, gm, force):
+        email = gm.email
+        now = datetime.datetime.now()
+        last_sync = _LAST_SYNC.get(email)
+        if not force and last_sync and (now - last_sync).total_seconds() / 60.0 < SYNC_INTERVAL_MINUTES:
+            return 0
+
+        today = datetime.date.today()
+        last_start = self.latest_start(email)
+        if last_start:
+            # Re-ask a fixed lookback before the newest stored activity and drop the ones we already have by activityId
+            start_date = datetime.date.fromisoformat(last_start.split(' ')[0]) - datetime.timedelta(days=SYNC_LOOKBACK_DAYS)
+        else:
+            start_date = today - datetime.timedelta(days=BACKFILL_DAYS)
+
+        try:
+            raw = gm.fetch_activities(start_date, today)
+        except Exception as e:
+            logger.warning(f"Garmin activity fetch failed for {email}: {e}")
+            return None
+        if raw is None:
+            return None
+
+        ids = [act.get('activityId') for act in raw]
+        stored = {}
+        if last_start and ids:
+            # Matched by id, not date, so an activity whose date was edited is still recognized
+            stored = {row[0]: row for row in self.db.query(
+                Activity.activity_id, Activity.date, Activity.start_time_local, Activity.summary
+            ).filter(
+                Activity.user_email == email,
+                Activity.activity_id.in_(ids)
+            ).all()}
+
+        new_count = 0
+        changed_count = 0
+        touched_dates = set()
+        new_summaries = []
+        rows = {}
+        synced_at = now.isoformat()
+        archive = RawArchive(self.db)
+        for act in raw:
+            start_time = act.get('startTimeLocal') or ''
+            act_id = act.get('activityId')
+            summary = summarize_activity(act)
+            old = stored.get(act_id)
+            if old is not None and old[2] == start_time and old[3] == summary:
+                continue
+
+            archive.store(email, "activity", act_id, act, date=summary["date"], fetched_at=synced_at)
+            rows[act_id] = {
+                "user_email": email,
+                "activity_id": act_id,
+                "start_time_local": start_time,
+                "date": summary["date"],
+                "activity_type": summary["type"],
+                "summary": summary,
+                "synced_at": synced_at
+            }
+            if old is None:
+                new_summaries.append(summary)
+                new_count += 1
+            else:
+                # Garmin revised it (training load, sport, duration...): the old day must be recomputed too
+                changed_count += 1
+                touched_dates.add(old[1])
+            stored[act_id] = (act_id, summary["date"], start_time, summary)
+            touched_dates.add(summary["date"])
+
+        if rows:
+            upsert_activities(self.db, list(rows.values()))
+        self.db.commit()
+        _LAST_SYNC[email] = now
+        touched_dates.discard("")
+        touched_dates.discard(None)
+        if new_count or changed_count:
+            logger.info(f"Stored {new_count} new and {changed_count} updated activities for {email}")
+            # Streams uploaded before their activity was synced get their curves now that the sport is known
+            from fit_ingest import StreamStore
+            streams = StreamStore(self.db)
+            for (act_id,) in self.db.query(ActivityStream.activity_id).filter(
+                ActivityStream.user_email == email,
+                ActivityStream.activity_id.in_(list(rows))
+            ).all():
+                streams.refresh_curves(email, act_id, rows[act_id]["activity_type"])
+            # Roll the stored CTL/ATL forward from the oldest touched day, re-aggregate only the touched days
+            from pmc_store import PmcStore
+            from rollups import RollupStore
+            PmcStore(self.db).roll_forward(email, datetime.date.fromisoformat(min(touched_dates)) if touched_dates else None)
+            RollupStore(self.db).update_days(email, touched_dates)
+            from challenge_rules import ChallengeEngine
+            if changed_count:
+                # A revised activity was already folded into the challenge states: replay the windows
+                ChallengeEngine(self.db).recompute(email)
+            else:
+                # One pass over the new activities advances every active challenge
+                ChallengeEngine(self.db).on_activities(email, new_summaries)
+        return new_count
+
+    def get_activities(self, user_email: str, start_date, end_date=None):
+        """Summarized activities between two dates (inclusive), newest first like Garmin's lists."""
+        end_date = end_date or datetime.date.today()
+        rows = self.db.query(Activity.summary).filter(
+            Activity.user_email == user_email,
+            Activity.date >= start_date.isoformat(),
+            Activity.date <= end_date.isoformat()
+        ).order_by(Activity.start_time_local.desc()).all()
+        return [row[0] for row in rows]
+
+    def get_recent(self, user_email: str, days: int):
+        """Same window as GarminManager.get_recent_activities, read from the local store."""
+        today = datetime.date.today()
+        return self.get_activities(user_email, today - datetime.timedelta(days=days), today)
+
+    def sync_user(self, db_user):
+        """Delta sync for a User row, persisting refreshed Garmin tokens. Returns the GarminManager used."""
+        from garmin_sync import GarminManager
+        gm = GarminManager(db_user.email, db_user.hashed_password, tokens=db_user.garmin_tokens)
+        result = self.sync(gm)
+
+        # Save tokens to persist session
+        if gm.get_session_tokens():
+            db_user.garmin_tokens = gm.get_session_tokens()
+            self.db.commit()
+        return gm, result
+
+    def has_activities(self, user_email: str) -> bool:
+        return self.db.query(Activity.id).filter(Activity.user_email == user_email).first() is not None
+
+    def last_synced(self, user_email: str):
+        """When the athlete's activities were last synced with Garmin, or None."""
+        if user_email in _LAST_SYNC:
+            return _LAST_SYNC[user_email]
+        # Other worker / restarted process: fall back to the newest stored row
+        value = self.db.query(func.max(Activity.synced_at)).filter(Activity.user_email == user_email).scalar()
+        return datetime.datetime.fromisoformat(value) if value else None
+
+
+def refresh_user(email: str):
+    """Background delta sync. Opens its own DB session since the request's one is closed by then."""
+    from database import SessionLocal, User
+    db = SessionLocal()
+    try:
+        db_user = db.query(User).filter(User.email == email).first()
+        if db_user and db_user.hashed_password:
+            ActivityStore(db).sync_user(db_user)
+    except Exception as e:
+        logger.warning(f"Background activity refresh failed for {email}: {e}")
+    finally:
+        db.close()
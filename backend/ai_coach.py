@@ -11,6 +11,7 @@ except ImportError:
 
 from datetime import datetime, timedelta
 import json
+from concurrency import LLM_LIMIT
 
 class AICoach:
     def __init__(self):
@@ -245,6 +246,7 @@ Sii il coach che vorresti avere! 💪
         
         return prompt
     
+    @LLM_LIMIT
     def chat(self, user_message, conversation_history, user_profile, recent_stats=None, training_plan=None):
         """
         Main chat method with enhanced context
@@ -0,0 +1,81 @@
+"""
+Concurrency benchmark: one slow Garmin call must not stall unrelated requests.
+
+Fires a /api/user/recent-activities request whose Garmin download takes SLOW_GARMIN_SECONDS
+and, while it is in flight, a burst of DB-only /api/user/training-plan requests.
+With the threadpool execution model (sync handlers) the burst latency stays in the
+milliseconds; with blocking calls on the event loop it would be >= SLOW_GARMIN_SECONDS.
+
+Usage (from backend/):  python benchmarks/bench_concurrency.py [slow_seconds] [burst_size]
+"""
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import httpx
+import garmin_sync
+import main
+from database import SessionLocal, User
+
+SLOW_GARMIN_SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+BURST_SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+class _NoTokens:
+    def dumps(self):
+        return None
+
+
+class SlowGarmin:
+    """Stands in for garminconnect.Garmin: every download takes SLOW_GARMIN_SECONDS."""
+    display_name = "bench"
+
+    def __init__(self, email, password):
+        self.garth = _NoTokens()
+
+    def login(self):
+        return True
+
+    def get_activities_by_date(self, start, end):
+        time.sleep(SLOW_GARMIN_SECONDS)
+        return []
+
+
+async def main_async():
+    garmin_sync.Garmin = SlowGarmin
+    db = SessionLocal()
+    db.add(User(email="slow@example.com", hashed_password="pw"))
+    db.add(User(email="fast@example.com"))
+    db.commit()
+    db.close()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def timed(url):
+            t0 = time.perf_counter()
+            r = await client.get(url)
+            return time.perf_counter() - t0, r.status_code
+
+        slow = asyncio.create_task(timed("/api/user/recent-activities/slow@example.com"))
+        await asyncio.sleep(0.1) # make sure the slow call is in flight
+        burst = await asyncio.gather(*[timed("/api/user/training-plan/fast@example.com") for _ in range(BURST_SIZE)])
+        slow_time, _ = await slow
+
+    lat = sorted(t for t, _ in burst)
+    print(f"slow garmin request: {slow_time * 1000:.0f} ms")
+    print(f"unrelated requests ({BURST_SIZE}): p50={statistics.median(lat) * 1000:.1f} ms "
+          f"p95={lat[int(len(lat) * 0.95) - 1] * 1000:.1f} ms max={lat[-1] * 1000:.1f} ms")
+    print("event loop stalled" if lat[-1] >= SLOW_GARMIN_SECONDS else "event loop not blocked by Garmin")
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
@@ -0,0 +1,80 @@
+"""
+Dashboard load test against the local fake Garmin Connect server (no real Garmin accounts).
+
+Starts fake_garmin.FakeGarminServer with GARMIN_LATENCY_MS per call, then for ATHLETES athletes
+fires one dashboard page load each (training-stats, health-metrics, recent-activities in parallel),
+first cold (empty DB) and then warm. Prints page latency percentiles and Garmin calls per route.
+
+Usage (from backend/):  python benchmarks/bench_fake_garmin.py [athletes] [latency_ms] [error_rate]
+"""
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+ATHLETES = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+GARMIN_LATENCY_MS = float(sys.argv[2]) if len(sys.argv) > 2 else 300
+ERROR_RATE = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+from fake_garmin import FakeGarminServer
+
+server = FakeGarminServer(port=0, latency_ms=GARMIN_LATENCY_MS, jitter_ms=GARMIN_LATENCY_MS / 4, error_rate=ERROR_RATE).start_in_thread()
+os.environ["GARMIN_FAKE_URL"] = server.url
+
+import httpx
+import main
+from database import SessionLocal, User
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+DASHBOARD = ["/api/user/training-stats/{}", "/api/user/health-metrics/{}", "/api/user/recent-activities/{}"]
+
+
+def garmin_calls():
+    with urllib.request.urlopen(server.url + "/__stats") as r:
+        return json.loads(r.read())
+
+
+async def page_loads(client, emails):
+    async def page(email):
+        t0 = time.perf_counter()
+        responses = await asyncio.gather(*[client.get(url.format(email)) for url in DASHBOARD])
+        return time.perf_counter() - t0, [r.status_code for r in responses]
+
+    results = await asyncio.gather(*[page(e) for e in emails])
+    lat = sorted(t for t, _ in results)
+    errors = sum(1 for _, codes in results for c in codes if c != 200)
+    return lat, errors
+
+
+async def main_async():
+    emails = [f"athlete{i}@example.com" for i in range(ATHLETES)]
+    db = SessionLocal()
+    for e in emails:
+        db.add(User(email=e, hashed_password="pw"))
+    db.commit()
+    db.close()
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        for label in ("cold", "warm"):
+            before = sum(garmin_calls().values())
+            lat, errors = await page_loads(client, emails)
+            calls = sum(garmin_calls().values()) - before
+            print(f"{label}: {ATHLETES} page loads p50={statistics.median(lat) * 1000:.0f} ms "
+                  f"p95={lat[max(0, int(len(lat) * 0.95) - 1)] * 1000:.0f} ms max={lat[-1] * 1000:.0f} ms "
+                  f"non-200={errors} garmin calls={calls}")
+
+    print(f"garmin calls per route: {garmin_calls()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
@@ -0,0 +1,103 @@
+"""
+PMC (CTL/ATL/TSB) benchmark: vectorized pmc_engine vs the previous per-day Python loop.
+
+Times a single athlete on 60 day, 1 year and 5 year windows, then a 200 athlete roster
+computed as one 2-D array, and the JSON size of a 2 year chart downsampled by LTTB and by week/month.
+
+Usage (from backend/):  python benchmarks/bench_pmc.py
+"""
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from pmc_engine import compute_training_stats, compute_roster_stats, activity_load, bin_activities, pmc, stats_payload
+from downsample import downsample
+
+TYPES = ["running", "road_cycling", "lap_swimming", "strength_training"]
+
+
+def loop_training_stats(activities, days=60, end_date=None):
+    """Baseline: ISO-string dicts walked one day at a time (the pre-pmc_engine implementation)."""
+    end_date = end_date or datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=days + 42)
+    daily_load, daily_volume = {}, {}
+    curr = start_date
+    while curr <= end_date:
+        daily_load[curr.isoformat()] = 0
+        daily_volume[curr.isoformat()] = {"swim": 0, "bike": 0, "run": 0}
+        curr += datetime.timedelta(days=1)
+    for act in activities:
+        date_str = act.get("date") or ""
+        if date_str not in daily_load: continue
+        daily_load[date_str] += activity_load(act)
+    ctl = atl = 0
+    history = []
+    curr = start_date
+    while curr <= end_date:
+        d_str = curr.isoformat()
+        load = daily_load.get(d_str, 0)
+        ctl = ctl + (load - ctl) * (1.0 / 42.0)
+        atl = atl + (load - atl) * (1.0 / 7.0)
+        if curr >= (end_date - datetime.timedelta(days=days)):
+            history.append({"day": curr.strftime("%d/%m"), "fitness": round(ctl, 1), "fatigue": round(atl, 1),
+                            "form": round(ctl - atl, 1), **daily_volume[d_str]})
+        curr += datetime.timedelta(days=1)
+    return history
+
+
+def synthetic_activities(n_days, end_date, rng):
+    acts = []
+    for back in range(n_days + 42):
+        d = (end_date - datetime.timedelta(days=back)).isoformat()
+        for _ in range(rng.integers(0, 3)):
+            acts.append({"date": d, "type": TYPES[rng.integers(0, len(TYPES))],
+                         "duration_min": float(rng.integers(20, 180)),
+                         "training_load": float(rng.integers(20, 250)) if rng.random() < 0.5 else None})
+    return acts
+
+
+def timed(fn, *args, repeat=5, **kwargs):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    rng = np.random.default_rng(11)
+    end = datetime.date.today()
+    for days in (60, 365, 5 * 365):
+        acts = synthetic_activities(days, end, rng)
+        t_loop = timed(loop_training_stats, acts, days=days, end_date=end)
+        t_np = timed(compute_training_stats, acts, days=days, end_date=end)
+        print(f"{days:5d} day window ({len(acts)} activities): loop {t_loop * 1000:.1f} ms, pmc_engine {t_np * 1000:.1f} ms")
+
+    roster = {f"athlete{i}@example.com": synthetic_activities(365, end, rng) for i in range(200)}
+    t_loop = timed(lambda: [loop_training_stats(a, days=365, end_date=end) for a in roster.values()], repeat=1)
+    t_np = timed(compute_roster_stats, roster, days=365, end_date=end, repeat=1)
+    print(f"200 athlete roster, 1 year: loop {t_loop * 1000:.0f} ms, pmc_engine 2-D {t_np * 1000:.0f} ms")
+
+    days = 2 * 365
+    first = end - datetime.timedelta(days=days)
+    load, volume = bin_activities(synthetic_activities(days, end, rng), first, days + 1)
+    ctl, atl, _ = pmc(load)
+    full = json.dumps(stats_payload(ctl, atl, volume, first))
+    print(f"2 year chart: daily {len(full) / 1e3:.0f} kB", end="")
+    for label, kwargs in (("LTTB 120", {"points": 120}), ("weekly", {"bucket": "week"}), ("monthly", {"bucket": "month"})):
+        t0 = time.perf_counter()
+        d_ctl, d_atl, d_volume, offsets = downsample(ctl, atl, volume, first, **kwargs)
+        payload = json.dumps(stats_payload(d_ctl, d_atl, d_volume, first, offsets))
+        t = time.perf_counter() - t0
+        print(f", {label} {len(payload) / 1e3:.0f} kB ({t * 1000:.1f} ms)", end="")
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Workout compiler benchmark: steps compiled per second on large, repeat-heavy workouts.
+
+Builds swim sets shaped like CoachLogic's threshold swims (reps = main_dur // 2 of
+[N m + 20s rest]) plus nested run/bike repeat blocks, then compiles them:
+  - cold: every tree is new (memo cache cleared)
+  - warm: the same trees again (re-sync of an unchanged week, served from the memo cache)
+
+Usage (from backend/):  python benchmarks/bench_workout_compiler.py [workouts] [rounds]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workout_compiler import compile_steps, _compile_cached
+
+N_WORKOUTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+ROUNDS = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+
+def swim_workout(main_dur, rep_dist=100, css_ms=0.95):
+    reps = main_dur // 2
+    return [
+        {"description": "Riscaldamento 400m", "distance_m": 400, "type": "WARMUP", "pace_ms": css_ms * 0.8},
+        {"repeat_count": reps, "description": f"Serie {reps}x[{rep_dist}m]", "steps": [
+            {"description": f"Serie {rep_dist}m", "distance_m": rep_dist, "type": "INTERVAL", "pace_ms": css_ms * 1.02},
+            {"description": "Recupero 20s", "duration_min": 0.33, "type": "RECOVERY"}
+        ]},
+        {"description": "Defaticamento 200m", "distance_m": 200, "type": "COOLDOWN", "pace_ms": css_ms * 0.75},
+    ]
+
+
+def run_workout(main_dur):
+    return [
+        {"description": "Warm up easy 6:00/km", "duration_min": 15, "type": "WARMUP"},
+        {"repeat_count": main_dur // 4, "description": "Fartlek Play", "steps": [
+            {"description": "Fast 4:10/km", "duration_min": 2, "type": "INTERVAL"},
+            {"description": "Float 11.5 km/h", "duration_min": 2, "type": "RECOVERY"}
+        ]},
+        {"repeat": 6, "recovery_dur": 1, "description": "Strides 30 sec", "type": "INTERVAL"},
+        {"description": "Cool down", "duration_min": 10, "type": "COOLDOWN", "target": {"type": "hr", "val": "130"}},
+    ]
+
+
+def count_steps(compiled):
+    return sum(1 + count_steps(s.get("workoutSteps", [])) for s in compiled)
+
+
+def bench(label, workouts, clear):
+    total_steps = 0
+    t0 = time.perf_counter()
+    for _ in range(ROUNDS):
+        if clear:
+            _compile_cached.cache_clear()
+        for steps, sport in workouts:
+            total_steps += count_steps(compile_steps(steps, sport))
+    elapsed = time.perf_counter() - t0
+    print(f"{label:5s} {total_steps:>9d} steps in {elapsed:6.3f}s -> {total_steps / elapsed:>12,.0f} steps/s")
+
+
+if __name__ == "__main__":
+    workouts = []
+    for i in range(N_WORKOUTS):
+        main_dur = 30 + (i % 90) * 2 # up to 90 repeats per swim set
+        workouts.append((swim_workout(main_dur, rep_dist=50 + 25 * (i % 4)), "swimming"))
+        workouts.append((run_workout(main_dur), "running"))
+
+    print(f"{len(workouts)} workouts x {ROUNDS} rounds")
+    bench("cold", workouts, clear=True)
+    bench("warm", workouts, clear=False)
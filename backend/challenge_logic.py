@@ -1,11 +1,83 @@
 
 import datetime
+import threading
+from types import SimpleNamespace
+from sqlalchemy import event, inspect, insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database import Challenge, UserChallenge, PerformanceHistory
+from database import Challenge, UserChallenge, PerformanceHistory, User
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Weekly challenges given to each athlete every week (first ones of the catalog)
+WEEKLY_CHALLENGES_PER_ATHLETE = 2
+# Challenges stay active this many days after their end date, so activities synced late still count
+EXPIRY_GRACE_DAYS = 1
+
+
+class ChallengeCatalog:
+    """
+    In-process copy of the challenges table. Definitions almost never change, so they are read once and
+    reloaded only after a committed change to a Challenge row (see the session events below).
+    Entries are detached snapshots with the Challenge column attributes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = None
+        self.loads = 0
+
+    def _load(self, db):
+        with self._lock:
+            if self._by_id is None:
+                columns = [c.key for c in inspect(Challenge).column_attrs]
+                self._by_id = {
+                    ch.id: SimpleNamespace(**{c: getattr(ch, c) for c in columns})
+                    for ch in db.query(Challenge).order_by(Challenge.id).all()
+                }
+                self.loads += 1
+            return self._by_id
+
+    def get(self, db, challenge_id):
+        by_id = self._by_id if self._by_id is not None else self._load(db)
+        return by_id.get(challenge_id)
+
+    def all(self, db, challenge_type=None):
+        by_id = self._by_id if self._by_id is not None else self._load(db)
+        return [ch for ch in by_id.values() if challenge_type is None or ch.challenge_type == challenge_type]
+
+    def invalidate(self):
+        with self._lock:
+            self._by_id = None
+
+
+CHALLENGE_CATALOG = ChallengeCatalog()
+
+
+@event.listens_for(Session, "after_flush")
+def _track_challenge_changes(session, flush_context):
+    if any(isinstance(obj, Challenge) for objs in (session.new, session.dirty, session.deleted) for obj in objs):
+        session.info["challenges_changed"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_challenge_bulk_changes(orm_execute_state):
+    if (orm_execute_state.is_update or orm_execute_state.is_delete) and orm_execute_state.bind_mapper is inspect(Challenge):
+        orm_execute_state.session.info["challenges_changed"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_challenge_catalog(session):
+    # Only after commit: reloading on flush could cache rows another transaction cannot see yet
+    if session.info.pop("challenges_changed", False):
+        CHALLENGE_CATALOG.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_challenge_changes(session):
+    session.info.pop("challenges_changed", None)
+
 class ChallengeLogic:
     def __init__(self, db: Session):
         self.db = db
@@ -55,80 +127,80 @@ class ChallengeLogic:
             }
         ]
         
-        for d in defaults:
-            exists = self.db.query(Challenge).filter(Challenge.title == d["title"]).first()
-            if not exists:
-                ch = Challenge(**d)
-                self.db.add(ch)
+        titles = {ch.title for ch in CHALLENGE_CATALOG.all(self.db)}
+        missing = [d for d in defaults if d["title"] not in titles]
+        if missing:
+            for d in missing:
+                self.db.add(Challenge(**d))
+            self.db.commit()
+
+    def assign_weekly_challenges(self, week_start: datetime.date, emails=None):
+        """
+        Bulk-assigns the weekly challenges of the week starting week_start (a Monday) to every athlete
+        (or only `emails`) that has none for that week yet. One read, one multi-row INSERT.
+        Returns the emails that got new challenges.
+        """
+        weekly = CHALLENGE_CATALOG.all(self.db, "weekly")[:WEEKLY_CHALLENGES_PER_ATHLETE]
+        if not weekly:
+            return []
+        start, end = week_start.isoformat(), (week_start + datetime.timedelta(days=6)).isoformat()
+        if emails is None:
+            emails = [row[0] for row in self.db.query(User.email).filter(User.email.isnot(None)).all()]
+
+        weekly_ids = [ch.id for ch in CHALLENGE_CATALOG.all(self.db, "weekly")]
+        assigned = {row[0] for row in self.db.query(UserChallenge.user_email).filter(
+            UserChallenge.start_date == start,
+            UserChallenge.challenge_id.in_(weekly_ids)
+        ).distinct().all()}
+        todo = [email for email in emails if email not in assigned]
+        if todo:
+            try:
+                self.db.execute(insert(UserChallenge), [
+                    {"user_email": email, "challenge_id": ch.id, "current_value": 0.0, "status": "active",
+                     "start_date": start, "end_date": end}
+                    for email in todo for ch in weekly
+                ])
+                self.db.commit()
+            except IntegrityError:
+                # Another worker assigned this week in the meantime (unique user/challenge/start)
+                self.db.rollback()
+                logger.info(f"Weekly challenges of {start} already assigned by another run")
+                return []
+        return todo
+
+    def expire_challenges(self, today: datetime.date = None):
+        """
+        Marks every active challenge that ended more than EXPIRY_GRACE_DAYS before today as expired,
+        in one UPDATE. Returns the row count.
+        """
+        today = today or datetime.date.today()
+        cutoff = today - datetime.timedelta(days=EXPIRY_GRACE_DAYS)
+        count = self.db.query(UserChallenge).filter(
+            UserChallenge.status == "active",
+            UserChallenge.end_date < cutoff.isoformat()
+        ).update({UserChallenge.status: "expired"}, synchronize_session=False)
         self.db.commit()
+        return count
 
     def generate_weekly_challenges(self, user_email: str):
-        """Assigns weekly challenges to the user based on their plan status"""
+        """Assigns this week's challenges to one athlete (e.g. right after sign-up) if they have none yet"""
         # Ensure we have some challenges to pick from
         self.seed_default_challenges()
-        
-        # Check if user already has active weekly challenges
-        active = self.db.query(UserChallenge).join(Challenge, UserChallenge.challenge_id == Challenge.id).filter(
-            UserChallenge.user_email == user_email,
-            UserChallenge.status == "active",
-            Challenge.challenge_type == "weekly"
-        ).first() # Simplified check
-        
-        if not active:
-            # Pick a few challenges to assign
-            all_ch = self.db.query(Challenge).filter(Challenge.challenge_type == "weekly").all()
-            
-            # Assign first 2 for now (could be randomized or based on AI coach logic)
-            today = datetime.date.today()
-            start_date = today - datetime.timedelta(days=today.weekday()) # Monday
-            end_date = start_date + datetime.timedelta(days=6) # Sunday
-            
-            for ch in all_ch[:2]:
-                uc = UserChallenge(
-                    user_email=user_email,
-                    challenge_id=ch.id,
-                    current_value=0.0,
-                    status="active",
-                    start_date=start_date.isoformat(),
-                    end_date=end_date.isoformat()
-                )
-                self.db.add(uc)
-            self.db.commit()
 
-    def update_challenge_progress(self, user_email: str, activities: list):
-        """Updates user challenge progress based on actual activities from Garmin"""
-        active_challenges = self.db.query(UserChallenge).filter(
-            UserChallenge.user_email == user_email,
-            UserChallenge.status == "active"
-        ).all()
-        
-        if not active_challenges:
-            return
-
-        for uc in active_challenges:
-            ch = self.db.query(Challenge).filter(Challenge.id == uc.challenge_id).first()
-            if not ch: continue
-            
-            # Filter activities within challenge timeframe
-            relevant_acts = [
-                a for a in activities 
-                if uc.start_date <= a.get('date', '') <= uc.end_date
-            ]
-            
-            new_val = 0.0
-            if ch.metric == "sessions":
-                new_val = float(len(relevant_acts))
-            elif ch.metric == "distance_bike":
-                new_val = sum(a.get('distance_km', 0) for a in relevant_acts if 'bike' in a.get('type', '').lower() or 'cycl' in a.get('type', '').lower())
-            
-            uc.current_value = new_val
-            
-            # Check for completion
-            if uc.current_value >= ch.target_value:
-                uc.status = "completed"
-                logger.info(f"Challenge COMPLETED for {user_email}: {ch.title}")
+        today = datetime.date.today()
+        if self.assign_weekly_challenges(today - datetime.timedelta(days=today.weekday()), [user_email]):
+            # Count what the athlete already did this week
+            from challenge_rules import ChallengeEngine
+            ChallengeEngine(self.db).recompute(user_email)
 
-        self.db.commit()
+    def update_challenge_progress(self, user_email: str, activities: list = None):
+        """
+        Recomputes user challenge progress from scratch with the metric rules in challenge_rules.
+        Without an activity list the athlete's stored activities in the challenge windows are used.
+        New activities are applied incrementally during the sync (ChallengeEngine.on_activities).
+        """
+        from challenge_rules import ChallengeEngine
+        return ChallengeEngine(self.db).recompute(user_email, activities)
 
     def record_performance_check(self, user_email: str, metric_type: str, value: float):
         """Records a new performance point (e.g. after a test session)"""
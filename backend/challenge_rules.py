@@ -0,0 +1,221 @@
+import copy
+import datetime
+from sqlalchemy.orm import Session
+from database import Activity, UserChallenge, TrainingPlan, User
+from pmc_engine import sport_of
+from leaderboard import XpStore
+import logging
+
+logger = logging.getLogger(__name__)
+
+# FTP estimate from a ride's normalized power (a whole ride is at most the best 20', so this is conservative)
+NP_FTP_FACTOR = 0.95
+NP_FTP_MIN_DURATION = 20 # minutes
+
+PLAN_DAYS = {"Mon": 0, "Tue": 1, "Wed": 2, "Thu": 3, "Fri": 4, "Sat": 5, "Sun": 6}
+
+# Format: { metric: ChallengeRule instance }
+CHALLENGE_RULES = {}
+
+
+def register_rule(cls):
+    """Class decorator: adds an evaluator to CHALLENGE_RULES under its metric."""
+    CHALLENGE_RULES[cls.metric] = cls()
+    return cls
+
+
+class ChallengeRule:
+    """
+    Incremental evaluator for one challenge metric. Progress lives in a small JSON state per UserChallenge:
+    start() creates it, advance() folds in one activity inside the challenge window, value() reads progress.
+    """
+    metric = None
+
+    def start(self, ctx, uc):
+        return {"value": 0.0}
+
+    def advance(self, state, act, ctx):
+        pass
+
+    def value(self, state):
+        return float(state.get("value", 0.0))
+
+
+@register_rule
+class SessionsRule(ChallengeRule):
+    metric = "sessions"
+
+    def advance(self, state, act, ctx):
+        state["value"] = state.get("value", 0.0) + 1
+
+
+@register_rule
+class BikeDistanceRule(ChallengeRule):
+    metric = "distance_bike"
+
+    def advance(self, state, act, ctx):
+        if sport_of(act.get("type")) == "bike":
+            state["value"] = state.get("value", 0.0) + (act.get("distance_km") or 0)
+
+
+@register_rule
+class ComplianceRule(ChallengeRule):
+    """Share (%) of the planned minutes in the window covered by a same-sport activity on the planned day."""
+    metric = "compliance"
+
+    def start(self, ctx, uc):
+        planned = {d: p for d, p in ctx.planned_days().items() if uc.start_date <= d <= uc.end_date}
+        return {"planned": planned, "done": {}}
+
+    def advance(self, state, act, ctx):
+        date = act.get("date")
+        plan = state["planned"].get(date)
+        if plan and sport_of(act.get("type")) == plan["sport"]:
+            done = min(act.get("duration_min") or 0, plan["duration"])
+            state["done"][date] = max(state["done"].get(date, 0), done)
+
+    def value(self, state):
+        total = sum(p["duration"] for p in state["planned"].values())
+        return round(sum(state["done"].values()) / total * 100, 1) if total else 0.0
+
+
+@register_rule
+class FtpGainRule(ChallengeRule):
+    """Watts gained over the profile FTP at the start of the challenge, estimated from ride normalized power."""
+    metric = "power"
+
+    def start(self, ctx, uc):
+        return {"baseline": ctx.ftp(), "value": 0.0}
+
+    def advance(self, state, act, ctx):
+        np_watts = act.get("norm_power")
+        if not state.get("baseline") or not np_watts or sport_of(act.get("type")) != "bike":
+            return
+        if (act.get("duration_min") or 0) < NP_FTP_MIN_DURATION:
+            return
+        gain = np_watts * NP_FTP_FACTOR - state["baseline"]
+        state["value"] = max(state.get("value", 0.0), round(gain, 1))
+
+
+def planned_days(plan_weeks):
+    """{date: {'sport', 'duration'}} of the non-rest workouts of a plan's weeks."""
+    days = {}
+    for week in plan_weeks or []:
+        if not isinstance(week, dict) or "start_date" not in week: continue
+        try:
+            start = datetime.date.fromisoformat(week["start_date"])
+        except (TypeError, ValueError):
+            continue
+        for day_name, workout in (week.get("days") or {}).items():
+            if not isinstance(workout, dict) or workout.get("activity") == "Rest": continue
+            sport = (workout.get("sport_type") or "").lower()
+            duration = workout.get("duration") or 0
+            if sport in ("swim", "bike", "run") and duration > 0:
+                d = (start + datetime.timedelta(days=PLAN_DAYS.get(day_name, 0))).isoformat()
+                days[d] = {"sport": sport, "duration": duration}
+    return days
+
+
+class AthleteContext:
+    """Per-athlete data the evaluators may need, loaded at most once per evaluation pass."""
+
+    def __init__(self, db: Session, user_email: str):
+        self.db = db
+        self.user_email = user_email
+        self._planned = None
+        self._ftp = False
+
+    def planned_days(self):
+        if self._planned is None:
+            plan = self.db.query(TrainingPlan.plan_data).filter(
+                TrainingPlan.user_email == self.user_email,
+                TrainingPlan.is_active == 1
+            ).order_by(TrainingPlan.id.desc()).first()
+            self._planned = planned_days((plan[0] or {}).get("weeks") if plan else None)
+        return self._planned
+
+    def ftp(self):
+        if self._ftp is False:
+            row = self.db.query(User.ftp).filter(User.email == self.user_email).first()
+            self._ftp = row[0] if row else None
+        return self._ftp
+
+
+class ChallengeEngine:
+    """Advances every active challenge of an athlete from new activities in one pass, with one commit."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _active(self, user_email):
+        from challenge_logic import CHALLENGE_CATALOG
+        rows = self.db.query(UserChallenge).filter(
+            UserChallenge.user_email == user_email,
+            UserChallenge.status == "active"
+        ).all()
+        active = []
+        for uc in rows:
+            ch = CHALLENGE_CATALOG.get(self.db, uc.challenge_id)
+            rule = CHALLENGE_RULES.get(ch.metric) if ch else None
+            if rule:
+                active.append((uc, ch, rule))
+        return active
+
+    def _apply(self, user_email, active, activities, ctx, states):
+        """Folds activities into the given states, then writes values, completions and XP in one commit."""
+        for act in activities:
+            date = act.get("date") or ""
+            for uc, ch, rule in active:
+                if uc.start_date <= date <= uc.end_date:
+                    rule.advance(states[uc.id], act, ctx)
+
+        completed = []
+        for uc, ch, rule in active:
+            uc.state = states[uc.id] # New object, so the JSON column is flagged dirty
+            uc.current_value = rule.value(uc.state)
+            if uc.current_value >= ch.target_value:
+                uc.status = "completed"
+                completed.append(ch)
+                logger.info(f"Challenge COMPLETED for {user_email}: {ch.title}")
+        XpStore(self.db).award(user_email, completed)
+        self.db.commit()
+        return len(completed)
+
+    def _stored(self, user_email, active):
+        """Stored activities covering every active challenge window."""
+        rows = self.db.query(Activity.summary).filter(
+            Activity.user_email == user_email,
+            Activity.date >= min(uc.start_date for uc, _, _ in active),
+            Activity.date <= max(uc.end_date for uc, _, _ in active)
+        ).all()
+        return [row[0] for row in rows]
+
+    def on_activities(self, user_email: str, activities):
+        """
+        Incremental update for newly stored activities: O(new activities x active challenges).
+        Returns the number of challenges completed.
+        """
+        active = self._active(user_email)
+        if not active or not activities:
+            return 0
+        if any(uc.state is None for uc, _, _ in active):
+            # Assigned before the rule states existed: replay the stored window once (includes the new ones)
+            return self._recompute(user_email, active, self._stored(user_email, active))
+        ctx = AthleteContext(self.db, user_email)
+        states = {uc.id: copy.deepcopy(uc.state) for uc, ch, rule in active}
+        return self._apply(user_email, active, activities, ctx, states)
+
+    def _recompute(self, user_email, active, activities):
+        ctx = AthleteContext(self.db, user_email)
+        states = {uc.id: rule.start(ctx, uc) for uc, ch, rule in active}
+        return self._apply(user_email, active, activities, ctx, states)
+
+    def recompute(self, user_email: str, activities=None):
+        """
+        Restarts every active challenge from scratch over the given activities
+        (default: the athlete's stored activities in the challenge windows).
+        """
+        active = self._active(user_email)
+        if not active:
+            return 0
+        return self._recompute(user_email, active, self._stored(user_email, active) if activities is None else activities)
@@ -194,13 +194,17 @@ IMPORTANTE:
                 readiness_mod *= 1.05
                 reactive_note += f"🔥 Ottimo riposo ({sleep_score}). Sei pronto a spingere! "
             
-            # 2. HRV Impact (suppressed HRV)
-            if hrv and hrv < 40:
+            # 2. HRV Impact (suppressed HRV vs the athlete's own 4-week baseline when we have it)
+            hrv_baseline = health.get("hrv_baseline")
+            hrv_low = hrv < hrv_baseline * 0.9 if hrv and hrv_baseline else hrv and hrv < 40
+            if hrv_low:
                 readiness_mod *= 0.9
                 reactive_note += "📉 HRV sotto la media. Ridotta intensità di picco. "
             
             # 3. RHR Impact
-            if rhr and rhr > 65:
+            rhr_baseline = health.get("rhr_baseline")
+            rhr_high = rhr > rhr_baseline + 5 if rhr and rhr_baseline else rhr and rhr > 65
+            if rhr_high:
                 readiness_mod *= 0.95
                 reactive_note += "💓 FC a riposo elevata. Sessioni abbreviate. "
         
@@ -718,9 +722,12 @@ IMPORTANTE:
 
         return opinion
 
-    def analyze_executed_activities(self, planned_weeks: List[Dict[str, Any]], executed_activities: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def analyze_executed_activities(self, planned_weeks: List[Dict[str, Any]], executed_activities: List[Dict[str, Any]],
+                                    daily_rollups: List[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Compares planned workouts with executed activities and provides feedback.
+        With daily_rollups (RollupStore.daily rows) the executed duration of a planned day is the
+        day's total for the planned sport, so a session split in two still counts in full.
         """
         analysis = {
             "overall_compliance": 0,
@@ -736,6 +743,7 @@ IMPORTANTE:
             if date_str not in executed_map:
                 executed_map[date_str] = []
             executed_map[date_str].append(act)
+        rollup_map = {row["date"]: row for row in daily_rollups or []}
             
         # Flatten planned workouts into a map {date: {workout, week}}
         planned_map = {}
@@ -789,6 +797,8 @@ IMPORTANTE:
             
             if best_match:
                 exec_dur = best_match.get("duration_min", 0)
+                if date_str in rollup_map:
+                    exec_dur = rollup_map[date_str].get(f"{plan_sport}_duration_min") or exec_dur
                 total_executed_on_planned += min(exec_dur, planned_dur)
                 matched_executed_ids.add(best_match.get("activityId"))
                 
@@ -0,0 +1,76 @@
+import os
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# Execution model
+# ---------------
+# Request handlers in main.py are plain `def` functions, so FastAPI runs them on its
+# worker threadpool and a slow Garmin/LLM/DB call never blocks the asyncio event loop.
+# On top of that each blocking backend gets its own cap, so one backend cannot use up
+# the whole threadpool (e.g. Garmin hanging for 30s on every thread).
+
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "40")) # Threads available to sync handlers
+GARMIN_MAX_CONCURRENCY = int(os.getenv("GARMIN_MAX_CONCURRENCY", "8"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+GARMIN_FETCH_WORKERS = int(os.getenv("GARMIN_FETCH_WORKERS", "16")) # Fan-out pool for per-day/per-workout calls
+# DB concurrency is capped by the SQLAlchemy connection pool (see DB_POOL_SIZE in database.py)
+
+
+class ConcurrencyLimit:
+    """
+    Caps the number of threads inside one backend at the same time.
+    Re-entrant per thread, so a limited method calling another limited method
+    (e.g. get_health_metrics -> login) does not deadlock.
+    """
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+        self._local = threading.local()
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    def __enter__(self):
+        depth = getattr(self._local, "depth", 0)
+        if depth == 0:
+            self._slots.acquire()
+            with self._lock:
+                self._in_use += 1
+        self._local.depth = depth + 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+        return False
+
+    def __call__(self, fn):
+        """Use as a decorator on blocking methods."""
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self:
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+GARMIN_LIMIT = ConcurrencyLimit("garmin", GARMIN_MAX_CONCURRENCY)
+LLM_LIMIT = ConcurrencyLimit("llm", LLM_MAX_CONCURRENCY)
+
+# Bounded pool for fanning out independent Garmin calls inside one request.
+# Tasks submitted here must never wait on other tasks of the same pool.
+GARMIN_FETCH_POOL = ThreadPoolExecutor(max_workers=GARMIN_FETCH_WORKERS, thread_name_prefix="garmin-fetch")
+
+
+def configure_threadpool(size=THREADPOOL_SIZE):
+    """Sizes the threadpool FastAPI uses for sync handlers. Must run inside the event loop."""
+    import anyio.to_thread
+    anyio.to_thread.current_default_thread_limiter().total_tokens = size
@@ -1,17 +1,26 @@
-from sqlalchemy import Column, Integer, String, Float, JSON, create_engine
+from sqlalchemy import Column, Integer, BigInteger, String, Float, JSON, LargeBinary, UniqueConstraint, Index, create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, deferred
 
 import os
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./triathlon_coach_v6.db")
 
 connect_args = {}
+pool_args = {}
 if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
     connect_args = {"check_same_thread": False}
+else:
+    # Caps concurrent DB work from the handler threadpool (see concurrency.py)
+    pool_args = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_pre_ping": True
+    }
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args=connect_args
+    SQLALCHEMY_DATABASE_URL, connect_args=connect_args, **pool_args
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -48,6 +57,8 @@ class User(Base):
     habits = Column(JSON)
     pool_length = Column(Float, default=25.0)
     garmin_tokens = Column(JSON) # To store session tokens (bypassing login)
+    ctl_days = Column(Integer, default=42) # PMC fitness time constant
+    atl_days = Column(Integer, default=7) # PMC fatigue time constant
 
 class Challenge(Base):
     __tablename__ = "challenges"
@@ -64,6 +75,13 @@ class Challenge(Base):
 
 class UserChallenge(Base):
     __tablename__ = "user_challenges"
+    __table_args__ = (
+        Index("ix_user_challenges_user_status", "user_email", "status"), # Active challenges of an athlete
+        Index("ix_user_challenges_user_start", "user_email", "start_date"), # Latest challenges first
+        Index("ix_user_challenges_status_end", "status", "end_date"), # Nightly expiry
+        # One assignment per athlete, challenge and period, even with the job running in several workers
+        Index("uq_user_challenges_user_challenge_start", "user_email", "challenge_id", "start_date", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_email = Column(String, index=True)
@@ -73,9 +91,11 @@ class UserChallenge(Base):
     start_date = Column(String)
     end_date = Column(String)
     is_notified = Column(Integer, default=0) # Boolean if user saw the completion
+    state = Column(JSON) # Incremental evaluator state (see challenge_rules)
 
 class PerformanceHistory(Base):
     __tablename__ = "performance_history"
+    __table_args__ = (Index("ix_performance_history_user_recorded", "user_email", "recorded_at"),)
     
     id = Column(Integer, primary_key=True, index=True)
     user_email = Column(String, index=True)
@@ -85,6 +105,7 @@ class PerformanceHistory(Base):
 
 class ChatMessage(Base):
     __tablename__ = "chat_messages"
+    __table_args__ = (Index("ix_chat_messages_user_id", "user_email", "id"),) # Latest messages first
     
     id = Column(Integer, primary_key=True, index=True)
     user_email = Column(String, index=True)
@@ -95,6 +116,7 @@ class ChatMessage(Base):
 
 class TrainingPlan(Base):
     __tablename__ = "training_plans"
+    __table_args__ = (Index("ix_training_plans_user_active_id", "user_email", "is_active", "id"),) # Latest active plan
     
     id = Column(Integer, primary_key=True, index=True)
     user_email = Column(String, index=True)
@@ -102,9 +124,178 @@ class TrainingPlan(Base):
     created_at = Column(String)
     is_active = Column(Integer, default=1)
 
+class Activity(Base):
+    __tablename__ = "activities"
+    __table_args__ = (UniqueConstraint("user_email", "activity_id", name="uq_activities_user_activity"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True)
+    activity_id = Column(BigInteger) # Garmin activityId
+    start_time_local = Column(String) # 'YYYY-MM-DD HH:MM:SS' as returned by Garmin
+    date = Column(String, index=True) # YYYY-MM-DD
+    activity_type = Column(String) # Garmin typeKey (running, cycling, lap_swimming...)
+    summary = Column(JSON) # Processed activity dict (same shape as get_recent_activities)
+    synced_at = Column(String)
+
+class HealthDaily(Base):
+    __tablename__ = "health_daily"
+    __table_args__ = (UniqueConstraint("user_email", "date", name="uq_health_daily_user_date"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True)
+    date = Column(String, index=True) # YYYY-MM-DD
+    sleep_score = Column(Integer)
+    sleep_hours = Column(Float)
+    rhr = Column(Integer)
+    hrv = Column(Float)
+    body_battery = Column(Integer)
+    stress = Column(Integer)
+    is_final = Column(Integer, default=0) # 0 while the day can still change on Garmin (today)
+    fetched_at = Column(String)
+
+class RawPayload(Base):
+    __tablename__ = "raw_payloads"
+    __table_args__ = (UniqueConstraint("user_email", "kind", "source_key", name="uq_raw_payloads_user_kind_key"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True)
+    kind = Column(String) # 'activity', 'sleep', 'summary', 'hrv'
+    source_key = Column(String) # activityId for activities, YYYY-MM-DD for daily payloads
+    date = Column(String, index=True) # YYYY-MM-DD
+    codec = Column(String) # 'zlib' or 'zstd'
+    raw_size = Column(Integer) # Uncompressed JSON bytes
+    payload = deferred(Column(LargeBinary)) # Compressed JSON, only loaded when accessed
+    fetched_at = Column(String)
+
+class ActivityStream(Base):
+    __tablename__ = "activity_streams"
+    __table_args__ = (UniqueConstraint("user_email", "activity_id", name="uq_activity_streams_user_activity"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True)
+    activity_id = Column(BigInteger) # Garmin activityId
+    start_time = Column(String) # UTC ISO time of the first sample
+    n_samples = Column(Integer) # Seconds on the 1 Hz grid
+    columns = Column(JSON) # ['power', 'heart_rate', ...] stored as .npy files
+    path = Column(String) # Directory relative to ACTIVITY_STREAMS_DIR
+    source = Column(String) # 'garmin' or 'upload'
+    created_at = Column(String)
+
+class PowerCurve(Base):
+    __tablename__ = "power_curves"
+    __table_args__ = (UniqueConstraint("user_email", "kind", "scope", "activity_id", name="uq_power_curves_user_kind_scope_activity"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True)
+    kind = Column(String) # 'power' (W) or 'speed' (m/s, shown as pace)
+    scope = Column(String) # 'activity', 'all_time' or 'rolling_90'
+    activity_id = Column(BigInteger) # Only for scope 'activity'
+    date = Column(String, index=True) # Activity date (YYYY-MM-DD) for scope 'activity'
+    curve = Column(JSON) # {'durations': [...], 'values': [...], 'activity_ids': [...], 'dates': [...]}
+    updated_at = Column(String)
+
+class PmcDaily(Base):
+    __tablename__ = "pmc_daily"
+    __table_args__ = (UniqueConstraint("user_email", "date", name="uq_pmc_daily_user_date"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True)
+    date = Column(String, index=True) # YYYY-MM-DD
+    load = Column(Float) # Training load of the day
+    ctl = Column(Float) # Fitness
+    atl = Column(Float) # Fatigue
+    tsb = Column(Float) # Form
+    swim = Column(Float) # Volume minutes
+    bike = Column(Float)
+    run = Column(Float)
+    by_sport = Column(JSON) # {'swim': {'load', 'ctl', 'atl'}, 'bike': {...}, 'run': {...}}
+
+class DailyRollup(Base):
+    __tablename__ = "daily_rollup"
+    __table_args__ = (UniqueConstraint("user_email", "date", name="uq_daily_rollup_user_date"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True)
+    date = Column(String, index=True) # YYYY-MM-DD
+    sessions = Column(Integer, default=0)
+    duration_min = Column(Float, default=0.0)
+    distance_km = Column(Float, default=0.0)
+    load = Column(Float, default=0.0)
+    swim_sessions = Column(Integer, default=0)
+    swim_duration_min = Column(Float, default=0.0)
+    swim_distance_km = Column(Float, default=0.0)
+    bike_sessions = Column(Integer, default=0)
+    bike_duration_min = Column(Float, default=0.0)
+    bike_distance_km = Column(Float, default=0.0)
+    run_sessions = Column(Integer, default=0)
+    run_duration_min = Column(Float, default=0.0)
+    run_distance_km = Column(Float, default=0.0)
+
+class WeeklyRollup(Base):
+    __tablename__ = "weekly_rollup"
+    __table_args__ = (UniqueConstraint("user_email", "week_start", name="uq_weekly_rollup_user_week"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True)
+    week_start = Column(String, index=True) # Monday, YYYY-MM-DD
+    sessions = Column(Integer, default=0)
+    duration_min = Column(Float, default=0.0)
+    distance_km = Column(Float, default=0.0)
+    load = Column(Float, default=0.0)
+    swim_sessions = Column(Integer, default=0)
+    swim_duration_min = Column(Float, default=0.0)
+    swim_distance_km = Column(Float, default=0.0)
+    bike_sessions = Column(Integer, default=0)
+    bike_duration_min = Column(Float, default=0.0)
+    bike_distance_km = Column(Float, default=0.0)
+    run_sessions = Column(Integer, default=0)
+    run_duration_min = Column(Float, default=0.0)
+    run_distance_km = Column(Float, default=0.0)
+
+class AthleteXP(Base):
+    __tablename__ = "athlete_xp"
+    # (xp, id) orders the leaderboard and serves its keyset pagination
+    __table_args__ = (Index("ix_athlete_xp_xp_id", "xp", "id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, unique=True, index=True)
+    xp = Column(Integer, default=0)
+    completed = Column(Integer, default=0) # Completed challenges
+    badges = Column(JSON) # {badge_icon: times earned}
+    updated_at = Column(String)
+
+class WorkoutUpload(Base):
+    __tablename__ = "workout_uploads"
+    __table_args__ = (UniqueConstraint("user_email", "payload_hash", name="uq_workout_uploads_user_hash"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_email = Column(String, index=True)
+    payload_hash = Column(String) # sha256 of the canonical Garmin workout JSON
+    workout_id = Column(BigInteger) # Garmin workoutId
+    scheduled_dates = Column(JSON) # ['YYYY-MM-DD', ...] already on the Garmin calendar
+    created_at = Column(String)
+    updated_at = Column(String)
+
 Base.metadata.create_all(bind=engine)
 
 
+def create_missing_indexes(bind):
+    """create_all skips tables that already exist: adds the indexes declared on them since. Returns the names created."""
+    from sqlalchemy import inspect
+    inspector = inspect(bind)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda ix: ix.name):
+            if index.name not in existing:
+                print(f"MIGRATION: Creating index {index.name} on {table.name}...")
+                index.create(bind=bind)
+                created.append(index.name)
+    return created
+
+
 def migrate_db():
     """Simple migration tool to add missing columns without Alembic"""
     from sqlalchemy import inspect, text
@@ -135,7 +326,9 @@ def migrate_db():
         "availability": f"ALTER TABLE users ADD COLUMN availability {'JSON' if not SQLALCHEMY_DATABASE_URL.startswith('sqlite') else 'TEXT'}",
         "habits": f"ALTER TABLE users ADD COLUMN habits {'JSON' if not SQLALCHEMY_DATABASE_URL.startswith('sqlite') else 'TEXT'}",
         "pool_length": "ALTER TABLE users ADD COLUMN pool_length FLOAT DEFAULT 25.0",
-        "garmin_tokens": f"ALTER TABLE users ADD COLUMN garmin_tokens {'JSON' if not SQLALCHEMY_DATABASE_URL.startswith('sqlite') else 'TEXT'}"
+        "garmin_tokens": f"ALTER TABLE users ADD COLUMN garmin_tokens {'JSON' if not SQLALCHEMY_DATABASE_URL.startswith('sqlite') else 'TEXT'}",
+        "ctl_days": "ALTER TABLE users ADD COLUMN ctl_days INTEGER DEFAULT 42",
+        "atl_days": "ALTER TABLE users ADD COLUMN atl_days INTEGER DEFAULT 7"
     }
 
     with engine.connect() as conn:
@@ -147,9 +340,40 @@ def migrate_db():
                     conn.commit()
                 except Exception as e:
                     print(f"MIGRATION WARNING: Could not add {col_name}: {e}")
+
+        # user_challenges predates the evaluator state
+        uc_columns = [c['name'] for c in inspector.get_columns('user_challenges')] if inspector.has_table("user_challenges") else ["state"]
+        if "state" not in uc_columns:
+            print("MIGRATION: Adding missing column state to user_challenges table...")
+            conn.execute(text(f"ALTER TABLE user_challenges ADD COLUMN state {'JSON' if not SQLALCHEMY_DATABASE_URL.startswith('sqlite') else 'TEXT'}"))
+            conn.commit()
+
+        # pmc_daily predates the per-sport columns
+        if inspector.has_table("pmc_daily"):
+            pmc_columns = [c['name'] for c in inspector.get_columns('pmc_daily')]
+            if "by_sport" not in pmc_columns:
+                print("MIGRATION: Adding missing column by_sport to pmc_daily table...")
+                conn.execute(text(f"ALTER TABLE pmc_daily ADD COLUMN by_sport {'JSON' if not SQLALCHEMY_DATABASE_URL.startswith('sqlite') else 'TEXT'}"))
+                conn.commit()
         
+        # Duplicate assignments (before the unique index) would make its creation fail: keep the oldest
+        if inspector.has_table("user_challenges") and "uq_user_challenges_user_challenge_start" not in {
+                ix["name"] for ix in inspector.get_indexes("user_challenges")}:
+            conn.execute(text(
+                "DELETE FROM user_challenges WHERE id NOT IN "
+                "(SELECT MIN(id) FROM user_challenges GROUP BY user_email, challenge_id, start_date)"
+            ))
+            conn.commit()
+
+        # The leaderboard pages by (xp, id) now, not by email
+        if inspector.has_table("athlete_xp") and "ix_athlete_xp_xp_user" in {
+                ix["name"] for ix in inspector.get_indexes("athlete_xp")}:
+            conn.execute(text("DROP INDEX ix_athlete_xp_xp_user"))
+            conn.commit()
+
         # Ensure new tables are created as well
         Base.metadata.create_all(bind=engine)
+        create_missing_indexes(engine)
         print("MIGRATION: All tables verified/created.")
 
 def get_db():
@@ -0,0 +1,72 @@
+import numpy as np
+
+# Chart points returned when a caller asks for downsampling without a count
+DEFAULT_POINTS = 120
+BUCKETS = ("week", "month")
+
+
+def lttb(y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: indices of n_out points of y (x = day index) that keep the visual shape.
+    First and last points are always kept. Bucket averages come from one cumulative sum;
+    only the per-bucket triangle pick is sequential.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # n_out - 2 buckets over y[1:n-1]
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    c = np.concatenate(([0.0], np.cumsum(y)))
+    counts = np.maximum(edges[1:] - edges[:-1], 1)
+    avg_x = (edges[:-1] + edges[1:] - 1) / 2.0
+    avg_y = (c[edges[1:]] - c[edges[:-1]]) / counts
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        # Next bucket's average, or the last point for the final bucket
+        cx, cy = (avg_x[i + 1], avg_y[i + 1]) if i + 1 < n_out - 2 else (n - 1, y[-1])
+        xb = np.arange(lo, hi)
+        area = np.abs((a - cx) * (y[lo:hi] - y[a]) - (a - xb) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        selected[i + 1] = a
+    return selected
+
+
+def bucket_starts(first_day, n_days, period):
+    """Day offsets where each calendar week (Monday) or month starts, beginning with 0."""
+    days = np.datetime64(first_day, "D") + np.arange(n_days)
+    if period == "week":
+        # 1970-01-01 was a Thursday: shift so Monday starts a group
+        groups = (days.astype(np.int64) + 3) // 7
+    elif period == "month":
+        groups = days.astype("datetime64[M]").astype(np.int64)
+    else:
+        raise ValueError(f"Unknown bucket {period!r}, expected one of {BUCKETS}")
+    return np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+
+
+def downsample(ctl, atl, volume, first_day, points=None, bucket=None):
+    """
+    Reduces daily PMC arrays (ctl/atl [rows, days], volume [sports, days]) for long chart ranges.
+      bucket='week'|'month': one point per period, dated and valued at the period's last day (the range end
+      for the last, partial period), volume summed over the period.
+      points=N: N points chosen by LTTB on combined fitness; volume summed up to the next point.
+    Returns (ctl, atl, volume, offsets) where offsets are the kept columns' day offsets from first_day.
+    The last day is always kept, so 'current' values are unchanged.
+    """
+    n = ctl.shape[-1]
+    if bucket:
+        starts = bucket_starts(first_day, n, bucket)
+        ends = np.append(starts[1:], n) - 1
+        return ctl[:, ends], atl[:, ends], np.add.reduceat(volume, starts, axis=-1), ends
+
+    idx = lttb(ctl[0], points or DEFAULT_POINTS)
+    # Volume of the days between two kept points belongs to the later one
+    prev = np.concatenate(([0], idx[:-1] + 1))
+    sums = np.add.reduceat(volume, prev, axis=-1) if n else volume
+    return ctl[:, idx], atl[:, idx], sums, idx
@@ -0,0 +1,330 @@
+"""
+Local stand-in for the Garmin Connect endpoints used by GarminManager, for offline load tests.
+
+Run the server:
+    python fake_garmin.py --port 8765 --latency-ms 300 --jitter-ms 100 --error-rate 0.02 [--fixtures DIR]
+
+Point the backend at it (GarminManager then builds a FakeGarminClient instead of garminconnect.Garmin):
+    GARMIN_FAKE_URL=http://127.0.0.1:8765 uvicorn main:app
+
+Responses come from recorded JSON fixtures when present in the fixture dir
+(activities.json, sleep.json, user_summary.json, hrv.json, <connectapi path with / replaced by _>.json, <activity_id>.fit),
+otherwise from deterministic synthetic data seeded by athlete and date.
+GET /__stats returns the request counters per route.
+"""
+import os
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+import requests.adapters
+
+SPORTS = [
+    ("running", 8000, 14000), # typeKey, speed band in m/h used for the distance
+    ("cycling", 25000, 30000),
+    ("lap_swimming", 2500, 3000),
+    ("strength_training", 0, 0),
+]
+
+
+class FixtureStore:
+    """Recorded fixtures with a deterministic synthetic fallback."""
+
+    def __init__(self, fixture_dir=None, seed=42):
+        self.fixture_dir = fixture_dir
+        self.seed = seed
+        self._recorded = {}
+        self._next_workout_id = 900000000
+        self._lock = threading.Lock()
+
+    def _load(self, name):
+        if name not in self._recorded:
+            path = os.path.join(self.fixture_dir, f"{name}.json") if self.fixture_dir else None
+            self._recorded[name] = None
+            if path and os.path.exists(path):
+                with open(path) as f:
+                    self._recorded[name] = json.load(f)
+        return self._recorded[name]
+
+    def _rng(self, *parts):
+        return random.Random(":".join([str(self.seed)] + [str(p) for p in parts]))
+
+    def activities(self, athlete, start, end):
+        recorded = self._load("activities")
+        if recorded is not None:
+            return [a for a in recorded if start <= (a.get("startTimeLocal") or "")[:10] <= end]
+
+        acts = []
+        day = datetime.date.fromisoformat(end)
+        first = datetime.date.fromisoformat(start)
+        while day >= first:
+            rng = self._rng(athlete, day)
+            for i in range(rng.choice([0, 1, 1, 2])):
+                sport, lo, hi = rng.choice(SPORTS)
+                duration = rng.randint(30, 120) * 60
+                acts.append({
+                    "activityId": int(day.strftime("%Y%m%d")) * 10 + i,
+                    "activityName": f"Synthetic {sport}",
+                    "activityType": {"typeKey": sport},
+                    "startTimeLocal": f"{day.isoformat()} {6 + 5 * i:02d}:00:00",
+                    "duration": float(duration),
+                    "distance": float(duration / 3600.0 * rng.randint(lo, hi)) if hi else 0.0,
+                    "averageHR": float(rng.randint(120, 160)),
+                    "maxHR": float(rng.randint(165, 185)),
+                    "averagePower": float(rng.randint(150, 230)) if sport == "cycling" else None,
+                    "trainingLoad": float(rng.randint(30, 180)),
+                    "calories": float(duration / 60 * 10),
+                })
+            day -= datetime.timedelta(days=1)
+        return acts
+
+    def sleep(self, athlete, date):
+        recorded = self._load("sleep")
+        if recorded is not None:
+            return recorded
+        rng = self._rng(athlete, "sleep", date)
+        return {"dailySleepDTO": {"calendarDate": date, "sleepTimeSeconds": rng.randint(5, 9) * 3600,
+                                  "sleepScores": {"overall": {"value": rng.randint(45, 95)}}}}
+
+    def user_summary(self, athlete, date):
+        recorded = self._load("user_summary")
+        if recorded is not None:
+            return recorded
+        rng = self._rng(athlete, "summary", date)
+        return {"calendarDate": date, "restingHeartRate": rng.randint(42, 60),
+                "bodyBatteryMostRecentValue": rng.randint(20, 100), "averageStressLevel": rng.randint(10, 60),
+                "hrvStatus": {}}
+
+    def hrv(self, athlete, date):
+        recorded = self._load("hrv")
+        if recorded is not None:
+            return recorded
+        return {"hrvSummary": {"calendarDate": date, "lastNightAvg": self._rng(athlete, "hrv", date).randint(35, 90)}}
+
+    def connectapi(self, path):
+        recorded = self._load(path.strip("/").replace("/", "_"))
+        if recorded is not None:
+            return recorded
+        if path.endswith("user-settings"):
+            return {"userData": {"functionalThresholdPower": 230, "lactateThresholdSpeed": 0.34}}
+        return {}
+
+    def activity_fit(self, athlete, activity_id):
+        """Zipped FIT file like Garmin's ORIGINAL download (recorded <activity_id>.fit or a synthetic 1 Hz ride)."""
+        import io
+        import zipfile
+        from fit_ingest import write_fit
+
+        path = os.path.join(self.fixture_dir, f"{activity_id}.fit") if self.fixture_dir else None
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                fit = f.read()
+        else:
+            rng = self._rng(athlete, "fit", activity_id)
+            n = rng.randint(45, 180) * 60
+            fit = write_fit(
+                time.time() - n,
+                power=[rng.randint(120, 320) for _ in range(n)],
+                heart_rate=[rng.randint(110, 170) for _ in range(n)],
+                cadence=[rng.randint(75, 100) for _ in range(n)],
+                speed=[rng.uniform(7.0, 12.0) for _ in range(n)],
+                altitude=[100 + 20 * ((i // 600) % 3) for i in range(n)],
+            )
+        out = io.BytesIO()
+        with zipfile.ZipFile(out, "w") as zf:
+            zf.writestr(f"{activity_id}_ACTIVITY.fit", fit)
+        return out.getvalue()
+
+    def new_workout_id(self):
+        with self._lock:
+            self._next_workout_id += 1
+            return self._next_workout_id
+
+
+class FakeGarminServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=8765, latency_ms=0, jitter_ms=0, error_rate=0.0, fixture_dir=None, seed=42):
+        super().__init__(("127.0.0.1", port), FakeGarminHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.fixtures = FixtureStore(fixture_dir, seed)
+        self.rng = random.Random(seed)
+        self.stats = {}
+        self.stats_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start_in_thread(self):
+        threading.Thread(target=self.serve_forever, name="fake-garmin", daemon=True).start()
+        return self
+
+
+class FakeGarminHandler(BaseHTTPRequestHandler):
+    """Routes mirror the Garmin Connect API paths called by garminconnect."""
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, method):
+        server = self.server
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        path = url.path.strip("/")
+        athlete = self.headers.get("X-Fake-Athlete", "athlete")
+        route = path.split("/")[0]
+
+        if path == "__stats":
+            return self._send(200, server.stats)
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or "null")
+        with server.stats_lock:
+            server.stats[route] = server.stats.get(route, 0) + 1
+            error_status = server.rng.choice([429, 500, 503]) if server.rng.random() < server.error_rate else None
+            delay = max(0, server.latency_ms + server.rng.uniform(-server.jitter_ms, server.jitter_ms)) / 1000.0
+
+        time.sleep(delay)
+        if error_status:
+            return self._send(error_status, {"message": "injected error"})
+
+        fx = server.fixtures
+        if path == "auth/login":
+            return self._send(200, {"displayName": athlete.split("@")[0], "access_token": "fake", "expires_in": 3600})
+        if path.startswith("activitylist-service/activities/search/activities"):
+            return self._send(200, fx.activities(athlete, query["startDate"], query["endDate"]))
+        if path.startswith("wellness-service/wellness/dailySleepData"):
+            return self._send(200, fx.sleep(athlete, query["date"]))
+        if path.startswith("usersummary-service/usersummary/daily"):
+            return self._send(200, fx.user_summary(athlete, query["calendarDate"]))
+        if path.startswith("hrv-service/hrv/"):
+            return self._send(200, fx.hrv(athlete, path.rsplit("/", 1)[1]))
+        if path.startswith("download-service/files/activity/"):
+            return self._send(200, fx.activity_fit(athlete, path.rsplit("/", 1)[1]), "application/zip")
+        if path == "workout-service/workout" and method == "POST":
+            return self._send(200, dict(body or {}, workoutId=fx.new_workout_id()))
+        if path.startswith("workout-service/schedule/") and method == "POST":
+            return self._send(200, {"workoutScheduleId": fx.new_workout_id(), "calendarDate": (body or {}).get("date")})
+        return self._send(200, fx.connectapi(path))
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+
+class _FakeToken:
+    def __init__(self, expires_at):
+        self.expires_at = expires_at
+
+
+class _FakeGarth:
+    """Token handling surface of garth used by GarminManager and the session pool."""
+
+    def __init__(self, client):
+        self.client = client
+        self.oauth2_token = None
+
+    def loads(self, tokens):
+        data = json.loads(tokens)
+        self.oauth2_token = _FakeToken(data["expires_at"])
+        self.client.display_name = data["display_name"]
+
+    def dumps(self):
+        if not self.oauth2_token:
+            return None
+        return json.dumps({"expires_at": self.oauth2_token.expires_at, "display_name": self.client.display_name})
+
+    def refresh_oauth2(self):
+        self.client.login()
+
+
+class FakeGarminClient:
+    """Drop-in for garminconnect.Garmin that talks to a FakeGarminServer."""
+
+    def __init__(self, email, password, base_url="http://127.0.0.1:8765"):
+        self.email = email
+        self.password = password
+        self.base_url = base_url.rstrip("/")
+        self.display_name = None
+        self.garth = _FakeGarth(self)
+        self._http = requests.Session()
+        # One client is shared by the fan-out pool threads
+        self._http.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=32))
+        self._http.headers["X-Fake-Athlete"] = email
+
+    def connectapi(self, path, method="GET", json=None, params=None):
+        r = self._http.request(method, f"{self.base_url}/{path.lstrip('/')}", json=json, params=params, timeout=30)
+        r.raise_for_status()
+        return r.json()
+
+    def login(self):
+        data = self.connectapi("auth/login", method="POST", json={"email": self.email})
+        self.display_name = data["displayName"]
+        self.garth.oauth2_token = _FakeToken(time.time() + data["expires_in"])
+        return True
+
+    def get_activities_by_date(self, startdate, enddate, activitytype=None):
+        return self.connectapi("activitylist-service/activities/search/activities",
+                               params={"startDate": startdate, "endDate": enddate, "start": 0, "limit": 1000})
+
+    def get_sleep_data(self, cdate):
+        return self.connectapi(f"wellness-service/wellness/dailySleepData/{self.display_name}", params={"date": cdate})
+
+    def get_user_summary(self, cdate):
+        return self.connectapi(f"usersummary-service/usersummary/daily/{self.display_name}", params={"calendarDate": cdate})
+
+    def get_hrv_data(self, cdate):
+        return self.connectapi(f"hrv-service/hrv/{cdate}")
+
+    def get_user_profile(self):
+        return self.connectapi("userprofile-service/userprofile/user-settings")
+
+    def get_social_profile(self):
+        return {"userName": self.display_name}
+
+    def get_training_status(self, cdate):
+        return self.connectapi(f"metrics-service/metrics/trainingstatus/aggregated/{cdate}")
+
+    def download_activity(self, activity_id, dl_fmt=None):
+        r = self._http.get(f"{self.base_url}/download-service/files/activity/{activity_id}", timeout=60)
+        r.raise_for_status()
+        return r.content
+
+    def upload_workout(self, workout_json):
+        return self.connectapi("workout-service/workout", method="POST", json=workout_json)
+
+    def schedule_workout(self, workout_id, cdate):
+        return self.connectapi(f"workout-service/schedule/{workout_id}", method="POST", json={"date": cdate})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Garmin Connect server for offline load tests")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--fixtures", default=None, help="Directory with recorded JSON fixtures")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    server = FakeGarminServer(args.port, args.latency_ms, args.jitter_ms, args.error_rate, args.fixtures, args.seed)
+    print(f"Fake Garmin Connect listening on {server.url} (latency {args.latency_ms}±{args.jitter_ms} ms, errors {args.error_rate:.0%})")
+    server.serve_forever()
@@ -0,0 +1,344 @@
+import io
+import os
+import struct
+import zipfile
+import hashlib
+import datetime
+import logging
+from array import array
+
+import numpy as np
+from sqlalchemy.orm import Session
+from database import ActivityStream
+
+logger = logging.getLogger(__name__)
+
+# Per-activity column files live under STREAMS_DIR/<athlete>/<activity_id>/<column>.npy
+STREAMS_DIR = os.getenv("ACTIVITY_STREAMS_DIR", "./activity_streams")
+# Longer recordings are truncated (protects the 1 Hz grid from corrupt timestamps)
+MAX_STREAM_SECONDS = 48 * 3600
+
+FIT_EPOCH = 631065600 # 1989-12-31T00:00:00Z in unix seconds
+RECORD_MESG = 20
+
+# Record message fields we decode: field number -> (name, struct code, invalid value)
+RECORD_FIELDS = {
+    253: ("timestamp", "I", 0xFFFFFFFF),
+    3: ("heart_rate", "B", 0xFF),
+    4: ("cadence", "B", 0xFF),
+    7: ("power", "H", 0xFFFF),
+    6: ("speed", "H", 0xFFFF), # m/s * 1000
+    73: ("enhanced_speed", "I", 0xFFFFFFFF),
+    5: ("distance", "I", 0xFFFFFFFF), # m * 100
+    2: ("altitude", "H", 0xFFFF), # (m + 500) * 5
+    78: ("enhanced_altitude", "I", 0xFFFFFFFF),
+}
+TIMESTAMP_FIELD = 253
+INVALID = {name: invalid for name, _, invalid in RECORD_FIELDS.values()}
+
+# Stored columns and their on-disk dtype
+STREAM_COLUMNS = {
+    "power": np.uint16,
+    "heart_rate": np.uint8,
+    "cadence": np.uint8,
+    "speed": np.float32,
+    "distance": np.float32,
+    "altitude": np.float32,
+}
+
+
+class FitError(ValueError):
+    pass
+
+
+def _make_plan(global_num, fields, endian, dev_size):
+    """
+    Precompiles how to read one local message type: a single Struct that unpacks only
+    the fields we need (timestamps everywhere, sensor fields in record messages) and skips the rest.
+    """
+    fmt = [endian]
+    names = []
+    size = 0
+    for num, fsize, _ in fields:
+        spec = RECORD_FIELDS.get(num) if global_num == RECORD_MESG or num == TIMESTAMP_FIELD else None
+        if spec and struct.calcsize("<" + spec[1]) == fsize:
+            fmt.append(spec[1])
+            names.append(spec[0])
+        else:
+            fmt.append(f"{fsize}x")
+        size += fsize
+    fmt.append(f"{dev_size}x")
+    size += dev_size
+    st = struct.Struct("".join(fmt)) if names else None
+    ts_idx = names.index("timestamp") if "timestamp" in names else -1
+    return global_num, st, size, ts_idx, tuple(names)
+
+
+def decode_fit(data):
+    """
+    Streams the messages of a FIT file and returns (start unix time, {column: 1 Hz numpy array}).
+    Record messages are unpacked straight into tuples grouped by message layout; no per-record dicts.
+    """
+    buf = memoryview(data)
+    if len(buf) < 12 or bytes(buf[8:12]) != b".FIT":
+        raise FitError("Not a FIT file")
+    header_size = buf[0]
+    end = min(header_size + int.from_bytes(buf[4:8], "little"), len(buf))
+
+    plans = {}
+    blocks = {} # Format: { plan: (array of timestamps, [unpacked tuples]) }
+    last_ts = 0
+    pos = header_size
+    while pos < end:
+        h = buf[pos]
+        pos += 1
+        if h & 0x80:
+            # Compressed timestamp header: 5-bit offset from the last full timestamp
+            offset = h & 0x1F
+            ts = (last_ts & ~0x1F) + offset
+            if offset < (last_ts & 0x1F):
+                ts += 0x20
+            last_ts = ts
+            plan = plans[(h >> 5) & 0x03]
+        elif h & 0x40:
+            arch = buf[pos + 1]
+            global_num = int.from_bytes(buf[pos + 2:pos + 4], "big" if arch else "little")
+            n_fields = buf[pos + 4]
+            pos += 5
+            fields = [(buf[pos + 3 * i], buf[pos + 3 * i + 1], buf[pos + 3 * i + 2]) for i in range(n_fields)]
+            pos += 3 * n_fields
+            dev_size = 0
+            if h & 0x20:
+                n_dev = buf[pos]
+                pos += 1
+                dev_size = sum(buf[pos + 3 * i + 1] for i in range(n_dev))
+                pos += 3 * n_dev
+            plans[h & 0x0F] = _make_plan(global_num, fields, ">" if arch else "<", dev_size)
+            continue
+        else:
+            plan = plans.get(h & 0x0F)
+            if plan is None:
+                raise FitError(f"Data message for undefined local type {h & 0x0F}")
+            ts = None
+
+        global_num, st, size, ts_idx, _ = plan
+        if st is not None:
+            values = st.unpack_from(buf, pos)
+            if ts is None and ts_idx >= 0 and values[ts_idx] != 0xFFFFFFFF:
+                last_ts = values[ts_idx]
+            if global_num == RECORD_MESG:
+                block = blocks.get(plan)
+                if block is None:
+                    block = blocks[plan] = (array("I"), [])
+                block[0].append(last_ts)
+                block[1].append(values)
+        pos += size
+
+    return _to_columns(blocks)
+
+
+def _field(names, matrix, name):
+    """Column of a decoded block as float64 with invalid values as NaN, or None if the layout lacks it."""
+    if name not in names:
+        return None
+    col = matrix[:, names.index(name)].copy()
+    col[col == INVALID[name]] = np.nan
+    return col
+
+
+def _to_columns(blocks):
+    """Places decoded record blocks on a 1 Hz grid starting at the first record."""
+    if not blocks:
+        return None, {}
+    t0 = min(ts[0] for ts, _ in blocks.values())
+    parts = {name: [] for name in STREAM_COLUMNS}
+    offsets = []
+    for (_, _, _, _, names), (ts, rows) in blocks.items():
+        matrix = np.array(rows, dtype=np.float64)
+        offsets.append(np.frombuffer(ts, dtype=np.uint32).astype(np.int64) - t0)
+        raw = {
+            "power": _field(names, matrix, "power"),
+            "heart_rate": _field(names, matrix, "heart_rate"),
+            "cadence": _field(names, matrix, "cadence"),
+            "speed": _pick(_field(names, matrix, "enhanced_speed"), _field(names, matrix, "speed"), 1000.0),
+            "distance": _scale(_field(names, matrix, "distance"), 100.0),
+            "altitude": _pick(_field(names, matrix, "enhanced_altitude"), _field(names, matrix, "altitude"), 5.0, 500.0),
+        }
+        for name in STREAM_COLUMNS:
+            parts[name].append(raw[name] if raw[name] is not None else np.full(len(ts), np.nan))
+
+    t = np.concatenate(offsets)
+    keep = (t >= 0) & (t < MAX_STREAM_SECONDS)
+    t = t[keep]
+    n = int(t.max()) + 1 if len(t) else 0
+
+    columns = {}
+    for name, dtype in STREAM_COLUMNS.items():
+        values = np.concatenate(parts[name])[keep]
+        if np.isnan(values).all():
+            continue
+        grid = np.full(n, np.nan)
+        grid[t] = values
+        if name in ("distance", "altitude"):
+            grid = _ffill(grid)
+        columns[name] = np.nan_to_num(grid, nan=0.0).astype(dtype)
+    return t0 + FIT_EPOCH, columns
+
+
+def _scale(col, scale, offset=0.0):
+    return None if col is None else col / scale - offset
+
+
+def _pick(enhanced, plain, scale, offset=0.0):
+    """Enhanced (32-bit) fields win over the 16-bit ones where present."""
+    if enhanced is None:
+        return _scale(plain, scale, offset)
+    if plain is not None:
+        enhanced = np.where(np.isnan(enhanced), plain, enhanced)
+    return _scale(enhanced, scale, offset)
+
+
+def _ffill(values):
+    idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    return values[idx]
+
+
+def extract_fit(data):
+    """Garmin's ORIGINAL download is a zip holding the .fit; plain FIT bytes pass through."""
+    if data[:2] == b"PK":
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            name = next(n for n in zf.namelist() if n.lower().endswith(".fit"))
+            return zf.read(name)
+    return data
+
+
+def _crc16(data, crc=0):
+    table = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+             0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
+    for byte in data:
+        tmp = table[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ table[byte & 0xF]
+        tmp = table[crc & 0xF]
+        crc = (crc >> 4) & 0x0FFF
+        crc = crc ^ tmp ^ table[(byte >> 4) & 0xF]
+    return crc
+
+
+def write_fit(start_time, power=None, heart_rate=None, cadence=None, speed=None, altitude=None):
+    """
+    Minimal FIT activity writer (file_id + 1 Hz record messages) used by the fake Garmin server,
+    tests and benchmarks. Sample lists are per second; None entries are written as invalid.
+    """
+    n = max(len(c) for c in (power, heart_rate, cadence, speed, altitude) if c is not None)
+    ts0 = int(start_time) - FIT_EPOCH
+    body = bytearray()
+    # file_id: type (field 0, enum) = 4 (activity)
+    body += bytes([0x40, 0, 0]) + struct.pack("<HB", 0, 1) + bytes([0, 1, 0x00])
+    body += bytes([0x00, 4])
+    # record definition (local 0): timestamp, power, heart_rate, cadence, enhanced_speed, distance, enhanced_altitude
+    layout = [(253, 4, 0x86), (7, 2, 0x84), (3, 1, 0x02), (4, 1, 0x02), (73, 4, 0x86), (5, 4, 0x86), (78, 4, 0x86)]
+    body += bytes([0x40, 0, 0]) + struct.pack("<HB", RECORD_MESG, len(layout))
+    for num, size, base in layout:
+        body += bytes([num, size, base])
+
+    rec = struct.Struct("<BIHBBIII")
+    dist = 0.0
+    for i in range(n):
+        def val(col, scale=1.0, offset=0.0, invalid=0xFFFFFFFF):
+            v = col[i] if col is not None and i < len(col) else None
+            return invalid if v is None else int(round((v + offset) * scale))
+        spd = speed[i] if speed is not None and i < len(speed) and speed[i] is not None else 0.0
+        dist += spd
+        body += rec.pack(0x00, ts0 + i, val(power, invalid=0xFFFF), val(heart_rate, invalid=0xFF),
+                         val(cadence, invalid=0xFF), val(speed, 1000.0), int(round(dist * 100)),
+                         val(altitude, 5.0, 500.0))
+
+    header = struct.pack("<BBHI4s", 14, 0x20, 2132, len(body), b".FIT")
+    header += struct.pack("<H", _crc16(header))
+    data = header + bytes(body)
+    return data + struct.pack("<H", _crc16(data))
+
+
+def _athlete_dir(user_email):
+    return hashlib.sha1(user_email.encode()).hexdigest()[:16]
+
+
+class StreamStore:
+    """Per-second activity streams as memory-mappable .npy column files, indexed by the activity_streams table."""
+
+    def __init__(self, db: Session, base_dir=None):
+        self.db = db
+        self.base_dir = base_dir or STREAMS_DIR
+
+    def _row(self, user_email, activity_id):
+        return self.db.query(ActivityStream).filter(
+            ActivityStream.user_email == user_email,
+            ActivityStream.activity_id == activity_id
+        ).first()
+
+    def has(self, user_email: str, activity_id: int) -> bool:
+        return self._row(user_email, activity_id) is not None
+
+    def ingest(self, user_email: str, activity_id: int, fit_bytes, source="garmin"):
+        """Decodes a FIT file and writes one .npy per column. Returns the ActivityStream row."""
+        start_time, columns = decode_fit(extract_fit(fit_bytes))
+        if not columns:
+            raise FitError("FIT file has no record samples")
+
+        rel_dir = os.path.join(_athlete_dir(user_email), str(activity_id))
+        out_dir = os.path.join(self.base_dir, rel_dir)
+        os.makedirs(out_dir, exist_ok=True)
+        for name, values in columns.items():
+            np.save(os.path.join(out_dir, f"{name}.npy"), values)
+
+        row = self._row(user_email, activity_id)
+        if row is None:
+            row = ActivityStream(user_email=user_email, activity_id=activity_id)
+            self.db.add(row)
+        row.start_time = datetime.datetime.fromtimestamp(start_time, datetime.timezone.utc).isoformat()
+        row.n_samples = len(next(iter(columns.values())))
+        row.columns = sorted(columns)
+        row.path = rel_dir
+        row.source = source
+        row.created_at = datetime.datetime.now().isoformat()
+        self.db.commit()
+        logger.info(f"Ingested FIT for activity {activity_id}: {row.n_samples}s, columns {row.columns}")
+
+        # Merge the new best efforts into the athlete's power/pace curves
+        from power_curve import CurveStore, activity_type_of
+        CurveStore(self.db).add_activity(user_email, activity_id, row.start_time[:10], columns,
+                                         activity_type_of(self.db, user_email, activity_id))
+        return row
+
+    def refresh_curves(self, user_email: str, activity_id: int, activity_type):
+        """
+        Merges a stored stream into the curves once its activity type is known (the FIT may have been
+        uploaded before the activity was synced). Returns the curve kinds written.
+        """
+        row = self._row(user_email, activity_id)
+        if row is None:
+            return []
+        from power_curve import CurveStore
+        return CurveStore(self.db).add_activity(user_email, activity_id, row.start_time[:10],
+                                                self.load(user_email, activity_id), activity_type)
+
+    def load(self, user_email: str, activity_id: int, columns=None):
+        """{column: read-only memory-mapped array}, or None if the activity has no stream."""
+        row = self._row(user_email, activity_id)
+        if row is None:
+            return None
+        names = [c for c in (columns or row.columns) if c in row.columns]
+        base = os.path.join(self.base_dir, row.path)
+        return {name: np.load(os.path.join(base, f"{name}.npy"), mmap_mode="r") for name in names}
+
+    def ensure(self, gm, activity_id: int):
+        """Downloads and ingests the original FIT from Garmin if we do not have the stream yet."""
+        if self.has(gm.email, activity_id):
+            return True
+        fit = gm.download_fit(activity_id)
+        if not fit:
+            return False
+        self.ingest(gm.email, activity_id, fit)
+        return True
@@ -1,17 +1,343 @@
+import os
 import logging
-from garminconnect import Garmin
+from garminconnect import Garmin, GarminConnectAuthenticationError, GarminConnectNotFoundError
 import datetime
-import re
+import threading
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
 from encryption import decrypt_password
+from concurrency import GARMIN_LIMIT, GARMIN_FETCH_POOL
+from workout_upload_cache import payload_hash
+from workout_compiler import build_workout_payload
+from metrics_cache import METRICS_CACHE
+from pmc_engine import compute_training_stats
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Module-level cache for Garmin metrics to avoid redundant API calls within short windows
-# Format: { email: { 'timestamp': dt, 'health': ..., 'activities': ... } }
-GARMIN_METRICS_CACHE = {}
-CACHE_TTL_MINUTES = 5
+# Session pool settings
+SESSION_TTL_MINUTES = 55 # Fallback lifetime when the OAuth2 token does not expose its expiry
+SESSION_REFRESH_MARGIN_SECONDS = 300 # Refresh tokens that expire within this margin
+SESSION_REFRESH_INTERVAL_SECONDS = 60 # How often the background refresher wakes up
+
+# Max workouts uploaded/scheduled in parallel by a single calendar sync
+CALENDAR_SYNC_MAX_PARALLEL = 4
+
+# Base URL of a fake_garmin.py server to use instead of Garmin Connect (offline load tests)
+GARMIN_FAKE_URL = os.getenv("GARMIN_FAKE_URL")
+
+
+def new_garmin_client(email, password):
+    """garminconnect client, or the offline stand-in when GARMIN_FAKE_URL is set."""
+    if GARMIN_FAKE_URL:
+        from fake_garmin import FakeGarminClient
+        return FakeGarminClient(email, password, base_url=GARMIN_FAKE_URL)
+    return Garmin(email, password)
+
+
+class GarminSessionPool:
+    """
+    Process-wide pool of authenticated Garmin clients keyed by athlete email.
+    Clients are lent out to requests so that only the first request of a session
+    pays for the login (and the token verification round trip).
+    """
+
+    def __init__(self, refresh_interval=SESSION_REFRESH_INTERVAL_SECONDS):
+        # Format: { email: { 'client': Garmin, 'expires_at': epoch_secs, 'last_used': epoch_secs } }
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stop = threading.Event()
+        self.refresh_interval = refresh_interval
+
+    @staticmethod
+    def _token_expiry(client):
+        """Reads the OAuth2 expiry from the garth session, falling back to a fixed TTL."""
+        try:
+            token = client.garth.oauth2_token
+            if token and getattr(token, "expires_at", None):
+                return float(token.expires_at)
+        except Exception:
+            pass
+        return time.time() + SESSION_TTL_MINUTES * 60
+
+    def borrow(self, email):
+        """Returns a live client for the athlete, or None if a login is needed."""
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(email)
+            if not entry:
+                return None
+            if entry["expires_at"] <= now:
+                # Expired and the refresher did not manage to renew it in time
+                del self._sessions[email]
+                return None
+            entry["last_used"] = now
+            return entry["client"]
+
+    def put(self, email, client):
+        with self._lock:
+            self._sessions[email] = {
+                "client": client,
+                "expires_at": self._token_expiry(client),
+                "last_used": time.time()
+            }
+
+    def invalidate(self, email):
+        with self._lock:
+            self._sessions.pop(email, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def refresh_expiring(self):
+        """Renews the tokens of every pooled session close to expiry. Failed renewals are dropped."""
+        deadline = time.time() + SESSION_REFRESH_MARGIN_SECONDS
+        with self._lock:
+            expiring = [(email, e["client"]) for email, e in self._sessions.items() if e["expires_at"] <= deadline]
+
+        for email, client in expiring:
+            try:
+                client.garth.refresh_oauth2()
+                self.put(email, client)
+                print(f"DEBUG: Refreshed pooled Garmin session for {email}")
+            except Exception as e:
+                logger.warning(f"Could not refresh Garmin session for {email}: {e}")
+                self.invalidate(email)
+
+    def start_background_refresh(self):
+        """Starts the daemon thread that keeps pooled sessions alive. Safe to call more than once."""
+        if self._refresher and self._refresher.is_alive():
+            return
+        self._stop.clear()
+
+        def _loop():
+            while not self._stop.wait(self.refresh_interval):
+                try:
+                    self.refresh_expiring()
+                except Exception as e:
+                    logger.error(f"Garmin session refresher error: {e}")
+
+        self._refresher = threading.Thread(target=_loop, name="garmin-session-refresh", daemon=True)
+        self._refresher.start()
+
+    def stop_background_refresh(self):
+        self._stop.set()
+
+
+SESSION_POOL = GarminSessionPool()
+
+
+def is_auth_error(e):
+    """True if Garmin rejected the session (revoked or expired token) rather than failing transiently."""
+    if isinstance(e, GarminConnectAuthenticationError):
+        return True
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status == 401
+
+
+def is_not_found_error(e):
+    """True if Garmin answered that the requested object (e.g. an activity id) does not exist."""
+    if isinstance(e, GarminConnectNotFoundError):
+        return True
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    return status == 404
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the function,
+    the others wait for it and get the same result (or exception).
+    Keys are (athlete email, data kind, window), e.g. (email, "activities", ("2024-01-01", "2024-01-31")).
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            print(f"DEBUG: Joining in-flight Garmin fetch {key}")
+            call.done.wait()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+SINGLE_FLIGHT = SingleFlight()
+
+
+def summarize_activity(act):
+    """Reduces a raw Garmin activity dict to the fields used by the coach, dashboard and challenges."""
+    # Basic info
+    start_time = act.get('startTimeLocal', '')
+    date_str = start_time.split(' ')[0]
+
+    # Advanced Power Logic (Garmin stores power in various places)
+    avg_pwr = act.get('averagePower')
+    max_pwr = act.get('maxPower')
+    norm_pwr = act.get('normPower') or act.get('weightedAveragePower')
+
+    return {
+        "activityId": act.get('activityId'),
+        "name": act.get('activityName'),
+        "type": act.get('activityType', {}).get('typeKey'),
+        "date": date_str,
+        "start_time": start_time,
+        "duration_min": round((act.get('duration', 0) or act.get('elapsedDuration', 0)) / 60.0, 1),
+        "distance_km": round((act.get('distance', 0) or 0) / 1000.0, 2),
+
+        # Heart Rate
+        "avg_hr": act.get('averageHR'),
+        "max_hr": act.get('maxHR'),
+
+        # Power & Load
+        "avg_power": avg_pwr,
+        "max_power": max_pwr,
+        "norm_power": norm_pwr,
+        "pss": act.get('trainingStressScore'), # TSS
+        "if": act.get('intensityFactor'),
+        "training_load": act.get('trainingLoad'),
+
+        # Speed & Pace
+        "avg_speed": act.get('averageSpeed'), # m/s
+        "max_speed": act.get('maxSpeed'),
+
+        # Cycling Specific
+        "avg_cadence": act.get('averageBikingCadenceInRevPerMinute'),
+
+        # Running Specific
+        "avg_run_cadence": act.get('averageRunningCadenceInStepsPerMinute'),
+        "avg_stride_len": act.get('avgStrideLength'),
+        "vertical_osc": act.get('avgVerticalOscillation'),
+        "gct": act.get('avgGroundContactTime'),
+
+        # Swim Specific
+        "avg_swolf": act.get('averageSwolf'),
+        "avg_stroke_rate": act.get('averageStrokeRate'),
+        "total_strokes": act.get('totalStrokes'),
+
+        "calories": act.get('calories'),
+        "aerobic_te": act.get('aerobicTrainingEffect'),
+        "anaerobic_te": act.get('anaerobicTrainingEffect'),
+        "v02_max_est": act.get('vO2MaxValue')
+    }
+
+
+def score_hunter(obj):
+    """Recursively search for anything that looks like a sleep score (1-100)."""
+    if isinstance(obj, dict):
+        # Priority keys first
+        for p_key in ['sleepScore', 'overallScore', 'score', 'sleepScoreValue', 'value']:
+            val = obj.get(p_key)
+            if isinstance(val, (int, float)) and 1 <= val <= 100:
+                return int(val)
+        # Recursive search
+        for k, v in obj.items():
+            res = score_hunter(v)
+            if res: return res
+    elif isinstance(obj, list):
+        for item in obj:
+            res = score_hunter(item)
+            if res: return res
+    return None
+
+
+def parse_health_day(d, sleep_raw, stats, hrv_raw=None):
+    """Extracts the daily health metrics from the raw Garmin payloads of one day."""
+    # 1. HUNTER: Find Sleep Score anywhere in sleep_raw or stats
+    s_score = score_hunter(sleep_raw) or score_hunter(stats.get('sleepSummary')) or stats.get('sleepScore')
+
+    # 2. Extract Duration
+    dto = sleep_raw.get('dailySleepDTO', {})
+    s_hrs = round(dto.get('sleepTimeSeconds', 0) / 3600.0, 1) if dto.get('sleepTimeSeconds') else 0
+
+    # 3. Standard Metrics
+    rhr = stats.get('restingHeartRate')
+    bb = stats.get('bodyBatteryMostRecentValue') or stats.get('bodyBatteryHigh')
+    stress = stats.get('averageStressLevel') or stats.get('allDayStress', {}).get('averageStressLevel')
+
+    # 4. HRV
+    hrv = stats.get('hrvStatus', {}).get('lastNightAvg')
+    if hrv is None and hrv_raw:
+        hrv = hrv_raw.get('hrvSummary', {}).get('lastNightAvg')
+
+    print(f"DEBUG: Hunter scan {d} -> Sleep={s_score}, HRV={hrv}, RHR={rhr}")
+    return {"sleep_score": s_score, "sleep_hours": s_hrs, "rhr": rhr, "hrv": hrv, "body_battery": bb, "stress": stress}
+
+
+def merge_health_days(dates_to_scan, day_metrics):
+    """
+    Builds the dashboard metrics from per-day results (same order as dates_to_scan, None for failed days).
+    The first day wins; sleep and HRV are back-filled from older days when missing.
+    """
+    best_metrics = {
+        "date": dates_to_scan[0],
+        "sleep_score": None,
+        "sleep_hours": 0,
+        "rhr": None,
+        "hrv": None,
+        "body_battery": None,
+        "stress": None,
+        "readiness_score": None
+    }
+
+    for i, d in enumerate(dates_to_scan):
+        m = day_metrics[i]
+        if m is None:
+            continue
+        s_score, hrv = m["sleep_score"], m["hrv"]
+
+        if i == 0:
+            best_metrics.update(m)
+        else:
+            if best_metrics["sleep_score"] is None and s_score:
+                best_metrics["sleep_score"] = s_score
+                best_metrics["sleep_hours"] = m["sleep_hours"]
+                best_metrics["date"] += f" (Sleep from {d})"
+            if best_metrics["hrv"] is None and hrv:
+                best_metrics["hrv"] = hrv
+                suffix = f" (HRV from {d})"
+                if "(Sleep from" in best_metrics["date"]:
+                     best_metrics["date"] = best_metrics["date"].replace(")", f", {suffix.strip(' ()')})")
+                else:
+                     best_metrics["date"] += suffix
+
+        if best_metrics["sleep_score"] and best_metrics["hrv"]:
+            break
+
+    best_metrics["readiness_score"] = best_metrics["sleep_score"] or best_metrics["body_battery"]
+    return best_metrics
+
 
 class GarminManager:
     def __init__(self, email, password, tokens=None):
@@ -22,43 +348,66 @@ class GarminManager:
         self.client = None
         self.last_login_error = None
         
-    def login(self):
+    @GARMIN_LIMIT
+    def login(self, force=False):
         self.last_login_error = None
+
+        # Already authenticated in this manager (e.g. health + activities in the same request)
+        if self.client and not force:
+            return True
+
+        # Reuse a live session from the process-wide pool (no login, no verification round trip)
+        if not force:
+            pooled = SESSION_POOL.borrow(self.email)
+            if pooled:
+                self.client = pooled
+                return True
+        else:
+            SESSION_POOL.invalidate(self.email)
+
+        # Concurrent requests for the same athlete share one login
+        self.client, self.last_login_error = SINGLE_FLIGHT.do((self.email, "login", None), self._authenticate)
+        return self.client is not None
+
+    def _authenticate(self):
+        """Token restore or password login. Returns (client, user-facing error message)."""
         try:
             print(f"DEBUG: Attempting Garmin login for {self.email}...")
-            self.client = Garmin(self.email, self.password)
+            client = new_garmin_client(self.email, self.password)
             
             # 1. Try to load session from tokens
             if self.tokens:
                 try:
-                    self.client.garth.loads(self.tokens)
+                    client.garth.loads(self.tokens)
                     print("DEBUG: Tokens loaded, verifying session...")
                     
                     # Test call to verify session
                     today = datetime.date.today().isoformat()
-                    self.client.get_user_summary(today)
+                    client.get_user_summary(today)
                     
                     # REPAIR: If display_name is missing, try to fetch it from social profile
-                    if not self.client.display_name:
+                    if not client.display_name:
                         print("DEBUG: display_name missing after token load, attempting repair...")
                         try:
-                            profile = self.client.get_social_profile()
-                            self.client.display_name = profile.get('userName')
+                            profile = client.get_social_profile()
+                            client.display_name = profile.get('userName')
                         except: pass
                     
                     # If STILL missing, we can't reliably build URLs
-                    if not self.client.display_name:
+                    if not client.display_name:
                         raise Exception("Session loaded/verified but display_name is missing")
                         
-                    print(f"DEBUG: Session restored for {self.client.display_name}")
-                    return True
+                    print(f"DEBUG: Session restored for {client.display_name}")
+                    SESSION_POOL.put(self.email, client)
+                    return client, None
                 except Exception as token_err:
                     print(f"DEBUG: Token session invalid or repairable ({token_err}). Falling back to password.")
-            
+
             # 2. Standard Login
-            self.client.login()
-            print(f"DEBUG: Password login successful for {self.client.display_name}")
-            return True
+            client.login()
+            print(f"DEBUG: Password login successful for {client.display_name}")
+            SESSION_POOL.put(self.email, client)
+            return client, None
         except Exception as e:
             err_str = str(e)
             msg = f"Garmin login failed for {self.email}: {err_str}"
@@ -66,367 +415,54 @@ class GarminManager:
             
             # Set a more user-friendly error message if possible
             if "Cloudflare" in err_str or "403" in err_str:
-                self.last_login_error = "Accesso bloccato (Cloudflare/403). I server di Render potrebbero essere temporaneamente bloccati da Garmin."
+                error = "Accesso bloccato (Cloudflare/403). I server di Render potrebbero essere temporaneamente bloccati da Garmin."
             elif "Invalid" in err_str or "Authentication" in err_str:
-                self.last_login_error = f"Email o Password non corretti (Dettaglio: {err_str})"
+                error = f"Email o Password non corretti (Dettaglio: {err_str})"
             elif "MFA" in err_str or "multi-factor" in err_str.lower():
-                self.last_login_error = "Garmin richiede l'autenticazione a due fattori (MFA). Disabilitala o usa un token di sessione."
+                error = "Garmin richiede l'autenticazione a due fattori (MFA). Disabilitala o usa un token di sessione."
             else:
-                self.last_login_error = f"Errore login Garmin: {err_str}"
+                error = f"Errore login Garmin: {err_str}"
                 
             try:
                 with open("sync_error.log", "a") as f:
                     f.write(f"{datetime.datetime.now()} - {msg}\n")
             except: pass
-            return False
+            return None, error
+
+    def drop_rejected_session(self, e):
+        """Evicts the pooled client if Garmin rejected its token, so the next login() starts over."""
+        if is_auth_error(e):
+            logger.warning(f"Garmin rejected the session of {self.email}, evicting it: {e}")
+            SESSION_POOL.invalidate(self.email)
+            self.client = None
 
     def get_session_tokens(self):
         if self.client and hasattr(self.client, 'garth'):
             return self.client.garth.dumps()
         return None
 
-    def create_and_schedule_workout(self, name, description, duration_min, date_str, activity_type="RUNNING", steps=None, pool_length=25.0):
-        """Creates a workout using pure JSON/Dict structure to avoid Object validation issues."""
+    @GARMIN_LIMIT
+    def create_and_schedule_workout(self, name, description, duration_min, date_str, activity_type="RUNNING", steps=None, pool_length=25.0, upload_cache=None):
+        """
+        Creates a workout using pure JSON/Dict structure to avoid Object validation issues.
+        With an upload_cache (WorkoutUploadCache), identical workouts are rescheduled instead of re-uploaded.
+        """
         print(f"START create_and_schedule_workout: {name}, {date_str}, {activity_type}, {len(steps or [])} steps")
         
         if not self.client:
             if not self.login(): return False
             
         try:
-            # 1. Resolve Activity Type & Sport Keys
-            act_upper = str(activity_type).upper()
-            sport_type = {"sportTypeId": 1, "sportTypeKey": "running"} # default
-            
-            if "SWIM" in act_upper:
-                sport_type = {"sportTypeId": 4, "sportTypeKey": "swimming"}
-            elif "CYCL" in act_upper or "BIK" in act_upper or "RID" in act_upper:
-                sport_type = {"sportTypeId": 2, "sportTypeKey": "cycling"}
-                
-            print(f"Resolved Sport Type: {sport_type}")
-
-            # 2. Build Steps List (Pure Dicts)
-            workout_steps = []
-            
-            if not steps:
-                # Default single step
-                dur_secs = float(duration_min) * 60.0 if duration_min else 1800.0
-                workout_steps.append({
-                    "type": "ExecutableStepDTO",
-                    "stepId": None,
-                    "stepOrder": 1,
-                    "description": "Main Part",
-                    "stepType": {"stepTypeId": 3, "stepTypeKey": "interval"},
-                    "endCondition": {"conditionTypeId": 2, "conditionTypeKey": "time"},
-                    "endConditionValue": dur_secs
-                })
-            else:
-                def process_steps(steps_data, start_order=1, is_child=False, global_rec_kmh=None):
-                    processed = []
-                    current_order = start_order
-                    
-                    for s_data in steps_data:
-                        # 1. Alias & Shorthand Logic
-                        if 'repeat' in s_data and 'repeat_count' not in s_data: s_data['repeat_count'] = s_data['repeat']
-                        
-                        if s_data.get('repeat_count', 1) > 1 and 'steps' not in s_data:
-                            rec_min = float(s_data.get('recovery_dur', 0))
-                            if rec_min > 0:
-                                work = s_data.copy(); work['repeat_count'] = 1; work.pop('steps', None)
-                                rec = {"type": "RECOVERY", "duration_min": rec_min, "description": "Rec"}
-                                s_data['steps'] = [work, rec]
-
-                        # Handle Repeat Blocks (RepeatGroupDTO based on User JSON)
-                        if 'steps' in s_data and s_data.get('repeat_count', 1) > 1:
-                            reps = int(s_data['repeat_count'])
-                            repeat_group = {
-                                "type": "RepeatGroupDTO",
-                                "stepId": None,
-                                "stepOrder": current_order,
-                                "description": s_data.get('description'),
-                                "stepType": {"stepTypeId": 6, "stepTypeKey": "repeat"},
-                                "childStepId": 1 if is_child else 1, # Garmin seems to like '1' for structured parts
-                                "numberOfIterations": reps,
-                                "workoutSteps": process_steps(s_data['steps'], start_order=1, is_child=True, global_rec_kmh=global_rec_kmh),
-                                "endCondition": {"conditionTypeId": 7, "conditionTypeKey": "iterations"},
-                                "endConditionValue": float(reps),
-                                "skipLastRestStep": True,
-                                "smartRepeat": False
-                            }
-                            processed.append(repeat_group)
-                        else:
-                            # --- PRE-PROCESS TARGETS FROM AI ---
-                            # AI sends "target": {"type": "pace", "val": "5:30"}
-                            print(f"DEBUG STEP PROCESSING: {s_data.get('description', 'No Desc')} Keys: {list(s_data.keys())}")
-                            
-                            if 'target' in s_data:
-                                tgt = s_data['target']
-                                t_type = tgt.get('type', '').lower()
-                                t_val = tgt.get('val')
-                                
-                                if t_type == 'pace' and t_val:
-                                    # Handle "5:30" or "330" (seconds)
-                                    try:
-                                        if ":" in str(t_val):
-                                            m, s = map(int, str(t_val).split(":"))
-                                            sec_km = m * 60 + s
-                                            if sec_km > 0:
-                                                s_data['pace_ms'] = 1000.0 / sec_km
-                                        else:
-                                            # Assume seconds/km
-                                            sec_km = float(t_val)
-                                            if sec_km > 0:
-                                                s_data['pace_ms'] = 1000.0 / sec_km # store as m/s
-                                    except: pass
-                                    
-                                elif t_type == 'power' and t_val:
-                                    try:
-                                        s_data['power_watts'] = int(t_val)
-                                    except: pass
-                                    
-                                elif t_type == 'hr' and t_val:
-                                    try:
-                                        s_data['hr_bpm'] = int(t_val)
-                                    except: pass
-                            
-                            # FALLBACK: Extract from Description if missing (e.g. "Run at 5:00/km" or "12.5 km/h")
-                            if 'pace_ms' not in s_data and 'power_watts' not in s_data:
-                                desc = s_data.get('description', '')
-                                
-                                # 1. Try Pace (min/km)
-                                match_pace = re.search(r'\b([3-7]:[0-5]\d)(?:\s*/?km)?\b', desc)
-                                if match_pace:
-                                    try:
-                                        grp = match_pace.group(1)
-                                        m, s = map(int, grp.split(":"))
-                                        sec_km = m * 60 + s
-                                        if sec_km > 0:
-                                            s_data['pace_ms'] = 1000.0 / sec_km
-                                            print(f"DEBUG: EXTRACTED PACE {grp} from desc")
-                                    except: pass
-                                
-                                # 2. Try Speed (km/h) - Common for Treadmill
-                                if 'pace_ms' not in s_data:
-                                    match_speed = re.search(r'\b(\d{1,2}(?:\.\d)?)\s*km/h\b', desc, re.IGNORECASE)
-                                    if match_speed:
-                                        try:
-                                            kmh = float(match_speed.group(1))
-                                            if kmh > 0:
-                                                ms = kmh / 3.6
-                                                s_data['pace_ms'] = ms
-                                                print(f"DEBUG: EXTRACTED SPEED {kmh} km/h -> {ms} m/s")
-                                        except: pass
-
-                            print(f"DEBUG FINAL STEP DATA: {s_data}")
-
-                            # Standard Step Construction - Robust Duration
-                            # Check if duration_sec is provided explicitly
-                            dur_sec_explicit = s_data.get('duration_sec')
-                            if dur_sec_explicit:
-                                dur_val = int(dur_sec_explicit)
-                            else:
-                                # Parse duration_min, handle sub-minute values carefully
-                                d_min = float(s_data.get('duration_min', 0))
-                                dur_val = int(d_min * 60)
-                                # If duration is 0 but description mentions "X sec", try to recover
-                                if dur_val == 0:
-                                    match_sec = re.search(r'\b(\d+)\s*sec', s_data.get('description', ''), re.IGNORECASE)
-                                    if match_sec:
-                                        dur_val = int(match_sec.group(1))
-
-                            dist_val = int(float(s_data.get('distance_m', 0)))
-                            
-                            stype_str = s_data.get('type', 'INTERVAL').lower()
-                            
-                            step = {
-                                "type": "ExecutableStepDTO",
-                                "stepId": None,
-                                "stepOrder": current_order,
-                                "description": s_data.get('description', ''),
-                                "stepType": {"stepTypeId": 3, "stepTypeKey": "interval"},
-                                "endCondition": {"conditionTypeId": 2, "conditionTypeKey": "time"},
-                                "endConditionValue": float(dur_val),
-                                "targetType": {"workoutTargetTypeId": 1, "workoutTargetTypeKey": "no.target"},
-                                "childStepId": 1 if is_child else None
-                            }
-
-                            # Distance Override
-                            if dist_val > 0:
-                                step["endCondition"] = {"conditionTypeId": 3, "conditionTypeKey": "distance"}
-                                step["endConditionValue"] = float(dist_val)
-                            
-                            if stype_str == "warmup": step["stepType"] = {"stepTypeId": 1, "stepTypeKey": "warmup"}
-                            elif stype_str == "cooldown": step["stepType"] = {"stepTypeId": 2, "stepTypeKey": "cooldown"}
-                            elif stype_str == "recovery": step["stepType"] = {"stepTypeId": 4, "stepTypeKey": "recovery"}
-                            
-                            if sport_type['sportTypeKey'] == 'swimming':
-                                step["strokeType"] = {"strokeTypeId": 1, "strokeTypeKey": "any_stroke"}
-                                step["equipmentType"] = {"equipmentTypeId": 0, "equipmentTypeKey": "no_equipment"}
-                                if step["stepType"]["stepTypeKey"] == "interval":
-                                    step["stepType"] = {"stepTypeId": 3, "stepTypeKey": "swim"}
-                                
-                                # FORCE KILOMETER UNIT for meters (from user's working export)
-                                if step["endCondition"]["conditionTypeKey"] == "distance":
-                                    step["preferredEndConditionUnit"] = {"unitId": 2, "unitKey": "kilometer", "factor": 100000.0}
-                                    
-                            # Target application logic
-                            if s_data.get('pace_ms') is not None:
-                                try:
-                                    speed = float(s_data['pace_ms'])
-                                    print(f"DEBUG: Applying Pace Target: {speed} m/s to step {current_order}")
-                                except (TypeError, ValueError) as e:
-                                    print(f"WARN: Invalid pace_ms value: {s_data.get('pace_ms')} ({e}). Skipping target.")
-                                    speed = None
-                                
-                                if speed is not None:
-                                    
-                                    # 1. Default Logic (applies to Running, and generic text-based pace)
-                                    # Default to Pace Zone (Running matches Library behavior)
-                                    step["targetType"] = {"workoutTargetTypeId": 6, "workoutTargetTypeKey": "pace.zone"}
-                                    step["targetValueOne"] = round(speed * 0.95, 3)
-                                    step["targetValueTwo"] = round(speed * 1.05, 3)
-                                    
-                                    # 2. Swim Specific Logic Override
-                                    if sport_type.get('sportTypeKey') == 'swimming':
-                                        # Use pace.zone (ID 6) and swim.css.offset (ID 17)
-                                        step["targetType"] = {"workoutTargetTypeId": 6, "workoutTargetTypeKey": "pace.zone"}
-                                        step["secondaryTargetType"] = {"workoutTargetTypeId": 17, "workoutTargetTypeKey": "swim.css.offset"}
-                                        
-                                        # Calculate offset from reference CSS
-                                        ref_css = float(s_data.get('css_ms') or speed)
-                                        if ref_css > 0:
-                                            step_sec_100 = 100.0 / speed
-                                            ref_sec_100 = 100.0 / ref_css
-                                            offset = round(step_sec_100 - ref_sec_100, 1)
-                                            step["secondaryTargetValueOne"] = offset
-                                        else:
-                                            step["secondaryTargetValueOne"] = 0.0
-                                            
-                                        step["secondaryTargetValueTwo"] = 0.0
-                                        step["targetValueUnit"] = None
-
-                                    else:
-                                        step["targetType"] = {"workoutTargetTypeId": 6, "workoutTargetTypeKey": "speed.target"}
-                                    
-                                    # Dynamic range: +/- 5% around the target speed for THIS specific step
-                                    step["targetValueOne"] = round(speed * 0.95, 3)
-                                    step["targetValueTwo"] = round(speed * 1.05, 3)
-
-                            if 'power_watts' in s_data and sport_type['sportTypeKey'] == 'cycling':
-                                watts = int(s_data['power_watts'])
-                                step["targetType"] = {"workoutTargetTypeId": 2, "workoutTargetTypeKey": "power.target"}
-                                step["targetValueOne"] = float(watts - 15)
-                                step["targetValueTwo"] = float(watts + 15)
-                                
-                                # Add cadence as secondary target if present
-                                if 'cadence' in s_data:
-                                    cad = int(s_data['cadence'])
-                                    step["secondaryTargetType"] = {"workoutTargetTypeId": 3, "workoutTargetTypeKey": "cadence.target"}
-                                    step["secondaryTargetValueOne"] = float(cad - 5)
-                                    step["secondaryTargetValueTwo"] = float(cad + 5)
-
-                            if 'hr_bpm' in s_data:
-                                bpm = int(s_data['hr_bpm'])
-                                # Heart Rate Target (Custom Range)
-                                step["targetType"] = {"workoutTargetTypeId": 4, "workoutTargetTypeKey": "heart.rate.target"}
-                                step["targetValueOne"] = float(bpm - 5)
-                                step["targetValueTwo"] = float(bpm + 5)
-                                step["targetValueUnit"] = {"unitId": 5, "unitKey": "beatsPerMinute", "factor": 1.0}
-                                
-                            processed.append(step)
-                        
-                        current_order += 1
-                    return processed
-
-                # Initial Call: Try to find Global Recovery Target in Name
-                g_rec_kmh = None
-                w_name = name # Use the 'name' parameter passed to create_and_schedule_workout
-                match_g = re.search(r'rec(?:upero)?\s*@\s*(\d+(?:\.\d+)?)\s*km/h', w_name, re.IGNORECASE)
-                if match_g:
-                    g_rec_kmh = float(match_g.group(1))
-
-                workout_steps = process_steps(steps, global_rec_kmh=g_rec_kmh)
-
+            # 1. Compile steps and build the final payload (see workout_compiler)
+            payload = build_workout_payload(name, description, duration_min, activity_type, steps, pool_length)
 
-            # 3. Construct Final Payload
-            # Note: We do NOT use RunningWorkout/WorkoutSegment classes to avoid validation errors.
-            # We mimic the JSON they produce.
-            
-            # Estimate Total Duration (mandatory for Garmin API)
-            def estimate_dur(steps_list):
-                total = 0
-                for s in steps_list:
-                    if s.get("type") in ["RepeatStepDTO", "RepeatGroupDTO"]:
-                        reps = s.get("repeatCount") or s.get("numberOfIterations") or 1
-                        total += estimate_dur(s["workoutSteps"]) * reps
-                    else:
-                        # If time based
-                        if s["endCondition"]["conditionTypeKey"] == "time":
-                            total += s["endConditionValue"]
-                        # If distance based
-                        elif s["endCondition"]["conditionTypeKey"] == "distance":
-                            # Rough estimation: 1000m -> 5 mins
-                            total += (s["endConditionValue"] / 1000.0) * 300.0
-                return total
-
-            total_dur = int(estimate_dur(workout_steps))
-
-            def estimate_dist(steps_list):
-                total = 0
-                for s in steps_list:
-                    if s.get("type") in ["RepeatStepDTO", "RepeatGroupDTO"]:
-                        reps = s.get("repeatCount") or s.get("numberOfIterations") or 1
-                        total += estimate_dist(s["workoutSteps"]) * reps
-                    else:
-                        if s["endCondition"]["conditionTypeKey"] == "distance":
-                            total += s["endConditionValue"]
-                return total
-
-            total_dist = estimate_dist(workout_steps)
-
-            payload = {
-                "workoutName": name,
-                "description": description or name,
-                "sportType": sport_type,
-                "workoutSegments": [
-                    {
-                        "segmentOrder": 1,
-                        "sportType": sport_type,
-                        "workoutSteps": workout_steps,
-                        "poolLength": None,
-                        "poolLengthUnit": None,
-                    }
-                ],
-                "estimatedDurationInSecs": total_dur,
-                "estimatedDistanceInMeters": float(total_dist) if total_dist > 0 else None,
-                "estimateType": "DISTANCE_ESTIMATED" if total_dist > 0 else None,
-                "estimatedDistanceUnit": {"unitId": None, "unitKey": None, "factor": None} if sport_type['sportTypeKey'] == 'swimming' else None,
-                "poolLength": float(pool_length) if sport_type['sportTypeKey'] == 'swimming' else None,
-                "poolLengthUnit": {"unitId": 2, "unitKey": "kilometer", "factor": 100000.0} if sport_type['sportTypeKey'] == 'swimming' else None,
-            }
-
-            # 4. Upload
-            try:
-                import json
-                with open("sync_payload_debug.log", "a") as f:
-                    f.write(f"\n--- {name} ({activity_type}) ---\n")
-                    f.write(json.dumps(payload, indent=2))
-                    f.write("\n")
-            except: pass
-
-            workout_response = self.client.upload_workout(payload)
-            # print(f"Upload Response: {workout_response}")
-
-            # 5. Extract ID
-            workout_id = None
-            if hasattr(workout_response, 'workoutId'): workout_id = workout_response.workoutId
-            elif isinstance(workout_response, dict): workout_id = workout_response.get("workoutId")
-            
-            if not workout_id:
-                print(f"Failed to get workout ID from: {workout_response}")
-                return False
-                
-            # 6. Schedule
-            return self.schedule_workout(workout_id, date_str)
+            # 2-5. Upload (or reuse an identical upload) and schedule. Identical workouts of one batch
+            # run one at a time, so the second one finds the first upload in the cache instead of uploading again
+            p_hash = payload_hash(payload)
+            if not upload_cache:
+                return self._upload_and_schedule(name, activity_type, payload, p_hash, date_str, None)
+            with upload_cache.in_flight(p_hash):
+                return self._upload_and_schedule(name, activity_type, payload, p_hash, date_str, upload_cache)
 
         except Exception as e:
             msg = f"Error in pure dict workout creation: {e}"
@@ -445,6 +481,80 @@ class GarminManager:
             traceback.print_exc()
             return False
 
+    def _upload_and_schedule(self, name, activity_type, payload, p_hash, date_str, upload_cache):
+        """Steps 2-5 of create_and_schedule_workout. Errors propagate to the caller."""
+        # 2. Skip the upload if this exact workout is already in the athlete's Garmin library
+        cached = upload_cache.lookup(p_hash) if upload_cache else None
+        if cached:
+            cached_id, cached_dates = cached
+            if date_str in cached_dates:
+                print(f"DEBUG: Workout '{name}' unchanged and already scheduled on {date_str}, skipping")
+                return True
+            if self.schedule_workout(cached_id, date_str):
+                print(f"DEBUG: Workout '{name}' unchanged, rescheduled existing id {cached_id}")
+                upload_cache.record(p_hash, cached_id, date_str)
+                return True
+            # Probably deleted in Garmin Connect: forget it and upload again
+            upload_cache.forget(p_hash)
+
+        # 3. Upload
+        try:
+            import json
+            with open("sync_payload_debug.log", "a") as f:
+                f.write(f"\n--- {name} ({activity_type}) ---\n")
+                f.write(json.dumps(payload, indent=2))
+                f.write("\n")
+        except: pass
+
+        workout_response = self.client.upload_workout(payload)
+        # print(f"Upload Response: {workout_response}")
+
+        # 4. Extract ID
+        workout_id = None
+        if hasattr(workout_response, 'workoutId'): workout_id = workout_response.workoutId
+        elif isinstance(workout_response, dict): workout_id = workout_response.get("workoutId")
+        
+        if not workout_id:
+            print(f"Failed to get workout ID from: {workout_response}")
+            return False
+            
+        # 5. Schedule
+        scheduled = self.schedule_workout(workout_id, date_str)
+        if upload_cache:
+            upload_cache.record(p_hash, workout_id, date_str if scheduled else None)
+        return scheduled
+
+    def sync_workouts(self, jobs, max_parallel=CALENDAR_SYNC_MAX_PARALLEL):
+        """
+        Uploads and schedules several workouts with bounded concurrency, reusing this manager's session.
+        jobs: [(key, create_and_schedule_workout kwargs), ...]
+        Yields {"day": key, "success": bool} in completion order.
+        """
+        if not self.login():
+            for key, _ in jobs:
+                yield {"day": key, "success": False}
+            return
+
+        pending = {}
+        queue = list(jobs)
+        while queue or pending:
+            # Keep at most max_parallel uploads in flight
+            while queue and len(pending) < max_parallel:
+                key, kwargs = queue.pop(0)
+                pending[GARMIN_FETCH_POOL.submit(self.create_and_schedule_workout, **kwargs)] = key
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                key = pending.pop(fut)
+                try:
+                    success = fut.result()
+                except Exception as e:
+                    print(f"Sync error for {key}: {e}")
+                    success = False
+                print(f"DEBUG: Sync result for {key}: {success}")
+                yield {"day": key, "success": bool(success)}
+
+    @GARMIN_LIMIT
     def schedule_workout(self, workout_id, date_str):
         try:
             print(f"Scheduling workout {workout_id} for {date_str}...")
@@ -471,6 +581,19 @@ class GarminManager:
             return False
 
     def get_performance_metrics(self):
+        """Thresholds, HR zones and profile data, cached per athlete (errors are not cached)."""
+        cached = METRICS_CACHE.get(self.email, "performance")
+        if cached is not None:
+            print(f"DEBUG: Returning cached performance metrics for {self.email}")
+            return cached
+
+        res = self._fetch_performance_metrics()
+        if res and "error" not in res:
+            METRICS_CACHE.set(self.email, "performance", res)
+        return res
+
+    @GARMIN_LIMIT
+    def _fetch_performance_metrics(self):
         import os
         import sys
         log_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "garmin_metrics_debug_v2.log")
@@ -484,12 +607,6 @@ class GarminManager:
             elif isinstance(obj, list):
                 for i, v in enumerate(obj):
                     results.extend(find_string_in_dict(v, target_str, f"{path}[{i}]"))
-            # Save to Cache (only for standard 14 days fetch)
-            if days == 14:
-                if self.email not in GARMIN_METRICS_CACHE:
-                    GARMIN_METRICS_CACHE[self.email] = {'timestamp': now}
-                GARMIN_METRICS_CACHE[self.email]['activities'] = results
-            
             return results
 
         try:
@@ -728,117 +845,102 @@ class GarminManager:
             print(f"GLOBAL ERROR: {e}", flush=True)
             return None
 
+    @GARMIN_LIMIT
+    def fetch_activities(self, start_date, end_date):
+        """Raw Garmin activity dicts between two dates (inclusive). None if login fails."""
+        if not self.login():
+            return None
+        window = (start_date.isoformat(), end_date.isoformat())
+        try:
+            return SINGLE_FLIGHT.do((self.email, "activities", window), self.client.get_activities_by_date, *window)
+        except Exception as e:
+            self.drop_rejected_session(e)
+            raise
+
+    @GARMIN_LIMIT
+    def download_fit(self, activity_id):
+        """Original FIT file of an activity. None if login fails."""
+        if not self.login():
+            return None
+        from fit_ingest import extract_fit
+        try:
+            data = SINGLE_FLIGHT.do((self.email, "fit", activity_id), self.client.download_activity,
+                                    activity_id, dl_fmt=Garmin.ActivityDownloadFormat.ORIGINAL)
+        except Exception as e:
+            self.drop_rejected_session(e)
+            raise
+        return extract_fit(data)
+
     def get_training_stats(self, days=60):
         """
         Fetches historical activities and calculates CTL, ATL, TSB.
-        CTL (Chronic Training Load) - 42 day average load (Fitness)
-        ATL (Acute Training Load) - 7 day average load (Fatigue)
-        TSB (Training Stress Balance) - CTL - ATL (Form)
+        See pmc_engine.compute_training_stats for the model.
         """
-        if not self.login():
-            return None
-
         end_date = datetime.date.today()
         start_date = end_date - datetime.timedelta(days=days + 42) # Extra buffer for CTL warmup
-        
-        try:
-            activities = self.client.get_activities_by_date(
-                start_date.isoformat(), 
-                end_date.isoformat()
-            )
-            
-            # Aggregate per day
-            daily_load = {}
-            daily_volume = {} # {date: {swim: x, bike: y, run: z}}
-            
-            # Initialize all days in range
-            curr = start_date
-            while curr <= end_date:
-                daily_load[curr.isoformat()] = 0
-                daily_volume[curr.isoformat()] = {"swim": 0, "bike": 0, "run": 0}
-                curr += datetime.timedelta(days=1)
-
-            for act in activities:
-                date_str = act.get('startTimeLocal', '').split(' ')[0]
-                if date_str not in daily_load: continue
-                
-                # Calculate TSS proxy
-                # Garmin often has 'trainingLoad' but not for all activities
-                load = act.get('trainingLoad')
-                if not load:
-                    # Heuristic: duration in minutes * intensity multiplier
-                    dur_min = (act.get('duration', 0) or act.get('elapsedDuration', 0)) / 60.0
-                    act_type = act.get('activityType', {}).get('typeKey', '').lower()
-                    
-                    mult = 0.6 # basic
-                    if 'run' in act_type: mult = 0.8
-                    elif 'cycl' in act_type: mult = 0.7
-                    elif 'swim' in act_type: mult = 1.0
-                    
-                    load = dur_min * mult
-                
-                daily_load[date_str] += load
-                
-                # Volume (minutes)
-                act_type = act.get('activityType', {}).get('typeKey', '').lower()
-                dur_min = (act.get('duration', 0) or act.get('elapsedDuration', 0)) / 60.0
-                if 'swim' in act_type: daily_volume[date_str]["swim"] += dur_min
-                elif 'cycl' in act_type: daily_volume[date_str]["bike"] += dur_min
-                elif 'run' in act_type: daily_volume[date_str]["run"] += dur_min
-
-            # Calculate CTL/ATL/TSB (Exponential Moving Averages)
-            # Default constants: CTL=42, ATL=7
-            ctl = 0
-            atl = 0
-            history = []
-            
-            curr = start_date
-            while curr <= end_date:
-                d_str = curr.isoformat()
-                load = daily_load.get(d_str, 0)
-                
-                # Formulas: CTL_today = CTL_yesterday + (Load - CTL_yesterday)(1/42)
-                ctl = ctl + (load - ctl) * (1.0/42.0)
-                atl = atl + (load - atl) * (1.0/7.0)
-                tsb = ctl - atl
-                
-                # Only keep the last 'days' for the chart
-                if curr >= (end_date - datetime.timedelta(days=days)):
-                    history.append({
-                        "day": curr.strftime("%d/%m"),
-                        "fitness": round(ctl, 1),
-                        "fatigue": round(atl, 1),
-                        "form": round(tsb, 1),
-                        "swim": round(daily_volume[d_str]["swim"]),
-                        "bike": round(daily_volume[d_str]["bike"]),
-                        "run": round(daily_volume[d_str]["run"])
-                    })
-                curr += datetime.timedelta(days=1)
-
-            return {
-                "history": history,
-                "current": {
-                    "fitness": round(ctl),
-                    "fatigue": round(atl),
-                    "form": round(tsb),
-                    "readiness": "Good" if tsb > -10 else "Tired"
-                }
-            }
 
+        window = (days, end_date.isoformat())
+        cached = METRICS_CACHE.get(self.email, "training_stats", window)
+        if cached is not None:
+            return cached
+
+        try:
+            activities = self.fetch_activities(start_date, end_date)
+            if activities is None:
+                return None
+            stats = compute_training_stats([summarize_activity(a) for a in activities], days=days, end_date=end_date)
+            if stats:
+                METRICS_CACHE.set(self.email, "training_stats", stats, window)
+            return stats
         except Exception as e:
             print(f"Error calculating stats: {e}")
             return None
 
-    def get_health_metrics(self, target_date=None):
-        # Check Cache
-        now = datetime.datetime.now()
-        cache = GARMIN_METRICS_CACHE.get(self.email, {})
-        if cache and 'health' in cache:
-            time_diff = (now - cache['timestamp']).total_seconds() / 60.0
-            if time_diff < CACHE_TTL_MINUTES:
-                print(f"DEBUG: Returning cached health metrics for {self.email} (age: {round(time_diff, 1)}m)")
-                return cache['health']
+    def fetch_health_day(self, d):
+        """Raw (sleep, user summary, hrv) payloads for one day. HRV is only fetched if the summary lacks it."""
+        sleep_raw = self.client.get_sleep_data(d)
+        stats = self.client.get_user_summary(d)
 
+        hrv_raw = None
+        if stats.get('hrvStatus', {}).get('lastNightAvg') is None:
+            try: hrv_raw = self.client.get_hrv_data(d)
+            except: pass
+        return d, sleep_raw, stats, hrv_raw
+
+    def fetch_health_days_raw(self, dates):
+        """Raw (date, sleep, user summary, hrv) tuples for each date (None for failed days), fetched concurrently. Requires login()."""
+        return SINGLE_FLIGHT.do((self.email, "health", tuple(dates)), self._fetch_health_days_raw, dates)
+
+    def _fetch_health_days_raw(self, dates):
+        futures = [GARMIN_FETCH_POOL.submit(self.fetch_health_day, d) for d in dates]
+        raws = []
+        rejected = None
+        for d, fut in zip(dates, futures):
+            try:
+                raws.append(fut.result())
+            except Exception as e:
+                print(f"DEBUG: Error fetching health day {d}: {e}")
+                raws.append(None)
+                rejected = rejected or (e if is_auth_error(e) else None)
+        if rejected:
+            # Only once every day is done: the other fetches were still using the client
+            self.drop_rejected_session(rejected)
+        return raws
+
+    def fetch_health_days(self, dates):
+        """Parsed health metrics for each date (None for failed days). Requires login()."""
+        day_metrics = []
+        for d, raw in zip(dates, self.fetch_health_days_raw(dates)):
+            try:
+                day_metrics.append(parse_health_day(*raw) if raw else None)
+            except Exception as e:
+                print(f"DEBUG: Error in hunter scan {d}: {e}")
+                day_metrics.append(None)
+        return day_metrics
+
+    @GARMIN_LIMIT
+    def get_health_metrics(self, target_date=None):
+        """Dashboard health snapshot straight from Garmin (the API serves health_store instead)."""
         if not self.login():
             return None
         
@@ -848,187 +950,23 @@ class GarminManager:
             (today_dt - datetime.timedelta(days=1)).isoformat(),
             (today_dt - datetime.timedelta(days=2)).isoformat()
         ]
-        
-        def score_hunter(obj):
-            """Recursively search for anything that looks like a sleep score (1-100)."""
-            if isinstance(obj, dict):
-                # Priority keys first
-                for p_key in ['sleepScore', 'overallScore', 'score', 'sleepScoreValue', 'value']:
-                    val = obj.get(p_key)
-                    if isinstance(val, (int, float)) and 1 <= val <= 100:
-                        return int(val)
-                # Recursive search
-                for k, v in obj.items():
-                    res = score_hunter(v)
-                    if res: return res
-            elif isinstance(obj, list):
-                for item in obj:
-                    res = score_hunter(item)
-                    if res: return res
-            return None
-
-        best_metrics = {
-            "date": dates_to_scan[0],
-            "sleep_score": None,
-            "sleep_hours": 0,
-            "rhr": None,
-            "hrv": None,
-            "body_battery": None,
-            "stress": None,
-            "readiness_score": None
-        }
-
-        for i, d in enumerate(dates_to_scan):
-            try:
-                # Fetch Raw Data
-                sleep_raw = self.client.get_sleep_data(d)
-                stats = self.client.get_user_summary(d)
-                
-                # 1. HUNTER: Find Sleep Score anywhere in sleep_raw or stats
-                s_score = score_hunter(sleep_raw) or score_hunter(stats.get('sleepSummary')) or stats.get('sleepScore')
-                
-                # 2. Extract Duration
-                dto = sleep_raw.get('dailySleepDTO', {})
-                s_hrs = round(dto.get('sleepTimeSeconds', 0) / 3600.0, 1) if dto.get('sleepTimeSeconds') else 0
-
-                # 3. Standard Metrics
-                rhr = stats.get('restingHeartRate')
-                bb = stats.get('bodyBatteryMostRecentValue') or stats.get('bodyBatteryHigh')
-                stress = stats.get('averageStressLevel') or stats.get('allDayStress', {}).get('averageStressLevel')
-                
-                # 4. HRV
-                hrv = stats.get('hrvStatus', {}).get('lastNightAvg')
-                if hrv is None:
-                    try: hrv = self.client.get_hrv_data(d).get('hrvSummary', {}).get('lastNightAvg')
-                    except: pass
-
-                print(f"DEBUG: Hunter scan {d} -> Sleep={s_score}, HRV={hrv}, RHR={rhr}")
-
-                if i == 0:
-                    best_metrics.update({"sleep_score": s_score, "sleep_hours": s_hrs, "rhr": rhr, "hrv": hrv, "body_battery": bb, "stress": stress})
-                else:
-                    if best_metrics["sleep_score"] is None and s_score:
-                        best_metrics["sleep_score"] = s_score
-                        best_metrics["sleep_hours"] = s_hrs
-                        best_metrics["date"] += f" (Sleep from {d})"
-                    if best_metrics["hrv"] is None and hrv:
-                        best_metrics["hrv"] = hrv
-                        suffix = f" (HRV from {d})"
-                        if "(Sleep from" in best_metrics["date"]:
-                             best_metrics["date"] = best_metrics["date"].replace(")", f", {suffix.strip(' ()')})")
-                        else:
-                             best_metrics["date"] += suffix
-
-                if best_metrics["sleep_score"] and best_metrics["hrv"]:
-                    break
-
-            except Exception as e:
-                print(f"DEBUG: Error in hunter scan {d}: {e}")
 
-        best_metrics["readiness_score"] = best_metrics["sleep_score"] or best_metrics["body_battery"]
-        
-        # Save to Cache
-        if self.email not in GARMIN_METRICS_CACHE:
-             GARMIN_METRICS_CACHE[self.email] = {'timestamp': now}
-        GARMIN_METRICS_CACHE[self.email]['health'] = best_metrics
-        GARMIN_METRICS_CACHE[self.email]['timestamp'] = now # Refresh timestamp
-        
-        return best_metrics
+        # Fetch all days concurrently, then merge in scan order
+        return merge_health_days(dates_to_scan, self.fetch_health_days(dates_to_scan))
 
     def get_recent_activities(self, days=14):
         """
-        Fetches activities from the last X days.
+        Fetches activities from the last X days straight from Garmin (the API serves activity_store instead).
         """
-        # Check Cache
-        now = datetime.datetime.now()
-        cache = GARMIN_METRICS_CACHE.get(self.email, {})
-        if cache and 'activities' in cache and days <= 14:
-             time_diff = (now - cache['timestamp']).total_seconds() / 60.0
-             if time_diff < CACHE_TTL_MINUTES:
-                 print(f"DEBUG: Returning cached recent activities for {self.email} (age: {round(time_diff, 1)}m)")
-                 return cache['activities']
-
-        if not self.login():
-            return None
-        
         end_date = datetime.date.today()
         start_date = end_date - datetime.timedelta(days=days)
-        
+
         try:
-            activities = self.client.get_activities_by_date(
-                start_date.isoformat(), 
-                end_date.isoformat()
-            )
-            
-            processed = []
-            for act in activities:
-                # Basic info
-                start_time = act.get('startTimeLocal', '')
-                date_str = start_time.split(' ')[0]
-                
-                # Advanced Power Logic (Garmin stores power in various places)
-                avg_pwr = act.get('averagePower')
-                max_pwr = act.get('maxPower')
-                norm_pwr = act.get('normPower') or act.get('weightedAveragePower')
-                
-                # If null, check for 20M critical power or others as proxys
-                if not avg_pwr and ('cycl' in act.get('activityType', {}).get('typeKey', '').lower()):
-                     # Sometimes stored in connectIQ fields or different keys
-                     pass
-
-                processed.append({
-                    "activityId": act.get('activityId'),
-                    "name": act.get('activityName'),
-                    "type": act.get('activityType', {}).get('typeKey'),
-                    "date": date_str,
-                    "start_time": start_time,
-                    "duration_min": round((act.get('duration', 0) or act.get('elapsedDuration', 0)) / 60.0, 1),
-                    "distance_km": round((act.get('distance', 0) or 0) / 1000.0, 2),
-                    
-                    # Heart Rate
-                    "avg_hr": act.get('averageHR'),
-                    "max_hr": act.get('maxHR'),
-                    
-                    # Power & Load
-                    "avg_power": avg_pwr,
-                    "max_power": max_pwr,
-                    "norm_power": norm_pwr,
-                    "pss": act.get('trainingStressScore'), # TSS
-                    "if": act.get('intensityFactor'),
-                    "training_load": act.get('trainingLoad'),
-                    
-                    # Speed & Pace
-                    "avg_speed": act.get('averageSpeed'), # m/s
-                    "max_speed": act.get('maxSpeed'),
-                    
-                    # Cycling Specific
-                    "avg_cadence": act.get('averageBikingCadenceInRevPerMinute'),
-                    
-                    # Running Specific
-                    "avg_run_cadence": act.get('averageRunningCadenceInStepsPerMinute'),
-                    "avg_stride_len": act.get('avgStrideLength'),
-                    "vertical_osc": act.get('avgVerticalOscillation'),
-                    "gct": act.get('avgGroundContactTime'),
-                    
-                    # Swim Specific
-                    "avg_swolf": act.get('averageSwolf'),
-                    "avg_stroke_rate": act.get('averageStrokeRate'),
-                    "total_strokes": act.get('totalStrokes'),
-                    
-                    "calories": act.get('calories'),
-                    "aerobic_te": act.get('aerobicTrainingEffect'),
-                    "anaerobic_te": act.get('anaerobicTrainingEffect'),
-                    "v02_max_est": act.get('vO2MaxValue')
-                })
-            
-            # Save to Cache (only for standard 14 days or less)
-            if days <= 14:
-                if self.email not in GARMIN_METRICS_CACHE:
-                    GARMIN_METRICS_CACHE[self.email] = {'timestamp': now}
-                GARMIN_METRICS_CACHE[self.email]['activities'] = processed
-                GARMIN_METRICS_CACHE[self.email]['timestamp'] = now
-            
-            return processed
+            activities = self.fetch_activities(start_date, end_date)
+            if activities is None:
+                return None
+
+            return [summarize_activity(act) for act in activities]
         except Exception as e:
             logger.error(f"Error fetching recent activities: {e}")
             return []
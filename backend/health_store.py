@@ -0,0 +1,187 @@
+import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from database import HealthDaily
+from garmin_sync import merge_health_days, parse_health_day, SINGLE_FLIGHT
+from raw_archive import RawArchive
+from concurrency import GARMIN_LIMIT
+
+# First sync of a new athlete downloads this many days (HRV/RHR baselines and trends)
+HEALTH_HISTORY_DAYS = 28
+# Provisional days (today) are re-fetched at most this often
+PROVISIONAL_TTL_MINUTES = 5
+# Past days still provisional (watch not uploaded yet, metrics missing) are re-fetched at most this often
+PAST_PROVISIONAL_TTL_MINUTES = 60
+# A day becomes final (never re-fetched) once this many days old if its core metrics are there,
+# and in any case after FINAL_MAX_DAYS (devices that never report some of them)
+FINAL_GRACE_DAYS = 2
+FINAL_MAX_DAYS = 7
+CORE_FIELDS = ["sleep_score", "rhr", "body_battery", "stress"]
+# Days merged into the dashboard snapshot (sleep/HRV back-filled from older days)
+SCAN_DAYS = 3
+
+METRIC_FIELDS = ["sleep_score", "sleep_hours", "rhr", "hrv", "body_battery", "stress"]
+
+
+def _row_metrics(row):
+    return {f: getattr(row, f) for f in METRIC_FIELDS}
+
+
+def is_final_day(d, metrics, today):
+    """True if the day's data can no longer change: old enough and complete, or too old to wait for."""
+    age = (today - datetime.date.fromisoformat(d)).days
+    if age >= FINAL_MAX_DAYS:
+        return True
+    return age >= FINAL_GRACE_DAYS and all(metrics.get(f) is not None for f in CORE_FIELDS)
+
+
+def _mean(values):
+    values = [v for v in values if v]
+    return round(sum(values) / len(values), 1) if values else None
+
+
+class HealthStore:
+    """One row per athlete per day of Garmin health data. Only missing or provisional days are fetched."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _rows(self, user_email: str, dates):
+        rows = self.db.query(HealthDaily).filter(
+            HealthDaily.user_email == user_email,
+            HealthDaily.date.in_(list(dates))
+        ).all()
+        return {row.date: row for row in rows}
+
+    def days_to_fetch(self, user_email: str, days=HEALTH_HISTORY_DAYS, now=None):
+        """Dates (newest first) that are missing, or provisional and older than PROVISIONAL_TTL_MINUTES."""
+        now = now or datetime.datetime.now()
+        today = now.date()
+        dates = [(today - datetime.timedelta(days=i)).isoformat() for i in range(days)]
+        rows = self._rows(user_email, dates)
+
+        missing = []
+        for d in dates:
+            row = rows.get(d)
+            if row is None:
+                missing.append(d)
+            elif not row.is_final:
+                # A provisional day is re-fetched once it is over (last fetched while it was running),
+                # or when its snapshot is too old
+                age_min = (now - datetime.datetime.fromisoformat(row.fetched_at)).total_seconds() / 60.0
+                ttl = PROVISIONAL_TTL_MINUTES if d == today.isoformat() else PAST_PROVISIONAL_TTL_MINUTES
+                if row.fetched_at[:10] <= d < today.isoformat() or age_min >= ttl:
+                    missing.append(d)
+        return missing
+
+    def sync(self, gm, days=HEALTH_HISTORY_DAYS):
+        """
+        Fetches the missing/provisional days from Garmin and stores them.
+        Returns the number of days stored, or None if Garmin could not be reached.
+        Concurrent syncs of the same athlete share one run.
+        """
+        return SINGLE_FLIGHT.do((gm.email, "health_sync", days), self._sync, gm, days)
+
+    def _sync(self, gm, days):
+        email = gm.email
+        now = datetime.datetime.now()
+        dates = self.days_to_fetch(email, days=days, now=now)
+        if not dates:
+            return 0
+
+        with GARMIN_LIMIT:
+            if not gm.login():
+                return None
+            day_raws = gm.fetch_health_days_raw(dates)
+
+        rows = self._rows(email, dates)
+        archive = RawArchive(self.db)
+        today = now.date()
+        fetched_at = now.isoformat()
+        stored = 0
+        for d, raw in zip(dates, day_raws):
+            if raw is None:
+                continue # Failed day, retried on the next sync
+            # Keep the raw payloads so new metrics can be derived later without refetching
+            archive.store_health_day(email, *raw, fetched_at=fetched_at)
+            try:
+                m = parse_health_day(*raw)
+            except Exception as e:
+                print(f"DEBUG: Error in hunter scan {d}: {e}")
+                continue
+            row = rows.get(d)
+            if row is None:
+                row = HealthDaily(user_email=email, date=d)
+                self.db.add(row)
+            for f in METRIC_FIELDS:
+                setattr(row, f, m[f])
+            row.is_final = 1 if is_final_day(d, m, today) else 0
+            row.fetched_at = fetched_at
+            stored += 1
+
+        self.db.commit()
+        print(f"DEBUG: Stored health data for {stored}/{len(dates)} days for {email}")
+        return stored
+
+    def get_history(self, user_email: str, days=HEALTH_HISTORY_DAYS):
+        """Daily metrics for the last `days` days, oldest first (for trends)."""
+        start = (datetime.date.today() - datetime.timedelta(days=days - 1)).isoformat()
+        rows = self.db.query(HealthDaily).filter(
+            HealthDaily.user_email == user_email,
+            HealthDaily.date >= start
+        ).order_by(HealthDaily.date).all()
+        return [dict(date=row.date, **_row_metrics(row)) for row in rows]
+
+    def baselines(self, user_email: str, days=HEALTH_HISTORY_DAYS):
+        """Average HRV / RHR over the previous `days` days (today excluded)."""
+        today = datetime.date.today()
+        rows = self.db.query(HealthDaily.hrv, HealthDaily.rhr).filter(
+            HealthDaily.user_email == user_email,
+            HealthDaily.date >= (today - datetime.timedelta(days=days)).isoformat(),
+            HealthDaily.date < today.isoformat()
+        ).all()
+        return {"hrv_baseline": _mean([r[0] for r in rows]), "rhr_baseline": _mean([r[1] for r in rows])}
+
+    def get_metrics(self, user_email: str):
+        """Dashboard snapshot (same shape as GarminManager.get_health_metrics) plus baselines, or None."""
+        today = datetime.date.today()
+        dates_to_scan = [(today - datetime.timedelta(days=i)).isoformat() for i in range(SCAN_DAYS)]
+        rows = self._rows(user_email, dates_to_scan)
+        if not rows:
+            return None
+
+        day_metrics = [_row_metrics(rows[d]) if d in rows else None for d in dates_to_scan]
+        metrics = merge_health_days(dates_to_scan, day_metrics)
+        metrics.update(self.baselines(user_email))
+        return metrics
+
+    def last_synced(self, user_email: str):
+        """When the athlete's health data was last fetched from Garmin, or None."""
+        value = self.db.query(func.max(HealthDaily.fetched_at)).filter(HealthDaily.user_email == user_email).scalar()
+        return datetime.datetime.fromisoformat(value) if value else None
+
+    def sync_user(self, db_user):
+        """Gap-only sync for a User row, persisting refreshed Garmin tokens. Returns the GarminManager used."""
+        from garmin_sync import GarminManager
+        gm = GarminManager(db_user.email, db_user.hashed_password, tokens=db_user.garmin_tokens)
+        result = self.sync(gm)
+
+        # Save tokens to persist session
+        if gm.get_session_tokens():
+            db_user.garmin_tokens = gm.get_session_tokens()
+            self.db.commit()
+        return gm, result
+
+
+def refresh_user(email: str):
+    """Background gap-only sync. Opens its own DB session since the request's one is closed by then."""
+    from database import SessionLocal, User
+    db = SessionLocal()
+    try:
+        db_user = db.query(User).filter(User.email == email).first()
+        if db_user and db_user.hashed_password:
+            HealthStore(db).sync_user(db_user)
+    except Exception as e:
+        print(f"DEBUG: Background health refresh failed for {email}: {e}")
+    finally:
+        db.close()
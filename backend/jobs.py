@@ -0,0 +1,87 @@
+import os
+import datetime
+import threading
+import logging
+from database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Local time of the nightly challenge job
+CHALLENGE_JOB_HOUR = int(os.getenv("CHALLENGE_JOB_HOUR", "0"))
+CHALLENGE_JOB_MINUTE = int(os.getenv("CHALLENGE_JOB_MINUTE", "5"))
+# Off unless asked for: every API worker imports this module, and only one process should run the job
+# (the Procfile enables it on its single uvicorn process)
+CHALLENGE_JOB_ENABLED = os.getenv("CHALLENGE_JOB_ENABLED", "0") == "1"
+
+
+def run_challenge_job(today=None, db=None):
+    """
+    Seeds the challenge catalog, backfills the XP totals once, expires finished challenges (one UPDATE) and bulk-assigns the weekly
+    challenges of this week and of tomorrow's week (so Sunday night prepares Monday). Idempotent.
+    """
+    from challenge_logic import ChallengeLogic
+    from leaderboard import XpStore
+    today = today or datetime.date.today()
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        logic = ChallengeLogic(db)
+        logic.seed_default_challenges()
+        XpStore(db).ensure()
+        expired = logic.expire_challenges(today)
+        assigned = 0
+        weeks = {d - datetime.timedelta(days=d.weekday()) for d in (today, today + datetime.timedelta(days=1))}
+        for monday in sorted(weeks):
+            assigned += len(logic.assign_weekly_challenges(monday))
+        logger.info(f"Challenge job: {expired} expired, weekly challenges assigned to {assigned} athletes")
+        return {"expired": expired, "assigned": assigned}
+    finally:
+        if own_session:
+            db.close()
+
+
+def seconds_until(hour, minute, now=None):
+    """Seconds from now to the next local hour:minute."""
+    now = now or datetime.datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += datetime.timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+class NightlyJob:
+    """Daemon thread running a function once at start and then every night at hour:minute."""
+
+    def __init__(self, name, fn, hour, minute):
+        self.name = name
+        self.fn = fn
+        self.hour = hour
+        self.minute = minute
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _run_once(self):
+        try:
+            self.fn()
+        except Exception as e:
+            logger.error(f"{self.name} job failed: {e}")
+
+    def start(self):
+        """Safe to call more than once."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def _loop():
+            self._run_once()
+            while not self._stop.wait(seconds_until(self.hour, self.minute)):
+                self._run_once()
+
+        self._thread = threading.Thread(target=_loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+CHALLENGE_JOB = NightlyJob("challenge-assignment", run_challenge_job, CHALLENGE_JOB_HOUR, CHALLENGE_JOB_MINUTE)
@@ -0,0 +1,219 @@
+import base64
+import datetime
+import threading
+import time
+from sqlalchemy import event, func, tuple_
+from sqlalchemy.orm import Session
+from database import AthleteXP, Challenge, UserChallenge, User
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# Other API workers award XP too: reload the in-process ranking at least this often
+RANKING_RELOAD_SECONDS = 300
+
+
+class XpRanking:
+    """
+    In-process rank index: a Fenwick tree counting athletes per XP value, so "how many athletes have more
+    XP" is O(log max_xp) and an award is O(log max_xp). Ties share a rank (1, 2, 2, 4).
+    Loaded from athlete_xp on first use and every RANKING_RELOAD_SECONDS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = None # {xp: athletes}
+        self._loaded_at = 0.0
+        self.loads = 0
+
+    def _build(self, counts):
+        size = 1024
+        while size <= max(counts, default=0):
+            size *= 2
+        tree = [0] * (size + 1)
+        for xp, n in counts.items():
+            i = xp + 1
+            while i <= size:
+                tree[i] += n
+                i += i & -i
+        self._counts, self._tree, self._size = counts, tree, size
+        self._total = sum(counts.values())
+
+    def _add(self, xp, n):
+        if xp >= self._size:
+            counts = dict(self._counts)
+            counts[xp] = counts.get(xp, 0) + n
+            self._build({k: v for k, v in counts.items() if v})
+            return
+        self._counts[xp] = self._counts.get(xp, 0) + n
+        if not self._counts[xp]:
+            del self._counts[xp]
+        self._total += n
+        i = xp + 1
+        while i <= self._size:
+            self._tree[i] += n
+            i += i & -i
+
+    def _at_most(self, xp):
+        """Athletes with XP <= xp."""
+        i, count = min(xp + 1, self._size), 0
+        while i > 0:
+            count += self._tree[i]
+            i -= i & -i
+        return count
+
+    def _ensure(self, db):
+        if self._counts is None or time.monotonic() - self._loaded_at > RANKING_RELOAD_SECONDS:
+            rows = db.query(AthleteXP.xp, func.count(AthleteXP.id)).group_by(AthleteXP.xp).all()
+            self._build({int(xp or 0): n for xp, n in rows})
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+
+    def rank(self, db, xp):
+        """1-based rank of an athlete with the given XP."""
+        with self._lock:
+            self._ensure(db)
+            return self._total - self._at_most(max(int(xp), 0)) + 1
+
+    def athletes(self, db):
+        with self._lock:
+            self._ensure(db)
+            return self._total
+
+    def move(self, old_xp, new_xp):
+        """Moves one athlete from old_xp (None for a new entry) to new_xp. No-op until loaded."""
+        with self._lock:
+            if self._counts is None:
+                return
+            if old_xp is not None:
+                self._add(int(old_xp), -1)
+            self._add(int(new_xp), 1)
+
+    def invalidate(self):
+        with self._lock:
+            self._counts = None
+
+
+XP_RANKING = XpRanking()
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_xp_moves(session):
+    # Only committed awards move ranks
+    for old_xp, new_xp in session.info.pop("xp_moves", []):
+        XP_RANKING.move(old_xp, new_xp)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_xp_moves(session):
+    session.info.pop("xp_moves", None)
+
+
+def encode_cursor(xp, row_id):
+    """Opaque page cursor from the last row's XP and athlete_xp id (never the email)."""
+    return base64.urlsafe_b64encode(f"{xp}:{row_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """(xp, athlete_xp id) of a cursor from encode_cursor. Raises ValueError if malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        xp, row_id = raw.split(":", 1)
+        return int(xp), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class XpStore:
+    """
+    Per-athlete XP and badge totals, updated when a challenge completes so the leaderboard never
+    scans user_challenges. Pages are read by keyset on the (xp, id) index, walked backwards.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def award(self, user_email: str, challenges):
+        """
+        Adds the XP and badges of newly completed challenges to the athlete's totals.
+        Does not commit: the caller commits together with the status change.
+        """
+        if not challenges:
+            return None
+        row = self.db.query(AthleteXP).filter(AthleteXP.user_email == user_email).first()
+        old_xp = row.xp if row else None
+        if row is None:
+            row = AthleteXP(user_email=user_email, xp=0, completed=0, badges={})
+            self.db.add(row)
+        badges = dict(row.badges or {})
+        for ch in challenges:
+            if ch.badge_icon:
+                badges[ch.badge_icon] = badges.get(ch.badge_icon, 0) + 1
+        row.xp = (row.xp or 0) + sum(ch.xp_reward or 0 for ch in challenges)
+        row.completed = (row.completed or 0) + len(challenges)
+        row.badges = badges
+        row.updated_at = datetime.datetime.now().isoformat(timespec="seconds")
+        self.db.info.setdefault("xp_moves", []).append((old_xp, row.xp))
+        return row
+
+    def rebuild(self):
+        """Recomputes every athlete's totals from the completed user_challenges (backfill). Returns athletes."""
+        rows = self.db.query(UserChallenge.user_email, Challenge.xp_reward, Challenge.badge_icon).join(
+            Challenge, Challenge.id == UserChallenge.challenge_id
+        ).filter(UserChallenge.status == "completed").all()
+        totals = {}
+        for user_email, xp, badge in rows:
+            t = totals.setdefault(user_email, {"xp": 0, "completed": 0, "badges": {}})
+            t["xp"] += xp or 0
+            t["completed"] += 1
+            if badge:
+                t["badges"][badge] = t["badges"].get(badge, 0) + 1
+        now = datetime.datetime.now().isoformat(timespec="seconds")
+        self.db.query(AthleteXP).delete(synchronize_session=False)
+        self.db.add_all([AthleteXP(user_email=e, updated_at=now, **t) for e, t in totals.items()])
+        self.db.commit()
+        XP_RANKING.invalidate()
+        return len(totals)
+
+    def ensure(self):
+        """Backfills the totals once if completed challenges predate them. Returns True if it had to."""
+        if self.db.query(AthleteXP.id).first() is not None:
+            return False
+        if self.db.query(UserChallenge.id).filter(UserChallenge.status == "completed").first() is None:
+            return False
+        self.rebuild()
+        return True
+
+    def get(self, user_email: str):
+        """The athlete's XP, completed challenges, badges and rank."""
+        row = self.db.query(AthleteXP).filter(AthleteXP.user_email == user_email).first()
+        xp = row.xp if row else 0
+        return {
+            "xp": xp,
+            "completed": row.completed if row else 0,
+            "badges": (row.badges if row else None) or {},
+            "rank": XP_RANKING.rank(self.db, xp) if row else None,
+            "athletes": XP_RANKING.athletes(self.db)
+        }
+
+    def leaderboard(self, limit: int = DEFAULT_PAGE_SIZE, after: str = None):
+        """
+        One page of athletes by XP, ties by athlete_xp id (both descending, so the index serves the order and
+        the cursor is one row-value comparison), starting after the cursor of the previous page.
+        Entries carry the display name, never the email: the endpoint is public.
+        Returns {"entries": [...], "next": cursor or None}.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        query = self.db.query(AthleteXP, User.name).outerjoin(User, User.email == AthleteXP.user_email)
+        if after:
+            xp, row_id = decode_cursor(after)
+            query = query.filter(tuple_(AthleteXP.xp, AthleteXP.id) < tuple_(xp, row_id))
+        rows = query.order_by(AthleteXP.xp.desc(), AthleteXP.id.desc()).limit(limit + 1).all()
+        entries = [{
+            "rank": XP_RANKING.rank(self.db, row.xp),
+            "name": name,
+            "xp": row.xp,
+            "completed": row.completed,
+            "badges": row.badges or {}
+        } for row, name in rows[:limit]]
+        last = rows[limit - 1][0] if len(rows) > limit else None
+        return {"entries": entries, "next": encode_cursor(last.xp, last.id) if last else None}
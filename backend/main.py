@@ -1,13 +1,14 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Response, BackgroundTasks, UploadFile, File
 from encryption import encrypt_password, decrypt_password
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from database import SessionLocal, engine, User, get_db, ChatMessage, TrainingPlan
 from challenge_logic import ChallengeLogic
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import uvicorn
+import anyio
 import os
 from dotenv import load_dotenv
 
@@ -24,6 +25,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Age", "X-Data-Stale"],
 )
 
 @app.exception_handler(RequestValidationError)
@@ -43,6 +45,35 @@ try:
 except Exception as e:
     print(f"DB INITIALIZATION/MIGRATION ERROR: {e}")
 
+@app.on_event("startup")
+async def configure_execution_model():
+    # Handlers are sync `def`: size the threadpool they run on (see concurrency.py)
+    from concurrency import configure_threadpool
+    configure_threadpool()
+
+@app.on_event("startup")
+def start_garmin_session_pool():
+    # Keep pooled Garmin sessions alive so requests skip the login round trips
+    from garmin_sync import SESSION_POOL
+    SESSION_POOL.start_background_refresh()
+
+@app.on_event("shutdown")
+def stop_garmin_session_pool():
+    from garmin_sync import SESSION_POOL
+    SESSION_POOL.stop_background_refresh()
+
+@app.on_event("startup")
+def start_challenge_job():
+    # Seeds the catalog now, then expires/assigns weekly challenges every night (see jobs.py)
+    from jobs import CHALLENGE_JOB, CHALLENGE_JOB_ENABLED
+    if CHALLENGE_JOB_ENABLED:
+        CHALLENGE_JOB.start()
+
+@app.on_event("shutdown")
+def stop_challenge_job():
+    from jobs import CHALLENGE_JOB
+    CHALLENGE_JOB.stop()
+
 from pydantic import BaseModel, Field, ConfigDict
 
 class UserProfileSchema(BaseModel):
@@ -74,13 +105,37 @@ class UserProfileSchema(BaseModel):
     availability: Dict[str, int] = Field(default_factory=dict)
     habits: Optional[Dict[str, Any]] = {}
     pool_length: Optional[float] = 25.0
+    # Only changed when sent: the profile form does not send them and must not reset custom values
+    ctl_days: Optional[int] = Field(default=None, ge=1)
+    atl_days: Optional[int] = Field(default=None, ge=1)
+
+def load_model_of(db_user):
+    """Profile fields the training load model depends on (see pmc_engine.athlete_params)."""
+    return (db_user.ftp, db_user.css, db_user.hr_rest, db_user.hr_max, db_user.lactate_threshold_hr,
+            db_user.ctl_days or 42, db_user.atl_days or 7)
+
+def revalidate(response: Response, background_tasks: BackgroundTasks, synced_at, soft_ttl_minutes, refresh, email):
+    """
+    Stale-while-revalidate for dashboard reads served from the local stores:
+    marks the response with its age and, past the soft TTL, refreshes from Garmin after responding.
+    """
+    import datetime
+    age = (datetime.datetime.now() - synced_at).total_seconds() if synced_at else None
+    stale = age is None or age >= soft_ttl_minutes * 60
+    if age is not None:
+        response.headers["Age"] = str(int(age))
+    response.headers["X-Data-Stale"] = "1" if stale else "0"
+    if stale:
+        print(f"DEBUG: Serving stale data for {email}, refreshing in background")
+        background_tasks.add_task(refresh, email)
+    return stale
 
 @app.get("/")
 async def root():
     return {"message": "Triathlon Coach API is running"}
 
 @app.get("/api/health")
-async def health_check(db: Session = Depends(get_db)):
+def health_check(db: Session = Depends(get_db)):
     try:
         # Simple query to check DB
         db.execute("SELECT 1")
@@ -97,7 +152,7 @@ async def health_check(db: Session = Depends(get_db)):
         }
 
 @app.post("/api/user/sync-metrics")
-async def sync_metrics(credentials: Dict[str, str], db: Session = Depends(get_db)):
+def sync_metrics(credentials: Dict[str, str], db: Session = Depends(get_db)):
     try:
         print(f"DEBUG: Sync request received for {credentials.get('email')}")
         
@@ -135,14 +190,16 @@ async def sync_metrics(credentials: Dict[str, str], db: Session = Depends(get_db
         })
 
 @app.post("/api/user/profile")
-async def update_profile(profile: UserProfileSchema, db: Session = Depends(get_db)):
+def update_profile(profile: UserProfileSchema, db: Session = Depends(get_db)):
     print(f"DEBUG: Received profile update for {profile.email}")
     try:
         db_user = db.query(User).filter(User.email == profile.email).first()
         
+        is_new = db_user is None
         if not db_user:
             db_user = User(email=profile.email)
             db.add(db_user)
+        load_model = load_model_of(db_user)
         
         db_user.name = profile.name
         db_user.age = profile.age
@@ -167,12 +224,27 @@ async def update_profile(profile: UserProfileSchema, db: Session = Depends(get_d
         db_user.availability = profile.availability
         db_user.habits = profile.habits
         db_user.pool_length = profile.pool_length
+        if profile.ctl_days is not None:
+            db_user.ctl_days = profile.ctl_days
+        if profile.atl_days is not None:
+            db_user.atl_days = profile.atl_days
         
         if profile.password:
             db_user.hashed_password = encrypt_password(profile.password)
             
         db.commit()
         db.refresh(db_user)
+
+        # Thresholds and time constants change every stored load/CTL value
+        if load_model_of(db_user) != load_model:
+            from pmc_store import PmcStore
+            from rollups import RollupStore
+            PmcStore(db).rebuild(db_user.email)
+            RollupStore(db).rebuild(db_user.email)
+
+        # New athletes get this week's challenges now instead of waiting for the nightly job
+        if is_new:
+            ChallengeLogic(db).generate_weekly_challenges(db_user.email)
         return {"status": "success", "user": {"email": db_user.email}}
     except Exception as e:
         print(f"ERROR UPDATING PROFILE: {e}")
@@ -182,7 +254,7 @@ async def update_profile(profile: UserProfileSchema, db: Session = Depends(get_d
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/user/profile/{email}")
-async def get_profile(email: str, db: Session = Depends(get_db)):
+def get_profile(email: str, db: Session = Depends(get_db)):
     print(f"DEBUG: Fetching profile for {email}")
     db_user = db.query(User).filter(User.email == email).first()
     if not db_user:
@@ -212,6 +284,8 @@ async def get_profile(email: str, db: Session = Depends(get_db)):
         "hr_max_cycle": db_user.hr_max_cycle,
         "hr_max_swim": db_user.hr_max_swim,
         "lactate_threshold_hr": db_user.lactate_threshold_hr,
+        "ctl_days": db_user.ctl_days or 42,
+        "atl_days": db_user.atl_days or 7,
         "gender": db_user.gender,
         "birthdate": db_user.birthdate,
         "availability": db_user.availability or {},
@@ -221,71 +295,180 @@ async def get_profile(email: str, db: Session = Depends(get_db)):
     }
 
 @app.get("/api/user/training-stats/{email}")
-async def get_training_stats(email: str, db: Session = Depends(get_db)):
+def get_training_stats(email: str, response: Response, background_tasks: BackgroundTasks, days: int = 30,
+                       end: Optional[str] = None, points: Optional[int] = None, bucket: Optional[str] = None,
+                       db: Session = Depends(get_db)):
+    """
+    Daily CTL/ATL/TSB and volume for the `days` before `end` (YYYY-MM-DD, default today).
+    Long ranges: bucket=week|month aggregates per period, points=N keeps N LTTB-selected days.
+    """
     print(f"DEBUG: Fetching training stats for {email}")
     db_user = db.query(User).filter(User.email == email).first()
     if not db_user or not db_user.hashed_password:
         raise HTTPException(status_code=400, detail="User credentials not found")
         
-    from garmin_sync import GarminManager
-    gm = GarminManager(db_user.email, db_user.hashed_password, tokens=db_user.garmin_tokens)
-    stats = gm.get_training_stats(days=30)
-    
-    # Save tokens to persist session
-    if gm.get_session_tokens():
-        db_user.garmin_tokens = gm.get_session_tokens()
-        db.commit()
-    
+    from activity_store import ActivityStore, SYNC_INTERVAL_MINUTES, refresh_user as refresh_activities
+    from pmc_engine import MAX_STATS_DAYS
+    from pmc_store import PmcStore
+    from downsample import BUCKETS
+    import datetime
+
+    if bucket is not None and bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(BUCKETS)}")
+    if points is not None and points < 3:
+        raise HTTPException(status_code=400, detail="points must be at least 3")
+    try:
+        end_date = datetime.date.fromisoformat(end) if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="end must be YYYY-MM-DD")
+    if end_date and end_date > datetime.date.today():
+        raise HTTPException(status_code=400, detail="end cannot be in the future")
+
+    # Serve from the local activity store; only block on Garmin when it is empty
+    store = ActivityStore(db)
+    if store.has_activities(email):
+        revalidate(response, background_tasks, store.last_synced(email), SYNC_INTERVAL_MINUTES, refresh_activities, email)
+    else:
+        gm, synced = store.sync_user(db_user)
+        if synced is None:
+            raise HTTPException(status_code=500, detail="Failed to calculate training stats")
+
+    # Range read of the stored daily CTL/ATL/TSB (kept current by the activity sync)
+    days = max(1, min(days, MAX_STATS_DAYS))
+    stats = PmcStore(db).get_stats(email, days=days, end_date=end_date, points=points, bucket=bucket)
+
     if not stats:
         raise HTTPException(status_code=500, detail="Failed to calculate training stats")
         
     return stats
 
 @app.get("/api/user/health-metrics/{email}")
-async def get_health_metrics(email: str, db: Session = Depends(get_db)):
+def get_health_metrics(email: str, response: Response, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     print(f"DEBUG: Fetching health metrics for {email}")
     db_user = db.query(User).filter(User.email == email).first()
     if not db_user or not db_user.hashed_password:
         raise HTTPException(status_code=400, detail="User credentials not found")
         
-    from garmin_sync import GarminManager
-    gm = GarminManager(db_user.email, db_user.hashed_password, tokens=db_user.garmin_tokens)
-    metrics = gm.get_health_metrics()
-    
-    # Save tokens to persist session
-    if gm.get_session_tokens():
-        db_user.garmin_tokens = gm.get_session_tokens()
-        db.commit()
+    from health_store import HealthStore, PROVISIONAL_TTL_MINUTES, refresh_user as refresh_health
+    store = HealthStore(db)
+    metrics = store.get_metrics(email)
+    if metrics:
+        revalidate(response, background_tasks, store.last_synced(email), PROVISIONAL_TTL_MINUTES, refresh_health, email)
+    else:
+        store.sync_user(db_user)
+        metrics = store.get_metrics(email)
     
     if not metrics:
         raise HTTPException(status_code=500, detail="Failed to fetch health metrics")
         
     return metrics
 
+@app.get("/api/user/health-history/{email}")
+def get_health_history(email: str, days: int = 28, db: Session = Depends(get_db)):
+    """Daily sleep/HRV/RHR/body battery/stress trend, read from the local health table."""
+    from health_store import HealthStore
+    return HealthStore(db).get_history(email, days)
+
 @app.get("/api/user/recent-activities/{email}")
-async def get_recent_activities(email: str, db: Session = Depends(get_db)):
+def get_recent_activities(email: str, response: Response, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
     print(f"DEBUG: Fetching recent activities for {email}")
     db_user = db.query(User).filter(User.email == email).first()
     if not db_user or not db_user.hashed_password:
         raise HTTPException(status_code=400, detail="User credentials not found")
         
-    from garmin_sync import GarminManager
-    gm = GarminManager(db_user.email, db_user.hashed_password, tokens=db_user.garmin_tokens)
-    activities = gm.get_recent_activities(days=14)
-    
-    # Save tokens to persist session
-    if gm.get_session_tokens():
-        db_user.garmin_tokens = gm.get_session_tokens()
-        db.commit()
-        
-    return activities
+    from activity_store import ActivityStore, SYNC_INTERVAL_MINUTES, refresh_user as refresh_activities
+    store = ActivityStore(db)
+    if store.has_activities(email):
+        revalidate(response, background_tasks, store.last_synced(email), SYNC_INTERVAL_MINUTES, refresh_activities, email)
+    else:
+        gm, synced = store.sync_user(db_user)
+        if synced is None:
+            return None
+
+    return store.get_recent(email, 14)
+
+@app.post("/api/user/activity-file/{email}/{activity_id}")
+def upload_activity_file(email: str, activity_id: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
+    """Ingests an original FIT file (or Garmin's zipped export) into per-second streams."""
+    from fit_ingest import StreamStore, FitError
+    try:
+        row = StreamStore(db).ingest(email, activity_id, file.file.read(), source="upload")
+    except (FitError, KeyError, StopIteration) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid FIT file: {e}")
+    return {"activity_id": activity_id, "n_samples": row.n_samples, "columns": row.columns}
+
+@app.get("/api/user/activity-stream/{email}/{activity_id}")
+def get_activity_stream(email: str, activity_id: int, columns: Optional[str] = None, db: Session = Depends(get_db)):
+    """Per-second power/HR/speed/cadence arrays, downloading the FIT from Garmin on first access."""
+    from fit_ingest import StreamStore, FitError
+    store = StreamStore(db)
+    if not store.has(email, activity_id):
+        db_user = db.query(User).filter(User.email == email).first()
+        if not db_user or not db_user.hashed_password:
+            raise HTTPException(status_code=404, detail="Activity stream not found")
+        from garmin_sync import GarminManager, is_not_found_error
+        gm = GarminManager(db_user.email, db_user.hashed_password, tokens=db_user.garmin_tokens)
+        try:
+            ensured = store.ensure(gm, activity_id)
+        except (FitError, KeyError, StopIteration) as e:
+            raise HTTPException(status_code=502, detail=f"Invalid activity file from Garmin: {e}")
+        except Exception as e:
+            if is_not_found_error(e):
+                raise HTTPException(status_code=404, detail="Activity not found in Garmin Connect")
+            print(f"DEBUG: FIT download failed for {email}/{activity_id}: {e}")
+            ensured = False
+        finally:
+            # Save tokens to persist session
+            if gm.get_session_tokens():
+                db_user.garmin_tokens = gm.get_session_tokens()
+                db.commit()
+        if not ensured:
+            raise HTTPException(status_code=502, detail="Could not download the activity file from Garmin")
+
+    streams = store.load(email, activity_id, columns.split(",") if columns else None)
+    return {
+        "activity_id": activity_id,
+        "columns": {name: values.tolist() for name, values in streams.items()}
+    }
+
+@app.get("/api/user/rollups/{email}")
+def get_rollups(email: str, period: str = "week", start: Optional[str] = None, end: Optional[str] = None, db: Session = Depends(get_db)):
+    """Daily or weekly training totals (sessions, duration, distance per sport, load) between two dates."""
+    from rollups import RollupStore
+    import datetime
+    if period not in ("day", "week"):
+        raise HTTPException(status_code=400, detail="period must be day or week")
+
+    end = end or datetime.date.today().isoformat()
+    start = start or (datetime.date.fromisoformat(end) - datetime.timedelta(days=84)).isoformat()
+    store = RollupStore(db)
+    store.ensure(email)
+    rows = store.daily(email, start, end) if period == "day" else store.weekly(email, start, end)
+    return {"period": period, "start": start, "end": end, "rows": rows, "totals": store.totals(email, start, end)}
+
+@app.get("/api/user/power-curve/{email}")
+def get_power_curve(email: str, kind: str = "power", scope: str = "all_time", db: Session = Depends(get_db)):
+    """Mean-maximal power (W) or pace (sec/km, kind=pace) curve, all-time or rolling_90."""
+    from power_curve import CurveStore
+    if kind not in ("power", "pace") or scope not in ("all_time", "rolling_90"):
+        raise HTTPException(status_code=400, detail="kind must be power|pace and scope all_time|rolling_90")
+
+    curve = CurveStore(db).get(email, "power" if kind == "power" else "speed", scope)
+    if not curve:
+        return {"kind": kind, "scope": scope, "durations": [], "values": []}
+    values = curve["values"]
+    if kind == "pace":
+        values = [round(1000.0 / v, 1) if v else None for v in values]
+    return {"kind": kind, "scope": scope, "durations": curve["durations"], "values": values,
+            "activity_ids": curve["activity_ids"], "dates": curve["dates"]}
 
 @app.post("/api/user/generate-plan")
-async def generate_plan(payload: Dict[str, str], db: Session = Depends(get_db)):
+def generate_plan(payload: Dict[str, str], db: Session = Depends(get_db)):
     email = payload.get("email")
     print(f"DEBUG: Generating detailed plan for {email}")
 
-    from garmin_sync import GarminManager
+    from activity_store import ActivityStore
+    from health_store import HealthStore
     from coach_logic import CoachLogic
     
     # 1. Load User Profile
@@ -298,9 +481,12 @@ async def generate_plan(payload: Dict[str, str], db: Session = Depends(get_db)):
     recent_activities = []
     if db_user.hashed_password:
         try:
-            gm = GarminManager(db_user.email, db_user.hashed_password)
-            health_metrics = gm.get_health_metrics()
-            recent_activities = gm.get_recent_activities(days=7) # Last week
+            store = ActivityStore(db)
+            gm, _ = store.sync_user(db_user)
+            health_store = HealthStore(db)
+            health_store.sync(gm)
+            health_metrics = health_store.get_metrics(email)
+            recent_activities = store.get_recent(email, 7) # Last week
             print(f"DEBUG: Reactive metrics for {email}: {health_metrics}")
             print(f"DEBUG: Recent activities for {email}: {len(recent_activities)}")
         except Exception as e:
@@ -340,8 +526,16 @@ async def generate_plan(payload: Dict[str, str], db: Session = Depends(get_db)):
         "ai_insights": ai_insights # The coach now 'drives' the generator
     }
     
+    # FTP from the power curve (95% of the best 20' of the last 90 days), only with enough ride streams
+    from power_curve import CurveStore
+    est_ftp = CurveStore(db).estimate_ftp(email)
+    if est_ftp:
+        print(f"DEBUG: Using power-curve FTP {est_ftp}W for {email} (profile: {db_user.ftp}W)")
+        user_data["ftp"] = est_ftp
+    
     cl = CoachLogic()
-    plan_structure = await cl.generate_ai_plan(user_data)
+    # generate_ai_plan is a coroutine: run it on the event loop from this worker thread
+    plan_structure = anyio.from_thread.run(cl.generate_ai_plan, user_data)
     
     # Post-process dates (Critical for Calendar Sync)
     import datetime
@@ -379,7 +573,7 @@ async def generate_plan(payload: Dict[str, str], db: Session = Depends(get_db)):
     return plan_structure
 
 @app.post("/api/user/sync-calendar")
-async def sync_calendar(payload: Dict[str, Any], db: Session = Depends(get_db)):
+def sync_calendar(payload: Dict[str, Any], db: Session = Depends(get_db)):
     email = payload.get("email")
     week_data = payload.get("week_data")
     print(f"DEBUG: Syncing calendar for {email}")
@@ -390,15 +584,22 @@ async def sync_calendar(payload: Dict[str, Any], db: Session = Depends(get_db)):
          raise HTTPException(status_code=400, detail="User credentials not found")
          
     from garmin_sync import GarminManager
-    gm = GarminManager(user.email, user.hashed_password)
+    # Reuse the stored session instead of a full password login
+    gm = GarminManager(user.email, user.hashed_password, tokens=user.garmin_tokens)
     
-    results = []
     import datetime
     
+    if not gm.login():
+         raise HTTPException(status_code=400, detail="Garmin login failed")
+
+    if gm.get_session_tokens():
+        user.garmin_tokens = gm.get_session_tokens()
+        db.commit()
+
+    from workout_upload_cache import WorkoutUploadCache
+    upload_cache = WorkoutUploadCache(db, user.email)
+
     try:
-        if not gm.login():
-             raise HTTPException(status_code=400, detail="Garmin login failed")
-             
         # Week start date
         week_start_str = week_data.get("start_date")
         if not week_start_str:
@@ -414,6 +615,7 @@ async def sync_calendar(payload: Dict[str, Any], db: Session = Depends(get_db)):
                  week_start = datetime.date.today()
         
         days_map = {"Mon": 0, "Tue": 1, "Wed": 2, "Thu": 3, "Fri": 4, "Sat": 5, "Sun": 6}
+        jobs = []
         
         for p_day, workout in week_data.get("days", {}).items():
             if workout.get("activity") == "Rest":
@@ -441,28 +643,46 @@ async def sync_calendar(payload: Dict[str, Any], db: Session = Depends(get_db)):
             
             print(f"Scheduling {activity_type} on {workout_date_str} (Name: {workout.get('activity')})")
             
-            success = gm.create_and_schedule_workout(
+            jobs.append((p_day, dict(
                 name=workout.get('activity'),
                 description=description,
                 duration_min=workout.get("duration", 60),
                 date_str=workout_date_str,
                 activity_type=activity_type,
                 steps=workout.get("steps"),
-                pool_length=user.pool_length or 25.0
-            )
-            print(f"DEBUG: Sync result for {p_day}: {success}")
-            results.append({"day": p_day, "success": bool(success)})
+                pool_length=user.pool_length or 25.0,
+                upload_cache=upload_cache
+            )))
 
     except Exception as e:
         print(f"Sync error: {e}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
-        
+
+    # Upload + schedule the week in parallel; results arrive as each day finishes
+    results = gm.sync_workouts(jobs)
+    if payload.get("stream"):
+        import json
+
+        def stream_results():
+            for r in results:
+                yield json.dumps(r) + "\n"
+            # The request session may already be closed while streaming
+            flush_db = SessionLocal()
+            try:
+                upload_cache.flush(flush_db)
+            finally:
+                flush_db.close()
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    results = list(results)
+    upload_cache.flush(db)
     return {"status": "success", "results": results}
 
 @app.post("/api/user/sync-single-workout")
-async def sync_single_workout(payload: Dict[str, Any], db: Session = Depends(get_db)):
+def sync_single_workout(payload: Dict[str, Any], db: Session = Depends(get_db)):
     email = payload.get("email")
     workout = payload.get("workout")
     date_str = payload.get("date") # Expected YYYY-MM-DD
@@ -474,7 +694,9 @@ async def sync_single_workout(payload: Dict[str, Any], db: Session = Depends(get
          raise HTTPException(status_code=400, detail="User credentials not found")
          
     from garmin_sync import GarminManager
-    gm = GarminManager(user.email, user.hashed_password)
+    from workout_upload_cache import WorkoutUploadCache
+    gm = GarminManager(user.email, user.hashed_password, tokens=user.garmin_tokens)
+    upload_cache = WorkoutUploadCache(db, user.email)
     
     try:
         if not gm.login():
@@ -505,8 +727,10 @@ async def sync_single_workout(payload: Dict[str, Any], db: Session = Depends(get
             date_str=date_str,
             activity_type=activity_type,
             steps=steps, # Now reliably extracted
-            pool_length=user.pool_length or 25.0
+            pool_length=user.pool_length or 25.0,
+            upload_cache=upload_cache
         )
+        upload_cache.flush(db)
         if not success:
              return {"status": "error", "message": "Failed to create or schedule workout in Garmin Connect. Check backend logs."}
              
@@ -517,7 +741,7 @@ async def sync_single_workout(payload: Dict[str, Any], db: Session = Depends(get
         return {"status": "error", "message": str(e)}
 
 @app.get("/api/user/training-plan/{email}")
-async def get_training_plan(email: str, db: Session = Depends(get_db)):
+def get_training_plan(email: str, db: Session = Depends(get_db)):
     """Fetch the active training plan from database"""
     plan = db.query(TrainingPlan).filter(
         TrainingPlan.user_email == email,
@@ -530,7 +754,7 @@ async def get_training_plan(email: str, db: Session = Depends(get_db)):
     return plan.plan_data
 
 @app.post("/api/user/analyze-compliance")
-async def analyze_compliance(payload: Dict[str, Any], db: Session = Depends(get_db)):
+def analyze_compliance(payload: Dict[str, Any], db: Session = Depends(get_db)):
     email = payload.get("email")
     plan = payload.get("plan") # The current full plan
     
@@ -548,32 +772,41 @@ async def analyze_compliance(payload: Dict[str, Any], db: Session = Depends(get_
     if not user or not user.hashed_password:
          raise HTTPException(status_code=400, detail="User credentials not found")
          
-    from garmin_sync import GarminManager
+    from activity_store import ActivityStore
+    from health_store import HealthStore
     from coach_logic import CoachLogic
+    import datetime
+
+    store = ActivityStore(db)
+    gm, synced = store.sync_user(user)
+    # Read last 30 days from the local store to have a good look back
+    recent_activities = store.get_recent(email, 30)
     
-    gm = GarminManager(user.email, user.hashed_password, tokens=user.garmin_tokens)
-    # Fetch last 30 days to have a good look back
-    recent_activities = gm.get_recent_activities(days=30)
-    
-    if gm.get_session_tokens():
-        user.garmin_tokens = gm.get_session_tokens()
-        db.commit()
-    
+    if synced is None and not store.has_activities(email):
+        recent_activities = None
+
     if recent_activities is None:
         print(f"DEBUG: Garmin login failed for {email}")
         raise HTTPException(status_code=401, detail="Garmin login failed. Please check your credentials.")
 
     print(f"DEBUG: Found {len(recent_activities)} activities for {email}")
         
+    # Per-sport daily totals come from the rollups maintained by the sync
+    from rollups import RollupStore
+    rollups = RollupStore(db)
+    rollups.ensure(email)
+    today = datetime.date.today()
+    daily_rollups = rollups.daily(email, (today - datetime.timedelta(days=30)).isoformat(), today.isoformat())
+
     cl = CoachLogic()
-    analysis = cl.analyze_executed_activities(plan, recent_activities)
+    analysis = cl.analyze_executed_activities(plan, recent_activities, daily_rollups)
     print(f"DEBUG: Analysis complete. All feedback count: {len(analysis['all_activities_feedback'])}")
     
     # Update challenge progress based on newly fetched activities
     try:
         from challenge_logic import ChallengeLogic
         cl_logic = ChallengeLogic(db)
-        cl_logic.update_challenge_progress(email, recent_activities)
+        cl_logic.update_challenge_progress(email)
     except Exception as e:
         print(f"DEBUG: Error updating challenges: {e}")
 
@@ -590,7 +823,7 @@ class ChatRequest(BaseModel):
     message: str
 
 @app.post("/api/chat")
-async def chat_with_coach(request: ChatRequest, db: Session = Depends(get_db)):
+def chat_with_coach(request: ChatRequest, db: Session = Depends(get_db)):
     """Send message to AI coach and get response with full context"""
     try:
         # Get user profile for context
@@ -620,16 +853,20 @@ async def chat_with_coach(request: ChatRequest, db: Session = Depends(get_db)):
         recent_stats = {}
         if user.hashed_password:
             try:
-                from garmin_sync import GarminManager
-                gm = GarminManager(user.email, user.hashed_password, tokens=user.garmin_tokens)
+                from activity_store import ActivityStore
+                from health_store import HealthStore
+                store = ActivityStore(db)
+                gm, _ = store.sync_user(user)
                 
-                # Get health metrics (HRV, sleep, stress, etc.)
-                health_metrics = gm.get_health_metrics()
+                # Get health metrics (HRV, sleep, stress, etc.) from the local health table
+                health_store = HealthStore(db)
+                health_store.sync(gm)
+                health_metrics = health_store.get_metrics(user.email)
                 if health_metrics:
                     recent_stats['health_metrics'] = health_metrics
                 
-                # Get recent activities (last 7 days)
-                recent_activities = gm.get_recent_activities(days=7)
+                # Get recent activities (last 7 days) from the local store
+                recent_activities = store.get_recent(user.email, 7)
                 if recent_activities:
                     recent_stats['recent_activities'] = recent_activities
                 
@@ -707,7 +944,7 @@ async def chat_with_coach(request: ChatRequest, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/chat/history/{email}")
-async def get_chat_history(email: str, limit: int = 50, db: Session = Depends(get_db)):
+def get_chat_history(email: str, limit: int = 50, db: Session = Depends(get_db)):
     """Get conversation history for user"""
     messages = db.query(ChatMessage).filter(
         ChatMessage.user_email == email
@@ -726,42 +963,53 @@ async def get_chat_history(email: str, limit: int = 50, db: Session = Depends(ge
     }
 
 @app.get("/api/user/challenges/{email}")
-async def get_challenges(email: str, db: Session = Depends(get_db)):
+def get_challenges(email: str, db: Session = Depends(get_db)):
     from database import Challenge, UserChallenge
-    from challenge_logic import ChallengeLogic
     
-    # Check if we need to generate new challenges
-    cl = ChallengeLogic(db)
-    cl.generate_weekly_challenges(email)
-    
-    # Get active/recent challenges
-    user_challenges = db.query(UserChallenge).filter(
+    # Read only: seeding, weekly assignment and expiry run in the nightly job (jobs.py)
+    # Get active/recent challenges with their definitions in one joined query
+    rows = db.query(UserChallenge, Challenge).join(
+        Challenge, UserChallenge.challenge_id == Challenge.id
+    ).filter(
         UserChallenge.user_email == email
     ).order_by(UserChallenge.start_date.desc()).limit(10).all()
     
     results = []
-    for uc in user_challenges:
-        ch = db.query(Challenge).filter(Challenge.id == uc.challenge_id).first()
-        if ch:
-            results.append({
-                "id": uc.id,
-                "title": ch.title,
-                "description": ch.description,
-                "category": ch.category,
-                "type": ch.challenge_type,
-                "metric": ch.metric,
-                "target_value": ch.target_value,
-                "current_value": uc.current_value,
-                "status": uc.status,
-                "badge": ch.badge_icon,
-                "xp": ch.xp_reward,
-                "end_date": uc.end_date
-            })
+    for uc, ch in rows:
+        results.append({
+            "id": uc.id,
+            "title": ch.title,
+            "description": ch.description,
+            "category": ch.category,
+            "type": ch.challenge_type,
+            "metric": ch.metric,
+            "target_value": ch.target_value,
+            "current_value": uc.current_value,
+            "status": uc.status,
+            "badge": ch.badge_icon,
+            "xp": ch.xp_reward,
+            "end_date": uc.end_date
+        })
             
     return results
 
+@app.get("/api/leaderboard")
+def get_leaderboard(limit: int = 20, after: Optional[str] = None, db: Session = Depends(get_db)):
+    """Athletes ranked by challenge XP. Pass the returned `next` cursor as `after` for the following page."""
+    from leaderboard import XpStore
+    try:
+        return XpStore(db).leaderboard(limit, after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/user/xp/{email}")
+def get_user_xp(email: str, db: Session = Depends(get_db)):
+    """XP, badges and leaderboard rank of one athlete."""
+    from leaderboard import XpStore
+    return XpStore(db).get(email)
+
 @app.get("/api/user/performance-history/{email}")
-async def get_performance_history(email: str, db: Session = Depends(get_db)):
+def get_performance_history(email: str, db: Session = Depends(get_db)):
     from database import PerformanceHistory
     
     history = db.query(PerformanceHistory).filter(
@@ -777,7 +1025,7 @@ async def get_performance_history(email: str, db: Session = Depends(get_db)):
     ]
 
 @app.delete("/api/chat/history/{email}")
-async def delete_chat_history(email: str, db: Session = Depends(get_db)):
+def delete_chat_history(email: str, db: Session = Depends(get_db)):
     """Clear conversation history for user"""
     try:
         db.query(ChatMessage).filter(ChatMessage.user_email == email).delete()
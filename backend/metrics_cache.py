@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+# Cache backend for Garmin-derived metrics: "performance" (thresholds, zones) and "training_stats" payloads.
+# Activities and health are read from their local tables (activity_store, health_store) instead.
+# "memory" keeps entries in this process; "sqlite" shares them between uvicorn workers through a local file.
+CACHE_BACKEND = os.getenv("METRICS_CACHE_BACKEND", "memory")
+CACHE_SQLITE_PATH = os.getenv("METRICS_CACHE_PATH", "./metrics_cache.db")
+CACHE_MAX_BYTES = int(os.getenv("METRICS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+# Time to live per kind of data, in seconds
+KIND_TTL_SECONDS = {
+    "training_stats": 15 * 60, # Also invalidated whenever the stored PMC series is rewritten
+    "performance": 6 * 60 * 60, # Thresholds/VO2max change rarely
+}
+DEFAULT_TTL_SECONDS = 5 * 60
+
+
+def cache_key(athlete, kind, window=None):
+    return f"{athlete}|{kind}|{json.dumps(window, sort_keys=True, default=str)}"
+
+
+class MetricsCache(ABC):
+    """
+    Cache interface: entries are keyed by (athlete, kind, window) and expire after the TTL of their kind.
+    Values must be JSON serializable; every get returns a fresh copy.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttls=None):
+        self.max_bytes = max_bytes
+        self.ttls = dict(KIND_TTL_SECONDS, **(ttls or {}))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, athlete, kind, window=None):
+        raw = self._get(cache_key(athlete, kind, window), time.time())
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(raw)
+
+    def set(self, athlete, kind, value, window=None, ttl=None):
+        raw = json.dumps(value, default=str)
+        ttl = ttl if ttl is not None else self.ttls.get(kind, DEFAULT_TTL_SECONDS)
+        self._set(cache_key(athlete, kind, window), athlete, kind, raw, time.time() + ttl)
+
+    def invalidate(self, athlete, kind=None):
+        """Drops every entry of the athlete (or only one kind of data)."""
+        self._invalidate(athlete, kind)
+
+    def clear(self):
+        """Drops every entry."""
+        self._clear()
+
+    def stats(self):
+        entries, size = self._usage()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    @abstractmethod
+    def _get(self, key, now):
+        """Raw JSON of a live entry (marking it recently used), or None."""
+
+    @abstractmethod
+    def _set(self, key, athlete, kind, raw, expires_at):
+        """Stores an entry, evicting least recently used ones beyond max_bytes."""
+
+    @abstractmethod
+    def _invalidate(self, athlete, kind):
+        """Drops the athlete's entries (of one kind, or all if kind is None)."""
+
+    @abstractmethod
+    def _clear(self):
+        """Drops every entry."""
+
+    @abstractmethod
+    def _usage(self):
+        """(entries, bytes) currently stored."""
+
+
+class MemoryCache(MetricsCache):
+    """In-process LRU bounded by the serialized size of its entries."""
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttls=None):
+        super().__init__(max_bytes, ttls)
+        # Format: { key: (athlete, kind, raw_json, expires_at) }, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def _get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[3] <= now:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def _set(self, key, athlete, kind, raw, expires_at):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if len(raw) > self.max_bytes:
+                return
+            self._entries[key] = (athlete, kind, raw, expires_at)
+            self._bytes += len(raw)
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry[2])
+
+    def _invalidate(self, athlete, kind):
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e[0] == athlete and (kind is None or e[1] == kind)]:
+                self._drop(key)
+
+    def _clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _usage(self):
+        return len(self._entries), self._bytes
+
+
+class SQLiteCache(MetricsCache):
+    """LRU shared by every worker on the host through one SQLite file (WAL mode)."""
+
+    def __init__(self, path=CACHE_SQLITE_PATH, max_bytes=CACHE_MAX_BYTES, ttls=None):
+        super().__init__(max_bytes, ttls)
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metrics_cache ("
+                "key TEXT PRIMARY KEY, athlete TEXT, kind TEXT, value TEXT, "
+                "size INTEGER, expires_at REAL, last_used REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_metrics_cache_athlete ON metrics_cache (athlete, kind)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_metrics_cache_last_used ON metrics_cache (last_used)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _get(self, key, now):
+        conn = self._conn()
+        row = conn.execute("SELECT value, expires_at FROM metrics_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            conn.execute("DELETE FROM metrics_cache WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE metrics_cache SET last_used = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def _set(self, key, athlete, kind, raw, expires_at):
+        if len(raw) > self.max_bytes:
+            return
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO metrics_cache (key, athlete, kind, value, size, expires_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, athlete, kind, raw, len(raw), expires_at, time.time())
+            )
+            # Expired entries go first, then least recently used ones until under the cap
+            conn.execute("DELETE FROM metrics_cache WHERE expires_at <= ?", (time.time(),))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM metrics_cache").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in conn.execute("SELECT key, size FROM metrics_cache ORDER BY last_used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM metrics_cache WHERE key = ?", (old_key,))
+                    total -= size
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _invalidate(self, athlete, kind):
+        if kind is None:
+            self._conn().execute("DELETE FROM metrics_cache WHERE athlete = ?", (athlete,))
+        else:
+            self._conn().execute("DELETE FROM metrics_cache WHERE athlete = ? AND kind = ?", (athlete, kind))
+
+    def _clear(self):
+        self._conn().execute("DELETE FROM metrics_cache")
+
+    def _usage(self):
+        return self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM metrics_cache").fetchone()
+
+
+def make_cache(backend=CACHE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteCache()
+    return MemoryCache()
+
+
+METRICS_CACHE = make_cache()
@@ -0,0 +1,264 @@
+import datetime
+import numpy as np
+
+# Performance Management Chart time constants (days)
+CTL_DAYS = 42
+ATL_DAYS = 7
+# Days per chunk of the blocked EMA. Decay powers inside a chunk stay in (0, 1], so the closed form is exact
+# and stable; only one step per chunk is sequential.
+EMA_CHUNK = 64
+
+# Longest chart window served by the API (days)
+MAX_STATS_DAYS = 3650
+
+SPORTS = ("swim", "bike", "run")
+SPORT_ROWS = {sport: row for row, sport in enumerate(SPORTS)}
+# Rows of the daily load array: combined load first, then one row per sport
+LOAD_ROWS = ("total",) + SPORTS
+
+# Load model defaults when the athlete profile lacks a threshold
+DEFAULT_HR_REST = 60
+LTHR_FROM_HR_MAX = 0.89
+
+
+def sport_of(act_type):
+    """'swim' | 'bike' | 'run' | None from a Garmin activity typeKey."""
+    act_type = (act_type or "").lower()
+    if "swim" in act_type: return "swim"
+    if "cycl" in act_type or "bik" in act_type: return "bike" # cycling, road_biking, mountain_biking
+    if "run" in act_type: return "run"
+    return None
+
+
+def parse_css(text):
+    """Critical swim speed in m/s from the profile's 'M:SS' per 100 m, or None."""
+    try:
+        m, s = map(int, str(text).split(":"))
+    except (TypeError, ValueError):
+        return None
+    sec_100 = m * 60 + s
+    return 100.0 / sec_100 if sec_100 > 0 else None
+
+
+def athlete_params(user):
+    """Load model parameters (thresholds and time constants) from a User row; None entries use the defaults."""
+    if user is None:
+        return {}
+    lthr = user.lactate_threshold_hr or (round(user.hr_max * LTHR_FROM_HR_MAX) if user.hr_max else None)
+    return {
+        "ctl_days": user.ctl_days or CTL_DAYS,
+        "atl_days": user.atl_days or ATL_DAYS,
+        "ftp": user.ftp,
+        "lthr": lthr,
+        "hr_rest": user.hr_rest or DEFAULT_HR_REST,
+        "css": parse_css(user.css),
+    }
+
+
+def activity_load(act, params=None):
+    """
+    Training stress of a summarized activity, best available model first:
+      - bike power TSS: hours * (NP / FTP)^2 * 100
+      - swim TSS: hours * (speed / CSS)^3 * 100
+      - hrTSS: hours * ((avgHR - rest) / (LTHR - rest))^2 * 100
+      - Garmin's trainingLoad, else duration in minutes * sport intensity multiplier
+    Without params only the last two apply.
+    """
+    params = params or {}
+    act_type = (act.get("type") or "").lower()
+    sport = sport_of(act_type)
+    dur_min = act.get("duration_min") or 0
+    hours = dur_min / 60.0
+
+    if hours > 0:
+        ftp, np_watts = params.get("ftp"), act.get("norm_power")
+        if sport == "bike" and ftp and np_watts:
+            return hours * (np_watts / ftp) ** 2 * 100
+
+        css, dist_km = params.get("css"), act.get("distance_km")
+        if sport == "swim" and css and dist_km:
+            speed = dist_km * 1000.0 / (dur_min * 60.0)
+            return hours * (speed / css) ** 3 * 100
+
+        lthr, hr_rest, avg_hr = params.get("lthr"), params.get("hr_rest") or DEFAULT_HR_REST, act.get("avg_hr")
+        if lthr and avg_hr and lthr > hr_rest:
+            intensity = max(avg_hr - hr_rest, 0) / (lthr - hr_rest)
+            return hours * intensity ** 2 * 100
+
+    load = act.get("training_load")
+    if not load:
+        mult = 0.6 # basic
+        if "run" in act_type: mult = 0.8
+        elif "cycl" in act_type: mult = 0.7
+        elif "swim" in act_type: mult = 1.0
+        load = dur_min * mult
+    return load
+
+
+def bin_activities(activities, start_date, n_days, params=None):
+    """
+    Bins summarized activities into day-indexed arrays starting at start_date, in one pass.
+    Returns (load[4, n_days], volume[3, n_days]): load rows follow LOAD_ROWS (combined, then per sport),
+    volume is minutes per SPORTS row. Activities outside the range or without a date are ignored.
+    """
+    load = np.zeros((len(LOAD_ROWS), n_days))
+    volume = np.zeros((len(SPORTS), n_days))
+    if not activities:
+        return load, volume
+
+    dates = np.array([(a.get("date") or "")[:10] or "NaT" for a in activities], dtype="datetime64[D]")
+    idx = (dates - np.datetime64(start_date, "D")).astype(np.int64)
+    valid = ~np.isnat(dates) & (idx >= 0) & (idx < n_days)
+
+    loads = np.fromiter((activity_load(a, params) for a in activities), dtype=np.float64, count=len(activities))
+    np.add.at(load[0], idx[valid], loads[valid])
+
+    durations = np.fromiter((a.get("duration_min") or 0 for a in activities), dtype=np.float64, count=len(activities))
+    rows = np.fromiter((SPORT_ROWS.get(sport_of(a.get("type")), -1) for a in activities), dtype=np.int64, count=len(activities))
+    valid &= rows >= 0
+    np.add.at(volume, (rows[valid], idx[valid]), durations[valid])
+    np.add.at(load, (rows[valid] + 1, idx[valid]), loads[valid])
+    return load, volume
+
+
+def ema(loads, days, initial=None):
+    """
+    Exponentially weighted load along the last axis, exactly the PMC recursion
+        y[t] = y[t-1] + (x[t] - y[t-1]) / days
+    for any leading shape (one row per athlete). `days` is a scalar or broadcasts to the leading shape.
+
+    The series is split into EMA_CHUNK-day blocks. Inside a block the recursion from a zero start is a
+    lower-triangular Toeplitz matrix product, done for every athlete and block in one matmul; the block
+    start values are then carried forward with one vector step per block.
+    """
+    x = np.asarray(loads, dtype=np.float64)
+    lead, n = x.shape[:-1], x.shape[-1]
+    if n == 0:
+        return x.copy()
+    d = np.asarray(days, dtype=np.float64)
+    if d.ndim:
+        # Per-row time constants: rows sharing one (usually all of them) are filtered together
+        d = np.broadcast_to(d, lead)
+        init = np.broadcast_to(np.asarray(0.0 if initial is None else initial, dtype=np.float64), lead)
+        out = np.empty(x.shape)
+        for value in np.unique(d):
+            rows = d == value
+            out[rows] = ema(x[rows], float(value), initial=init[rows])
+        return out
+    a = 1.0 - 1.0 / days
+    b = min(EMA_CHUNK, n)
+    n_chunks = -(-n // b)
+
+    padded = np.zeros(lead + (n_chunks * b,))
+    padded[..., :n] = x
+    blocks = padded.reshape(lead + (n_chunks, b))
+
+    # L[i, j] = a^(i-j) / days for j <= i
+    steps = np.arange(b)
+    diff = steps[:, None] - steps[None, :]
+    kernel = np.where(diff >= 0, a ** np.maximum(diff, 0), 0.0) / days
+    local = blocks @ kernel.T
+
+    # Carry each block's end value into the next one: y = local + a^(i+1) * carry
+    decay = a ** (steps + 1)
+    carry = np.zeros(lead) if initial is None else np.broadcast_to(np.asarray(initial, dtype=np.float64), lead).copy()
+    out = np.empty_like(local)
+    for c in range(n_chunks):
+        out[..., c, :] = local[..., c, :] + decay * carry[..., None]
+        carry = out[..., c, -1]
+    return out.reshape(lead + (n_chunks * b,))[..., :n]
+
+
+def pmc(loads, ctl_days=CTL_DAYS, atl_days=ATL_DAYS):
+    """(ctl, atl, tsb) arrays for daily loads of shape (..., n_days)."""
+    ctl = ema(loads, ctl_days)
+    atl = ema(loads, atl_days)
+    return ctl, atl, ctl - atl
+
+
+def stats_payload(ctl, atl, volume, first_day, offsets=None):
+    """
+    Dashboard payload from one athlete's PMC arrays (ctl/atl shaped [LOAD_ROWS, points]), starting the chart
+    at first_day. Top-level fitness/fatigue/form are the combined load; by_sport has the per-sport values.
+    offsets are the points' day offsets from first_day (default: one point per consecutive day).
+    """
+    n = ctl.shape[-1]
+    offsets = np.arange(n) if offsets is None else np.asarray(offsets)
+    iso = np.datetime_as_string(np.datetime64(first_day, "D") + offsets, unit="D").tolist()
+    labels = [d[8:10] + "/" + d[5:7] for d in iso] # dd/mm
+    fitness, fatigue, form = np.round(ctl, 1).tolist(), np.round(atl, 1).tolist(), np.round(ctl - atl, 1).tolist()
+    swim, bike, run = np.round(volume).astype(np.int64).tolist()
+    history = [{
+        "day": labels[i],
+        "date": iso[i],
+        "fitness": fitness[0][i],
+        "fatigue": fatigue[0][i],
+        "form": form[0][i],
+        "swim": swim[i],
+        "bike": bike[i],
+        "run": run[i],
+        "by_sport": {sport: {"fitness": fitness[r][i], "fatigue": fatigue[r][i], "form": form[r][i]}
+                     for r, sport in enumerate(SPORTS, 1)}
+    } for i in range(n)]
+
+    last = [(float(ctl[r, -1]), float(atl[r, -1])) if n else (0.0, 0.0) for r in range(len(LOAD_ROWS))]
+    last_tsb = last[0][0] - last[0][1]
+    return {
+        "history": history,
+        "current": {
+            "fitness": round(last[0][0]),
+            "fatigue": round(last[0][1]),
+            "form": round(last_tsb),
+            "readiness": "Good" if last_tsb > -10 else "Tired",
+            "by_sport": {sport: {"fitness": round(last[r][0]), "fatigue": round(last[r][1]), "form": round(last[r][0] - last[r][1])}
+                         for r, sport in enumerate(SPORTS, 1)}
+        }
+    }
+
+
+def _window(days, end_date, ctl_days=CTL_DAYS):
+    end_date = end_date or datetime.date.today()
+    start_date = end_date - datetime.timedelta(days=days + ctl_days) # Extra buffer for CTL warmup
+    return start_date, (end_date - start_date).days + 1
+
+
+def compute_training_stats(activities, days=60, end_date=None, params=None):
+    """
+    Calculates combined and per-sport CTL, ATL, TSB from summarized activities (see garmin_sync.summarize_activity).
+    CTL (Chronic Training Load) - ctl_days (default 42) average load (Fitness)
+    ATL (Acute Training Load) - atl_days (default 7) average load (Fatigue)
+    TSB (Training Stress Balance) - CTL - ATL (Form)
+    params come from athlete_params. The chart keeps the last `days` + 1 days.
+    """
+    params = params or {}
+    ctl_days, atl_days = params.get("ctl_days") or CTL_DAYS, params.get("atl_days") or ATL_DAYS
+    start_date, n_days = _window(days, end_date, ctl_days)
+    load, volume = bin_activities(activities, start_date, n_days, params)
+    ctl, atl, _ = pmc(load, ctl_days, atl_days)
+    keep = n_days - (days + 1)
+    return stats_payload(ctl[:, keep:], atl[:, keep:], volume[:, keep:], start_date + datetime.timedelta(days=keep))
+
+
+def compute_roster_stats(activities_by_athlete, days=60, end_date=None, params_by_athlete=None):
+    """
+    compute_training_stats for many athletes at once (coach roster, nightly recompute):
+    loads are stacked into an (athletes, LOAD_ROWS, days) array and filtered in one pass,
+    each athlete with their own time constants. Returns {athlete: stats}.
+    """
+    params_by_athlete = params_by_athlete or {}
+    athletes = list(activities_by_athlete)
+    params = [params_by_athlete.get(athlete) or {} for athlete in athletes]
+    ctl_days = np.array([p.get("ctl_days") or CTL_DAYS for p in params], dtype=np.float64)
+    atl_days = np.array([p.get("atl_days") or ATL_DAYS for p in params], dtype=np.float64)
+
+    start_date, n_days = _window(days, end_date, int(ctl_days.max()) if athletes else CTL_DAYS)
+    loads = np.zeros((len(athletes), len(LOAD_ROWS), n_days))
+    volumes = np.zeros((len(athletes), len(SPORTS), n_days))
+    for i, athlete in enumerate(athletes):
+        loads[i], volumes[i] = bin_activities(activities_by_athlete[athlete], start_date, n_days, params[i])
+
+    ctl, atl, _ = pmc(loads, ctl_days[:, None], atl_days[:, None])
+    keep = n_days - (days + 1)
+    first_day = start_date + datetime.timedelta(days=keep)
+    return {athlete: stats_payload(ctl[i, :, keep:], atl[i, :, keep:], volumes[i, :, keep:], first_day)
+            for i, athlete in enumerate(athletes)}
@@ -0,0 +1,198 @@
+import datetime
+import numpy as np
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from database import Activity, PmcDaily, User
+from downsample import downsample
+from metrics_cache import METRICS_CACHE
+from rollups import RollupStore, week_start
+from pmc_engine import bin_activities, ema, stats_payload, athlete_params, CTL_DAYS, ATL_DAYS, SPORTS, LOAD_ROWS
+
+PMC_COLUMNS = ["load", "ctl", "atl", "tsb", "by_sport"] + list(SPORTS)
+
+
+def upsert_daily(db: Session, rows):
+    """
+    Writes pmc_daily rows, replacing existing (user_email, date) ones in the same statement, so a
+    concurrent roll forward of the same athlete (background sync, dashboard read, another worker)
+    cannot hit uq_pmc_daily_user_date. Dialects without ON CONFLICT fall back to delete + insert.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(PmcDaily)
+        stmt = stmt.on_conflict_do_update(index_elements=["user_email", "date"],
+                                          set_={c: stmt.excluded[c] for c in PMC_COLUMNS})
+        db.execute(stmt, rows)
+        return
+    for row in rows:
+        db.query(PmcDaily).filter(PmcDaily.user_email == row["user_email"], PmcDaily.date == row["date"]).delete(synchronize_session=False)
+    db.execute(insert(PmcDaily), rows)
+
+
+class PmcStore:
+    """
+    Daily combined and per-sport CTL/ATL/TSB per athlete, stored from the first activity onwards.
+    New activities roll the series forward from the earliest affected date, seeded with the stored
+    values of the day before, so a new day costs O(1) and reads are a range query.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def last_date(self, user_email: str):
+        value = self.db.query(func.max(PmcDaily.date)).filter(PmcDaily.user_email == user_email).scalar()
+        return datetime.date.fromisoformat(value) if value else None
+
+    def _first_activity_date(self, user_email):
+        value = self.db.query(func.min(Activity.date)).filter(
+            Activity.user_email == user_email,
+            Activity.date != ""
+        ).scalar()
+        return datetime.date.fromisoformat(value) if value else None
+
+    def _params(self, user_email):
+        return athlete_params(self.db.query(User).filter(User.email == user_email).first())
+
+    def _seed(self, user_email, day):
+        """(ctl[LOAD_ROWS], atl[LOAD_ROWS]) stored for `day`, or zeros."""
+        row = self.db.query(PmcDaily.ctl, PmcDaily.atl, PmcDaily.by_sport).filter(
+            PmcDaily.user_email == user_email,
+            PmcDaily.date == day.isoformat()
+        ).first()
+        ctl, atl = np.zeros(len(LOAD_ROWS)), np.zeros(len(LOAD_ROWS))
+        if row:
+            ctl[0], atl[0] = row[0], row[1]
+            for r, sport in enumerate(SPORTS, 1):
+                values = (row[2] or {}).get(sport) or {}
+                ctl[r], atl[r] = values.get("ctl", 0.0), values.get("atl", 0.0)
+        return ctl, atl
+
+    def roll_forward(self, user_email: str, from_date=None, to_date=None):
+        """
+        Recomputes the stored days from `from_date` (default: the day after the last stored one) to `to_date`
+        (default today). Returns the number of days written.
+        """
+        to_date = to_date or datetime.date.today()
+        first = self._first_activity_date(user_email)
+        if first is None:
+            return 0
+        last = self.last_date(user_email)
+        if last is None:
+            start = first
+        else:
+            # Never leave a gap between the stored series and the recomputed part
+            start = min(from_date or last + datetime.timedelta(days=1), last + datetime.timedelta(days=1))
+            start = max(start, first)
+        if start > to_date:
+            return 0
+
+        n_days = (to_date - start).days + 1
+        rows = self.db.query(Activity.summary).filter(
+            Activity.user_email == user_email,
+            Activity.date >= start.isoformat(),
+            Activity.date <= to_date.isoformat()
+        ).all()
+        # One pass over the activities gives the combined and per-sport load rows
+        params = self._params(user_email)
+        load, volume = bin_activities([row[0] for row in rows], start, n_days, params)
+        seed_ctl, seed_atl = self._seed(user_email, start - datetime.timedelta(days=1))
+        ctl = ema(load, params.get("ctl_days") or CTL_DAYS, initial=seed_ctl)
+        atl = ema(load, params.get("atl_days") or ATL_DAYS, initial=seed_atl)
+
+        # Days after to_date were computed from a longer series: drop them, the range itself is upserted
+        self.db.query(PmcDaily).filter(
+            PmcDaily.user_email == user_email,
+            PmcDaily.date > to_date.isoformat()
+        ).delete(synchronize_session=False)
+        dates = np.datetime_as_string(np.datetime64(start, "D") + np.arange(n_days), unit="D").tolist()
+        columns = {"load": load[0], "ctl": ctl[0], "atl": atl[0], "tsb": ctl[0] - atl[0]}
+        columns.update(zip(SPORTS, volume))
+        columns = {name: values.tolist() for name, values in columns.items()}
+        per_sport = {sport: (load[r].tolist(), ctl[r].tolist(), atl[r].tolist()) for r, sport in enumerate(SPORTS, 1)}
+        upsert_daily(self.db, [
+            {"user_email": user_email, "date": d, **{name: values[i] for name, values in columns.items()},
+             "by_sport": {sport: {"load": l[i], "ctl": c[i], "atl": a[i]} for sport, (l, c, a) in per_sport.items()}}
+            for i, d in enumerate(dates)
+        ])
+        self.db.commit()
+        # Cached payloads were read from the series just rewritten
+        METRICS_CACHE.invalidate(user_email, "training_stats")
+        return n_days
+
+    def rebuild(self, user_email: str):
+        """Drops and recomputes the athlete's whole series (after reprocessing activities)."""
+        self.db.query(PmcDaily).filter(PmcDaily.user_email == user_email).delete(synchronize_session=False)
+        self.db.commit()
+        METRICS_CACHE.invalidate(user_email, "training_stats")
+        return self.roll_forward(user_email)
+
+    def get_stats(self, user_email: str, days=60, end_date=None, points=None, bucket=None):
+        """
+        Same payload as pmc_engine.compute_training_stats, read from the stored series
+        (rolled forward to today first). Days before the first activity are zeros.
+        bucket ('week'|'month') or points (LTTB) shrink the history for long ranges, see downsample.downsample.
+        Volume per day and per week (weekly_volume, minutes per sport) comes from the rollups.
+        Payloads are cached per window until the series is rewritten. Only days up to today are stored:
+        days after it are the stored values decayed with no load, computed in memory.
+        """
+        today = datetime.date.today()
+        end_date = end_date or today
+        window = (days, end_date.isoformat(), points, bucket)
+        cached = METRICS_CACHE.get(user_email, "training_stats", window)
+        if cached is not None:
+            return cached
+        stored_end = min(end_date, today)
+        if (self.last_date(user_email) or datetime.date.min) < stored_end:
+            self.roll_forward(user_email, to_date=stored_end)
+
+        first_day = end_date - datetime.timedelta(days=days)
+        rows = self.db.query(PmcDaily.date, PmcDaily.ctl, PmcDaily.atl, PmcDaily.by_sport).filter(
+            PmcDaily.user_email == user_email,
+            PmcDaily.date >= first_day.isoformat(),
+            PmcDaily.date <= stored_end.isoformat()
+        ).order_by(PmcDaily.date).all()
+
+        ctl, atl = np.zeros((len(LOAD_ROWS), days + 1)), np.zeros((len(LOAD_ROWS), days + 1))
+        volume = np.zeros((len(SPORTS), days + 1))
+        if rows:
+            dates = np.array([row[0] for row in rows], dtype="datetime64[D]")
+            idx = (dates - np.datetime64(first_day, "D")).astype(np.int64)
+            ctl[0, idx] = [row[1] for row in rows]
+            atl[0, idx] = [row[2] for row in rows]
+            for r, sport in enumerate(SPORTS, 1):
+                ctl[r, idx] = [((row[3] or {}).get(sport) or {}).get("ctl", 0.0) for row in rows]
+                atl[r, idx] = [((row[3] or {}).get(sport) or {}).get("atl", 0.0) for row in rows]
+
+        # Volume is read from the daily/weekly rollups the sync maintains
+        rollups = RollupStore(self.db)
+        rollups.ensure(user_email)
+        daily = rollups.daily(user_email, first_day.isoformat(), stored_end.isoformat())
+        if daily:
+            idx = [(datetime.date.fromisoformat(row["date"]) - first_day).days for row in daily]
+            volume[:, idx] = [[row[f"{sport}_duration_min"] for row in daily] for sport in SPORTS]
+
+        tail = (end_date - stored_end).days
+        if tail:
+            # Days after today are not stored: today's values decayed with no load, y[k] = y[0] * (1 - 1/days)^k
+            params = self._params(user_email)
+            seed_ctl, seed_atl = self._seed(user_email, stored_end)
+            n = min(tail, days + 1)
+            k = np.arange(tail - n + 1, tail + 1)
+            ctl[:, -n:] = seed_ctl[:, None] * (1.0 - 1.0 / (params.get("ctl_days") or CTL_DAYS)) ** k
+            atl[:, -n:] = seed_atl[:, None] * (1.0 - 1.0 / (params.get("atl_days") or ATL_DAYS)) ** k
+
+        offsets = None
+        if bucket or (points and points < days + 1):
+            ctl, atl, volume, offsets = downsample(ctl, atl, volume, first_day, points=points, bucket=bucket)
+        payload = stats_payload(ctl, atl, volume, first_day, offsets)
+        payload["weekly_volume"] = [
+            {"week_start": row["week_start"], "sessions": row["sessions"], "load": round(row["load"], 1),
+             **{sport: round(row[f"{sport}_duration_min"]) for sport in SPORTS}}
+            for row in rollups.weekly(user_email, week_start(first_day.isoformat()), stored_end.isoformat())
+        ]
+        METRICS_CACHE.set(user_email, "training_stats", payload, window)
+        return payload
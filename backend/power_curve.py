@@ -0,0 +1,171 @@
+import datetime
+import numpy as np
+from sqlalchemy.orm import Session
+from database import PowerCurve, Activity
+from pmc_engine import sport_of
+
+# Best-effort durations in seconds (1 s to 5 h)
+CURVE_DURATIONS = [1, 2, 3, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 300, 420, 600, 900, 1200,
+                   1800, 2400, 3600, 5400, 7200, 10800, 14400, 18000]
+ROLLING_DAYS = 90
+FTP_DURATION = 1200 # FTP = 95% of the best 20 minute power
+FTP_FACTOR = 0.95
+# Rides with a 20 minute best needed in the rolling window before the curve FTP is trusted
+FTP_MIN_RIDES = 3
+RUN_TYPES = ("running", "trail_running", "treadmill_running", "track_running")
+
+
+def mean_max(values, durations=CURVE_DURATIONS):
+    """
+    Best average of `values` over each window length, from one cumulative sum:
+    every window mean is (c[i+d] - c[i]) / d, so each duration is a single vectorized pass (O(n) per duration).
+    Durations longer than the stream are NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    c = np.concatenate(([0.0], np.cumsum(values)))
+    n = len(values)
+    out = np.full(len(durations), np.nan)
+    for i, d in enumerate(durations):
+        if d <= n:
+            out[i] = (c[d:] - c[:-d]).max() / d
+    return out
+
+
+def _to_json(values):
+    return [None if np.isnan(v) else round(float(v), 2) for v in values]
+
+
+def _from_json(values):
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def merge_best(current, candidate):
+    """Element-wise best of two curves (each {'values', 'activity_ids', 'dates'}). Returns the merged curve."""
+    cur = _from_json(current["values"])
+    new = _from_json(candidate["values"])
+    better = np.nan_to_num(new, nan=-1.0) > np.nan_to_num(cur, nan=-1.0)
+    return {
+        "durations": CURVE_DURATIONS,
+        "values": [c if not b else v for c, v, b in zip(current["values"], candidate["values"], better)],
+        "activity_ids": [c if not b else v for c, v, b in zip(current["activity_ids"], candidate["activity_ids"], better)],
+        "dates": [c if not b else v for c, v, b in zip(current["dates"], candidate["dates"], better)],
+    }
+
+
+def _empty_curve():
+    k = len(CURVE_DURATIONS)
+    return {"durations": CURVE_DURATIONS, "values": [None] * k, "activity_ids": [None] * k, "dates": [None] * k}
+
+
+class CurveStore:
+    """
+    Per-activity mean-maximal curves plus each athlete's all-time and rolling 90 day bests.
+    A new activity is merged into the aggregates in O(durations); streams are never re-read.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _row(self, user_email, kind, scope, activity_id=None):
+        return self.db.query(PowerCurve).filter(
+            PowerCurve.user_email == user_email,
+            PowerCurve.kind == kind,
+            PowerCurve.scope == scope,
+            PowerCurve.activity_id == activity_id
+        ).first()
+
+    def _save(self, user_email, kind, scope, curve, activity_id=None, date=None):
+        row = self._row(user_email, kind, scope, activity_id)
+        if row is None:
+            row = PowerCurve(user_email=user_email, kind=kind, scope=scope, activity_id=activity_id)
+            self.db.add(row)
+        row.date = date
+        row.curve = curve
+        row.updated_at = datetime.datetime.now().isoformat()
+        return row
+
+    def add_activity(self, user_email: str, activity_id: int, date: str, streams, activity_type=None):
+        """
+        Computes the activity's curves from its streams and merges them into the athlete's bests.
+        The power curve only takes rides (running power is on another scale); the pace curve only runs.
+        """
+        kinds = []
+        if "power" in streams and streams["power"].any() and sport_of(activity_type) == "bike":
+            kinds.append(("power", streams["power"]))
+        if "speed" in streams and (activity_type or "") in RUN_TYPES:
+            kinds.append(("speed", streams["speed"]))
+
+        for kind, values in kinds:
+            values = _to_json(mean_max(values))
+            curve = {"durations": CURVE_DURATIONS, "values": values,
+                     "activity_ids": [activity_id if v is not None else None for v in values],
+                     "dates": [date if v is not None else None for v in values]}
+            self._save(user_email, kind, "activity", curve, activity_id, date)
+
+            all_time = self._row(user_email, kind, "all_time")
+            self._save(user_email, kind, "all_time", merge_best(all_time.curve if all_time else _empty_curve(), curve))
+
+            rolling = self._row(user_email, kind, "rolling_90")
+            cutoff = (datetime.date.today() - datetime.timedelta(days=ROLLING_DAYS)).isoformat()
+            if date >= cutoff:
+                self._save(user_email, kind, "rolling_90", merge_best(rolling.curve if rolling else _empty_curve(), curve))
+        self.db.commit()
+        return [kind for kind, _ in kinds]
+
+    def _refresh_rolling(self, user_email, kind, row):
+        """Rebuilds the rolling bests from the stored per-activity curves when some best left the window."""
+        cutoff = (datetime.date.today() - datetime.timedelta(days=ROLLING_DAYS)).isoformat()
+        if row and all(d is None or d >= cutoff for d in row.curve["dates"]):
+            return row
+        curve = _empty_curve()
+        for act in self.db.query(PowerCurve).filter(
+            PowerCurve.user_email == user_email,
+            PowerCurve.kind == kind,
+            PowerCurve.scope == "activity",
+            PowerCurve.date >= cutoff
+        ).all():
+            curve = merge_best(curve, act.curve)
+        if row is None and all(v is None for v in curve["values"]):
+            return None
+        row = self._save(user_email, kind, "rolling_90", curve)
+        self.db.commit()
+        return row
+
+    def get(self, user_email: str, kind="power", scope="all_time"):
+        """Stored curve ({'durations', 'values', 'activity_ids', 'dates'}) or None."""
+        row = self._row(user_email, kind, scope)
+        if scope == "rolling_90":
+            row = self._refresh_rolling(user_email, kind, row)
+        if row is None or all(v is None for v in row.curve["values"]):
+            return None
+        return row.curve
+
+    def estimate_ftp(self, user_email: str):
+        """
+        95% of the best 20 minute power of the rides of the last 90 days.
+        None unless at least FTP_MIN_RIDES rides of the window have a 20 minute power best.
+        """
+        idx = CURVE_DURATIONS.index(FTP_DURATION)
+        cutoff = (datetime.date.today() - datetime.timedelta(days=ROLLING_DAYS)).isoformat()
+        rows = self.db.query(PowerCurve.curve, Activity.activity_type).join(
+            Activity, (Activity.user_email == PowerCurve.user_email) & (Activity.activity_id == PowerCurve.activity_id)
+        ).filter(
+            PowerCurve.user_email == user_email,
+            PowerCurve.kind == "power",
+            PowerCurve.scope == "activity",
+            PowerCurve.date >= cutoff
+        ).all()
+        # Type checked here too: curves stored before rides-only filtering may come from runs
+        bests = [curve["values"][idx] for curve, activity_type in rows
+                 if sport_of(activity_type) == "bike" and curve["values"][idx]]
+        if len(bests) < FTP_MIN_RIDES:
+            return None
+        return int(round(max(bests) * FTP_FACTOR))
+
+
+def activity_type_of(db: Session, user_email: str, activity_id: int):
+    row = db.query(Activity.activity_type).filter(
+        Activity.user_email == user_email,
+        Activity.activity_id == activity_id
+    ).first()
+    return row[0] if row else None
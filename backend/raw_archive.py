@@ -0,0 +1,159 @@
+import os
+import json
+import zlib
+import datetime
+from sqlalchemy.orm import Session
+from database import RawPayload, Activity, HealthDaily
+
+try:
+    import zstandard
+except ImportError: # Optional: falls back to zlib
+    zstandard = None
+
+# Codec for new payloads. Both codecs can always be read back (zstd needs the zstandard package).
+ARCHIVE_CODEC = os.getenv("RAW_ARCHIVE_CODEC", "zstd" if zstandard else "zlib")
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+# Rows per batch when reprocessing
+REPROCESS_BATCH = 500
+
+HEALTH_KINDS = ("sleep", "summary", "hrv")
+
+
+def compress_payload(obj, codec=None):
+    """JSON-encodes and compresses a Garmin payload. Returns (codec, compressed bytes, raw size)."""
+    codec = codec or ARCHIVE_CODEC
+    raw = json.dumps(obj, separators=(",", ":")).encode()
+    if codec == "zstd" and zstandard:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw), len(raw)
+    return "zlib", zlib.compress(raw, ZLIB_LEVEL), len(raw)
+
+
+def decompress_payload(codec, data):
+    if codec == "zstd":
+        if not zstandard:
+            raise RuntimeError("zstandard is required to read zstd archived payloads")
+        return json.loads(zstandard.ZstdDecompressor().decompress(data))
+    return json.loads(zlib.decompress(data))
+
+
+class RawArchive:
+    """Compressed copy of every raw Garmin payload we download, so derived data can be rebuilt offline."""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def store(self, user_email: str, kind: str, source_key, payload, date=None, fetched_at=None):
+        """Adds or replaces one payload. The caller commits."""
+        source_key = str(source_key)
+        codec, data, raw_size = compress_payload(payload)
+        row = self.db.query(RawPayload).filter(
+            RawPayload.user_email == user_email,
+            RawPayload.kind == kind,
+            RawPayload.source_key == source_key
+        ).first()
+        if row is None:
+            row = RawPayload(user_email=user_email, kind=kind, source_key=source_key)
+            self.db.add(row)
+        row.date = date
+        row.codec = codec
+        row.raw_size = raw_size
+        row.payload = data
+        row.fetched_at = fetched_at or datetime.datetime.now().isoformat()
+        return row
+
+    def store_health_day(self, user_email: str, d, sleep_raw, stats, hrv_raw=None, fetched_at=None):
+        for kind, payload in zip(HEALTH_KINDS, (sleep_raw, stats, hrv_raw)):
+            if payload is not None:
+                self.store(user_email, kind, d, payload, date=d, fetched_at=fetched_at)
+
+    def get(self, user_email: str, kind: str, source_key):
+        row = self.db.query(RawPayload.codec, RawPayload.payload).filter(
+            RawPayload.user_email == user_email,
+            RawPayload.kind == kind,
+            RawPayload.source_key == str(source_key)
+        ).first()
+        return decompress_payload(row[0], row[1]) if row else None
+
+    def iter_payloads(self, user_email: str, kind: str):
+        """Yields (source_key, date, payload) in date order. Each payload is decompressed only when reached."""
+        rows = self.db.query(RawPayload.source_key, RawPayload.date, RawPayload.codec, RawPayload.payload).filter(
+            RawPayload.user_email == user_email,
+            RawPayload.kind == kind
+        ).order_by(RawPayload.date, RawPayload.source_key).yield_per(REPROCESS_BATCH)
+        for source_key, date, codec, data in rows:
+            yield source_key, date, decompress_payload(codec, data)
+
+    def athletes(self):
+        return [row[0] for row in self.db.query(RawPayload.user_email).distinct().all()]
+
+    def usage(self, user_email: str = None):
+        """(payload count, uncompressed bytes) without loading the payloads."""
+        from sqlalchemy import func
+        q = self.db.query(func.count(RawPayload.id), func.coalesce(func.sum(RawPayload.raw_size), 0))
+        if user_email:
+            q = q.filter(RawPayload.user_email == user_email)
+        return tuple(q.one())
+
+
+def reprocess_activities(db: Session, user_email: str):
+    """Rebuilds the athlete's activities table rows from archived raw activities. Returns rows written."""
+    from garmin_sync import summarize_activity
+
+    existing = {row.activity_id: row for row in db.query(Activity).filter(Activity.user_email == user_email).all()}
+    now = datetime.datetime.now().isoformat()
+    count = 0
+    for _, _, act in RawArchive(db).iter_payloads(user_email, "activity"):
+        summary = summarize_activity(act)
+        row = existing.get(act.get("activityId"))
+        if row is None:
+            row = Activity(user_email=user_email, activity_id=act.get("activityId"), synced_at=now)
+            db.add(row)
+        row.start_time_local = act.get("startTimeLocal") or ""
+        row.date = summary["date"]
+        row.activity_type = summary["type"]
+        row.summary = summary
+        count += 1
+        if count % REPROCESS_BATCH == 0:
+            db.flush()
+    db.commit()
+
+    from pmc_store import PmcStore
+    from rollups import RollupStore
+    PmcStore(db).rebuild(user_email)
+    RollupStore(db).rebuild(user_email)
+    return count
+
+
+def reprocess_health(db: Session, user_email: str):
+    """Rebuilds the athlete's health_daily rows from archived sleep/summary/HRV payloads. Returns days written."""
+    from garmin_sync import parse_health_day
+    from health_store import METRIC_FIELDS, is_final_day
+
+    # Group the three daily payload kinds by date
+    days = {}
+    archive = RawArchive(db)
+    for kind in HEALTH_KINDS:
+        for source_key, _, payload in archive.iter_payloads(user_email, kind):
+            days.setdefault(source_key, {})[kind] = payload
+
+    existing = {row.date: row for row in db.query(HealthDaily).filter(HealthDaily.user_email == user_email).all()}
+    today = datetime.date.today()
+    now = datetime.datetime.now().isoformat()
+    count = 0
+    for d in sorted(days):
+        raw = days[d]
+        if "sleep" not in raw or "summary" not in raw:
+            continue
+        metrics = parse_health_day(d, raw["sleep"], raw["summary"], raw.get("hrv"))
+        row = existing.get(d)
+        if row is None:
+            row = HealthDaily(user_email=user_email, date=d, fetched_at=now)
+            db.add(row)
+        for f in METRIC_FIELDS:
+            setattr(row, f, metrics[f])
+        # Same rule as a live sync: recent or incomplete days stay provisional so they are fetched again
+        row.is_final = 1 if is_final_day(d, metrics, today) else 0
+        count += 1
+    db.commit()
+    return count
@@ -0,0 +1,38 @@
+"""
+Rebuilds derived tables (activities, health_daily) from the compressed raw Garmin payload archive.
+No Garmin calls: use it after adding or changing a derived metric instead of re-downloading history.
+
+Usage (from backend/):  python reprocess_archive.py [--email athlete@example.com] [--only activities|health]
+"""
+import argparse
+import time
+from database import SessionLocal
+from raw_archive import RawArchive, reprocess_activities, reprocess_health
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild derived tables from the raw Garmin archive")
+    parser.add_argument("--email", help="Only this athlete (default: every archived athlete)")
+    parser.add_argument("--only", choices=["activities", "health"], help="Only one derived table")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        archive = RawArchive(db)
+        emails = [args.email] if args.email else archive.athletes()
+        t0 = time.perf_counter()
+        for email in emails:
+            n_act = reprocess_activities(db, email) if args.only in (None, "activities") else 0
+            n_health = reprocess_health(db, email) if args.only in (None, "health") else 0
+            print(f"{email}: {n_act} activities, {n_health} health days rebuilt")
+
+        payloads, raw_bytes = archive.usage(args.email)
+        elapsed = time.perf_counter() - t0
+        print(f"Reprocessed {len(emails)} athletes from {payloads} archived payloads "
+              f"({raw_bytes / 1e6:.1f} MB uncompressed) in {elapsed:.2f}s")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
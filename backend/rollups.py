@@ -0,0 +1,138 @@
+import datetime
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+from database import Activity, DailyRollup, WeeklyRollup, User
+from metrics_cache import METRICS_CACHE
+from pmc_engine import activity_load, athlete_params, sport_of, SPORTS
+
+SPORT_METRICS = ("sessions", "duration_min", "distance_km")
+# Aggregated columns shared by daily_rollup and weekly_rollup
+ROLLUP_FIELDS = ["sessions", "duration_min", "distance_km", "load"] + [f"{s}_{m}" for s in SPORTS for m in SPORT_METRICS]
+
+
+def week_start(date_str):
+    """Monday (YYYY-MM-DD) of the week containing date_str."""
+    d = datetime.date.fromisoformat(date_str)
+    return (d - datetime.timedelta(days=d.weekday())).isoformat()
+
+
+def rollup_activities(activities, params=None):
+    """Sums summarized activities into a {ROLLUP_FIELDS: value} dict."""
+    totals = dict.fromkeys(ROLLUP_FIELDS, 0)
+    for act in activities:
+        duration = act.get("duration_min") or 0
+        distance = act.get("distance_km") or 0
+        totals["sessions"] += 1
+        totals["duration_min"] += duration
+        totals["distance_km"] += distance
+        totals["load"] += activity_load(act, params)
+        sport = sport_of(act.get("type"))
+        if sport:
+            totals[f"{sport}_sessions"] += 1
+            totals[f"{sport}_duration_min"] += duration
+            totals[f"{sport}_distance_km"] += distance
+    return totals
+
+
+class RollupStore:
+    """
+    Per-athlete daily and weekly training totals (sessions, duration, distance per sport, load),
+    maintained when activities are written so consumers read a date range instead of scanning activities.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def _params(self, user_email):
+        return athlete_params(self.db.query(User).filter(User.email == user_email).first())
+
+    def update_days(self, user_email: str, dates):
+        """Re-aggregates the given days (and their weeks) from the athlete's stored activities."""
+        dates = sorted({d for d in dates if d})
+        if not dates:
+            return 0
+        rows = self.db.query(Activity.date, Activity.summary).filter(
+            Activity.user_email == user_email,
+            Activity.date.in_(dates)
+        ).all()
+        by_day = {}
+        for date, summary in rows:
+            by_day.setdefault(date, []).append(summary)
+
+        params = self._params(user_email)
+        self.db.query(DailyRollup).filter(
+            DailyRollup.user_email == user_email,
+            DailyRollup.date.in_(dates)
+        ).delete(synchronize_session=False)
+        if by_day:
+            self.db.execute(insert(DailyRollup), [
+                {"user_email": user_email, "date": d, **rollup_activities(acts, params)} for d, acts in by_day.items()
+            ])
+
+        # Weeks are re-summed from their (at most 7) daily rows
+        weeks = sorted({week_start(d) for d in dates})
+        self.db.query(WeeklyRollup).filter(
+            WeeklyRollup.user_email == user_email,
+            WeeklyRollup.week_start.in_(weeks)
+        ).delete(synchronize_session=False)
+        sums = [func.coalesce(func.sum(getattr(DailyRollup, f)), 0) for f in ROLLUP_FIELDS]
+        week_rows = []
+        for monday in weeks:
+            sunday = (datetime.date.fromisoformat(monday) + datetime.timedelta(days=6)).isoformat()
+            values = self.db.query(*sums).filter(
+                DailyRollup.user_email == user_email,
+                DailyRollup.date >= monday,
+                DailyRollup.date <= sunday
+            ).one()
+            if values[0]:
+                week_rows.append({"user_email": user_email, "week_start": monday, **dict(zip(ROLLUP_FIELDS, values))})
+        if week_rows:
+            self.db.execute(insert(WeeklyRollup), week_rows)
+        self.db.commit()
+        # Training stats payloads carry the volume read from these rows
+        METRICS_CACHE.invalidate(user_email, "training_stats")
+        return len(dates)
+
+    def rebuild(self, user_email: str):
+        """Drops and recomputes every rollup of the athlete (after reprocessing or a load model change)."""
+        self.db.query(DailyRollup).filter(DailyRollup.user_email == user_email).delete(synchronize_session=False)
+        self.db.query(WeeklyRollup).filter(WeeklyRollup.user_email == user_email).delete(synchronize_session=False)
+        dates = [row[0] for row in self.db.query(Activity.date).filter(Activity.user_email == user_email).distinct().all()]
+        self.db.commit()
+        METRICS_CACHE.invalidate(user_email, "training_stats")
+        return self.update_days(user_email, dates)
+
+    def ensure(self, user_email: str):
+        """Builds the rollups of an athlete whose activities predate them. Returns True if it had to."""
+        if self.db.query(DailyRollup.id).filter(DailyRollup.user_email == user_email).first() is not None:
+            return False
+        if self.db.query(Activity.id).filter(Activity.user_email == user_email).first() is None:
+            return False
+        self.rebuild(user_email)
+        return True
+
+    def _rows(self, model, key, user_email, start, end):
+        column = getattr(model, key)
+        rows = self.db.query(model).filter(
+            model.user_email == user_email,
+            column >= start,
+            column <= end
+        ).order_by(column).all()
+        return [{key: getattr(r, key), **{f: getattr(r, f) for f in ROLLUP_FIELDS}} for r in rows]
+
+    def daily(self, user_email: str, start: str, end: str):
+        """Days with activity between start and end (YYYY-MM-DD, inclusive), oldest first."""
+        return self._rows(DailyRollup, "date", user_email, start, end)
+
+    def weekly(self, user_email: str, start: str, end: str):
+        """Weeks with activity whose Monday is between start and end, oldest first."""
+        return self._rows(WeeklyRollup, "week_start", user_email, start, end)
+
+    def totals(self, user_email: str, start: str, end: str):
+        """{ROLLUP_FIELDS: sum} over the days between start and end (inclusive)."""
+        values = self.db.query(*[func.coalesce(func.sum(getattr(DailyRollup, f)), 0) for f in ROLLUP_FIELDS]).filter(
+            DailyRollup.user_email == user_email,
+            DailyRollup.date >= start,
+            DailyRollup.date <= end
+        ).one()
+        return dict(zip(ROLLUP_FIELDS, values))
@@ -20,6 +20,13 @@ def db():
     finally:
         db.close()
         Base.metadata.drop_all(bind=engine)
+        # Tables are dropped outside any session commit, so the in-process caches cannot notice
+        from challenge_logic import CHALLENGE_CATALOG
+        from leaderboard import XP_RANKING
+        from metrics_cache import METRICS_CACHE
+        CHALLENGE_CATALOG.invalidate()
+        XP_RANKING.invalidate()
+        METRICS_CACHE.clear()
 
 def test_coach_logic_prompt_generation():
     coach = CoachLogic(api_key="test-key")
@@ -95,3 +102,1079 @@ def test_challenge_progress_update(db):
     
     db.refresh(user_chal)
     assert user_chal.current_value == 2.0
+
+def test_garmin_session_pool_reuses_and_expires_sessions():
+    import time
+    import datetime
+    from garmin_sync import GarminSessionPool, GarminManager, SESSION_POOL
+
+    class FakeClient:
+        display_name = "athlete"
+
+    pool = GarminSessionPool()
+    client = FakeClient()
+    pool.put("a@example.com", client)
+    assert pool.borrow("a@example.com") is client
+    assert pool.borrow("b@example.com") is None
+
+    # Expired sessions are evicted instead of being lent out
+    pool._sessions["a@example.com"]["expires_at"] = time.time() - 1
+    assert pool.borrow("a@example.com") is None
+    assert len(pool) == 0
+
+    # A pooled session makes login() a no-op (no Garmin client is built)
+    SESSION_POOL.put("pooled@example.com", client)
+    try:
+        gm = GarminManager("pooled@example.com", "secret")
+        assert gm.login()
+        assert gm.client is client
+
+        # A token Garmin rejects evicts the pooled session instead of lending it out until its TTL
+        from garminconnect import GarminConnectAuthenticationError
+        def rejected(*args):
+            raise GarminConnectAuthenticationError("401 Unauthorized")
+        client.get_activities_by_date = rejected
+        with pytest.raises(GarminConnectAuthenticationError):
+            gm.fetch_activities(datetime.date(2024, 5, 1), datetime.date(2024, 5, 2))
+        assert SESSION_POOL.borrow("pooled@example.com") is None and gm.client is None
+    finally:
+        SESSION_POOL.invalidate("pooled@example.com")
+
+def test_activity_store_delta_sync(db):
+    import datetime
+    from activity_store import ActivityStore, SYNC_LOOKBACK_DAYS
+    from database import Activity
+
+    today = datetime.date.today()
+    yesterday = (today - datetime.timedelta(days=1)).isoformat()
+
+    class FakeGarmin:
+        email = "athlete@example.com"
+        def __init__(self):
+            self.calls = []
+            self.activities = [
+                {"activityId": 1, "startTimeLocal": f"{yesterday} 07:00:00", "activityType": {"typeKey": "running"}, "duration": 3600},
+            ]
+        def fetch_activities(self, start_date, end_date):
+            self.calls.append(start_date)
+            return list(self.activities)
+
+    gm = FakeGarmin()
+    store = ActivityStore(db)
+    assert store.sync(gm, force=True) == 1
+
+    # Second sync asks from a fixed lookback before the newest stored activity and skips known ids
+    gm.activities.append({"activityId": 2, "startTimeLocal": f"{today.isoformat()} 06:30:00", "activityType": {"typeKey": "cycling"}, "duration": 5400})
+    assert store.sync(gm, force=True) == 1
+    assert gm.calls[-1] == today - datetime.timedelta(days=1 + SYNC_LOOKBACK_DAYS)
+    assert db.query(Activity).count() == 2
+
+    # An activity that reaches Garmin late with an older date is still picked up
+    three_days_ago = (today - datetime.timedelta(days=3)).isoformat()
+    gm.activities.append({"activityId": 3, "startTimeLocal": f"{three_days_ago} 18:00:00", "activityType": {"typeKey": "running"}, "duration": 1800})
+    assert store.sync(gm, force=True) == 1
+
+    # An activity Garmin revised later (longer, new training load) is updated with its derived days
+    from rollups import RollupStore
+    gm.activities[0] = dict(gm.activities[0], duration=5400, activityTrainingLoad=80.0)
+    assert store.sync(gm, force=True) == 0
+    assert db.query(Activity).count() == 3
+    row = db.query(Activity).filter(Activity.activity_id == 1).one()
+    assert row.summary["duration_min"] == 90.0
+    assert RollupStore(db).daily("athlete@example.com", yesterday, yesterday)[0]["duration_min"] == 90.0
+
+    # A row another worker stored in the meantime is overwritten instead of violating the unique key
+    from activity_store import upsert_activities
+    upsert_activities(db, [{"user_email": "athlete@example.com", "activity_id": 1, "start_time_local": row.start_time_local,
+                            "date": row.date, "activity_type": row.activity_type, "summary": row.summary, "synced_at": row.synced_at}])
+    db.commit()
+    assert db.query(Activity).count() == 3
+
+    # Garmin errors are reported as "not reachable" instead of propagating
+    def unreachable(start_date, end_date):
+        raise ConnectionError("Garmin down")
+    gm.fetch_activities = unreachable
+    assert store.sync(gm, force=True) is None
+
+    recent = store.get_recent("athlete@example.com", 7)
+    assert [a["activityId"] for a in recent] == [2, 1, 3]
+    assert recent[0]["duration_min"] == 90.0 and recent[1]["duration_min"] == 90.0
+
+def test_concurrency_limit_is_reentrant_and_bounded():
+    import threading
+    from concurrency import ConcurrencyLimit
+
+    limit = ConcurrencyLimit("test", 1)
+
+    @limit
+    def outer():
+        return inner()
+
+    @limit
+    def inner():
+        return limit.in_use
+
+    # Nested limited calls on the same thread hold a single slot
+    assert outer() == 1
+    assert limit.in_use == 0
+
+    # A second thread has to wait while the only slot is taken
+    entered = threading.Event()
+    with limit:
+        t = threading.Thread(target=lambda: (limit.__enter__(), entered.set(), limit.__exit__(None, None, None)))
+        t.start()
+        assert not entered.wait(0.1)
+    t.join(1)
+    assert entered.is_set()
+
+def test_health_metrics_fan_out_keeps_scan_precedence():
+    import datetime
+    import threading
+    from garmin_sync import GarminManager
+
+    today = datetime.date.today()
+    d0, d1, d2 = [(today - datetime.timedelta(days=i)).isoformat() for i in range(3)]
+    threads = set()
+
+    class FakeClient:
+        def get_sleep_data(self, d):
+            threads.add(threading.current_thread().name)
+            scores = {d0: None, d1: 81, d2: 70}
+            return {"dailySleepDTO": {"sleepScores": {"overall": {"value": scores[d]}}, "sleepTimeSeconds": 7 * 3600}} if scores[d] else {}
+        def get_user_summary(self, d):
+            return {"restingHeartRate": 50, "bodyBatteryMostRecentValue": 60, "hrvStatus": {"lastNightAvg": 55 if d == d2 else None}}
+        def get_hrv_data(self, d):
+            return {}
+
+    gm = GarminManager("fanout@example.com", "pw")
+    gm.client = FakeClient()
+    metrics = gm.get_health_metrics()
+
+    # Sleep comes from the most recent day that has it, HRV from the only day that has it
+    assert metrics["sleep_score"] == 81
+    assert metrics["hrv"] == 55
+    assert metrics["date"] == f"{d0} (Sleep from {d1}, HRV from {d2})"
+    assert all(name.startswith("garmin-fetch") for name in threads)
+
+def test_sync_workouts_runs_in_parallel_and_reports_each_day():
+    import threading
+    import time
+    from garmin_sync import GarminManager
+
+    gm = GarminManager("batch@example.com", "pw")
+    gm.client = object() # already logged in
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def fake_create(name, date_str, **kwargs):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.05 if name != "Slow" else 0.4)
+        with lock:
+            state["running"] -= 1
+        return name != "Broken"
+
+    gm.create_and_schedule_workout = fake_create
+    jobs = [(day, {"name": name, "date_str": "2026-01-05"}) for day, name in
+            [("Mon", "Slow"), ("Tue", "Run"), ("Wed", "Broken"), ("Thu", "Run"), ("Fri", "Run"), ("Sat", "Run")]]
+
+    results = list(gm.sync_workouts(jobs, max_parallel=3))
+    assert {r["day"] for r in results} == {"Mon", "Tue", "Wed", "Thu", "Fri", "Sat"}
+    assert [r["success"] for r in results if r["day"] == "Wed"] == [False]
+    # The slow Monday upload does not hold back the other days, and concurrency stays bounded
+    assert results[-1]["day"] == "Mon"
+    assert state["peak"] == 3
+
+def test_workout_upload_cache_skips_identical_workouts(db, tmp_path, monkeypatch):
+    from garmin_sync import GarminManager
+    from workout_upload_cache import WorkoutUploadCache
+    from database import WorkoutUpload
+
+    class FakeClient:
+        def __init__(self):
+            self.uploads = 0
+            self.scheduled = []
+        def upload_workout(self, payload):
+            self.uploads += 1
+            return {"workoutId": 1000 + self.uploads}
+        def schedule_workout(self, workout_id, date_str):
+            self.scheduled.append((workout_id, date_str))
+
+    monkeypatch.chdir(tmp_path) # create_and_schedule_workout writes debug logs to the cwd
+    gm = GarminManager("cache@example.com", "pw")
+    gm.client = FakeClient()
+    steps = [{"description": "Easy", "duration_min": 30, "type": "INTERVAL"}]
+
+    cache = WorkoutUploadCache(db, "cache@example.com")
+    assert gm.create_and_schedule_workout("Easy Run", "Z2", 30, "2026-01-06", steps=steps, upload_cache=cache)
+    cache.flush(db)
+
+    # Re-sync of the same week: nothing uploaded, nothing rescheduled
+    cache = WorkoutUploadCache(db, "cache@example.com")
+    assert gm.create_and_schedule_workout("Easy Run", "Z2", 30, "2026-01-06", steps=steps, upload_cache=cache)
+    # Same workout on another day: reschedule the existing id
+    assert gm.create_and_schedule_workout("Easy Run", "Z2", 30, "2026-01-08", steps=steps, upload_cache=cache)
+    cache.flush(db)
+
+    assert gm.client.uploads == 1
+    assert gm.client.scheduled == [(1001, "2026-01-06"), (1001, "2026-01-08")]
+    row = db.query(WorkoutUpload).one()
+    assert row.scheduled_dates == ["2026-01-06", "2026-01-08"]
+
+    # Identical new workouts uploaded in parallel by one batch: one upload, the others reschedule it
+    import time
+    upload = gm.client.upload_workout
+    gm.client.upload_workout = lambda payload: (time.sleep(0.1), upload(payload))[1]
+    cache = WorkoutUploadCache(db, "cache@example.com")
+    jobs = [(d, {"name": "Tempo", "description": "Z3", "duration_min": 45, "date_str": d, "steps": steps, "upload_cache": cache})
+            for d in ("2026-01-12", "2026-01-14", "2026-01-16")]
+    assert all(r["success"] for r in gm.sync_workouts(jobs, max_parallel=3))
+    assert gm.client.uploads == 2
+
+def test_workout_compiler_is_pure_and_memoized():
+    import copy
+    from workout_compiler import compile_steps, build_workout_payload
+
+    steps = [
+        {"description": "Warm up", "duration_min": 10, "type": "WARMUP"},
+        {"repeat": 4, "recovery_dur": 1, "description": "Fast 4:00/km", "duration_min": 2},
+        {"description": "Cool down 30 sec", "type": "COOLDOWN", "target": {"type": "hr", "val": "130"}},
+    ]
+    original = copy.deepcopy(steps)
+
+    compiled = compile_steps(steps, "running")
+    assert steps == original # input untouched
+
+    group = compiled[1]
+    assert group["type"] == "RepeatGroupDTO" and group["numberOfIterations"] == 4
+    work, rec = group["workoutSteps"]
+    assert work["targetType"]["workoutTargetTypeKey"] == "speed.target"
+    assert work["targetValueOne"] == round(1000.0 / 240 * 0.95, 3)
+    assert rec["stepType"]["stepTypeKey"] == "recovery" and rec["endConditionValue"] == 60.0
+    assert compiled[2]["endConditionValue"] == 30.0
+    assert compiled[2]["targetType"]["workoutTargetTypeKey"] == "heart.rate.target"
+
+    # Memoized trees are returned as fresh copies
+    again = compile_steps(steps, "running")
+    assert again == compiled and again is not compiled
+    again[0]["description"] = "changed"
+    assert compile_steps(steps, "running")[0]["description"] == "Warm up"
+
+    payload = build_workout_payload("Intervals", None, 40, "RUNNING", steps)
+    assert payload["estimatedDurationInSecs"] == 600 + 4 * 180 + 30
+
+def test_health_store_only_fetches_missing_or_provisional_days(db):
+    import datetime
+    from health_store import HealthStore
+    from database import HealthDaily
+
+    today = datetime.date.today()
+
+    class FakeGarmin:
+        email = "athlete@example.com"
+        def __init__(self):
+            self.requested = []
+        def login(self):
+            return True
+        def fetch_health_days_raw(self, dates):
+            self.requested.append(list(dates))
+            return [(d, {"dailySleepDTO": {"sleepTimeSeconds": 27000}, "sleepScore": 80},
+                     {"restingHeartRate": 48, "bodyBatteryMostRecentValue": 70, "averageStressLevel": 20,
+                      "hrvStatus": {"lastNightAvg": 60 if d != today.isoformat() else 45}}, None) for d in dates]
+
+    gm = FakeGarmin()
+    store = HealthStore(db)
+    assert store.sync(gm, days=5) == 5
+    assert db.query(HealthDaily).count() == 5
+
+    # Nothing is re-fetched while today's snapshot is fresh
+    assert store.sync(gm, days=5) == 0
+
+    # Today and yesterday are provisional (the watch may upload late): re-fetched once their snapshot
+    # is stale, complete older days never are
+    db.query(HealthDaily).filter(HealthDaily.date == today.isoformat()).update(
+        {"fetched_at": (datetime.datetime.now() - datetime.timedelta(minutes=10)).isoformat()})
+    db.commit()
+    assert store.sync(gm, days=5) == 1
+    assert gm.requested[-1] == [today.isoformat()]
+    db.query(HealthDaily).update({"fetched_at": (datetime.datetime.now() - datetime.timedelta(hours=2)).isoformat()})
+    db.commit()
+    assert store.sync(gm, days=5) == 2
+    assert gm.requested[-1] == [today.isoformat(), (today - datetime.timedelta(days=1)).isoformat()]
+
+    # A past day fetched before its data was uploaded stays provisional until it is complete (or a week old)
+    from health_store import is_final_day
+    empty = dict.fromkeys(["sleep_score", "rhr", "body_battery", "stress"])
+    assert not is_final_day((today - datetime.timedelta(days=3)).isoformat(), empty, today)
+    assert is_final_day((today - datetime.timedelta(days=7)).isoformat(), empty, today)
+
+    metrics = store.get_metrics("athlete@example.com")
+    assert metrics["hrv"] == 45 and metrics["hrv_baseline"] == 60
+    assert len(store.get_history("athlete@example.com", 5)) == 5
+
+def test_single_flight_coalesces_concurrent_garmin_logins(monkeypatch):
+    import threading
+    import time
+    import garmin_sync
+    from garmin_sync import GarminManager, SingleFlight, SESSION_POOL
+
+    built = []
+
+    class SlowGarmin:
+        display_name = None
+        def __init__(self, email, password):
+            built.append(email)
+        def login(self):
+            time.sleep(0.2)
+            self.display_name = "athlete"
+
+    monkeypatch.setattr(garmin_sync, "Garmin", SlowGarmin)
+    managers = [GarminManager("flight@example.com", "secret") for _ in range(4)]
+    try:
+        threads = [threading.Thread(target=gm.login) for gm in managers]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    finally:
+        SESSION_POOL.invalidate("flight@example.com")
+
+    # One login for four concurrent requests, all sharing the same client
+    assert len(built) == 1
+    assert all(gm.client is managers[0].client for gm in managers)
+
+    # Followers get the leader's exception too
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+    def boom():
+        release.wait()
+        raise RuntimeError("garmin down")
+    def call():
+        try: flight.do(("x", "health", None), boom)
+        except RuntimeError as e: errors.append(e)
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads: t.start()
+    while flight.in_flight() == 0: time.sleep(0.01)
+    time.sleep(0.05)
+    release.set()
+    for t in threads: t.join()
+    assert len(errors) == 3 and flight.in_flight() == 0
+
+def test_metrics_cache_backends_ttl_and_lru(tmp_path):
+    import time
+    from metrics_cache import MetricsCache, MemoryCache, SQLiteCache
+
+    with pytest.raises(TypeError):
+        MetricsCache() # Abstract: only the backends can be built
+    for cache in (MemoryCache(max_bytes=200), SQLiteCache(str(tmp_path / "cache.db"), max_bytes=200)):
+        cache.set("a@example.com", "health", {"hrv": 50})
+        cache.set("a@example.com", "activities", [1, 2, 3], window=14, ttl=-1) # already expired
+        assert cache.get("a@example.com", "health") == {"hrv": 50}
+        assert cache.get("a@example.com", "activities", 14) is None # separate TTL per kind
+        assert cache.get("a@example.com", "health", "2024-01-01") is None # window is part of the key
+
+        # LRU eviction under the size cap: "health" was read last, so the bulky old entry goes first
+        cache.set("b@example.com", "performance", {"blob": "x" * 90})
+        time.sleep(0.01)
+        cache.get("a@example.com", "health")
+        cache.set("c@example.com", "performance", {"blob": "y" * 90})
+        assert cache.get("b@example.com", "performance") is None
+        assert cache.get("a@example.com", "health") == {"hrv": 50}
+        assert cache.stats()["bytes"] <= 200
+
+        cache.invalidate("a@example.com")
+        assert cache.get("a@example.com", "health") is None
+        assert cache.hits == 3 and cache.misses == 4
+
+    # The SQLite backend is shared between instances (i.e. workers)
+    first = SQLiteCache(str(tmp_path / "shared.db"))
+    first.set("a@example.com", "training_stats", {"ctl": 42}, window=(30, "2024-01-01"))
+    assert SQLiteCache(str(tmp_path / "shared.db")).get("a@example.com", "training_stats", (30, "2024-01-01")) == {"ctl": 42}
+
+def test_dashboard_revalidate_serves_stale_and_schedules_refresh():
+    import datetime
+    from fastapi import Response, BackgroundTasks
+    from main import revalidate
+
+    refreshed = []
+    now = datetime.datetime.now()
+
+    # Fresh data: no refresh, Age set
+    response, tasks = Response(), BackgroundTasks()
+    assert not revalidate(response, tasks, now - datetime.timedelta(minutes=1), 5, refreshed.append, "a@example.com")
+    assert response.headers["X-Data-Stale"] == "0" and 55 <= int(response.headers["Age"]) <= 65
+    assert not tasks.tasks
+
+    # Older than the soft TTL: served anyway, refreshed after the response
+    response, tasks = Response(), BackgroundTasks()
+    assert revalidate(response, tasks, now - datetime.timedelta(minutes=30), 5, refreshed.append, "a@example.com")
+    assert response.headers["X-Data-Stale"] == "1"
+    assert len(tasks.tasks) == 1
+    tasks.tasks[0].func(*tasks.tasks[0].args)
+    assert refreshed == ["a@example.com"]
+
+def test_fake_garmin_server_backs_garmin_manager(monkeypatch, tmp_path):
+    import datetime
+    import garmin_sync
+    from fake_garmin import FakeGarminServer
+
+    server = FakeGarminServer(port=0).start_in_thread()
+    try:
+        monkeypatch.setattr(garmin_sync, "GARMIN_FAKE_URL", server.url)
+        monkeypatch.chdir(tmp_path)
+        gm = garmin_sync.GarminManager("fake@example.com", "secret")
+        assert gm.login() and gm.client.display_name == "fake"
+
+        today = datetime.date.today()
+        week = gm.fetch_activities(today - datetime.timedelta(days=7), today)
+        assert week == gm.client.get_activities_by_date((today - datetime.timedelta(days=7)).isoformat(), today.isoformat())
+        metrics = gm.fetch_health_days([today.isoformat()])[0]
+        assert metrics["sleep_score"] and metrics["hrv"]
+        assert gm.create_and_schedule_workout("Easy run", None, 30, today.isoformat(), steps=[{"description": "easy", "duration_min": 30}])
+
+        # Error injection surfaces as HTTP errors from the client
+        server.error_rate = 1.0
+        with pytest.raises(Exception):
+            gm.client.get_user_summary(today.isoformat())
+        assert server.stats["workout-service"] == 2
+    finally:
+        garmin_sync.SESSION_POOL.invalidate("fake@example.com")
+        server.shutdown()
+
+def test_raw_archive_round_trip_and_reprocess(db):
+    import datetime
+    from activity_store import ActivityStore
+    from raw_archive import RawArchive, reprocess_activities, compress_payload
+    from database import Activity, RawPayload
+
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    raw_act = {"activityId": 7, "activityName": "Long ride", "startTimeLocal": f"{yesterday} 08:00:00",
+               "activityType": {"typeKey": "cycling"}, "duration": 7200, "normPower": 210, "extra": ["x"] * 200}
+
+    class FakeGarmin:
+        email = "athlete@example.com"
+        def fetch_activities(self, start_date, end_date):
+            return [raw_act]
+
+    ActivityStore(db).sync(FakeGarmin(), force=True)
+
+    # The full raw dict is kept compressed, and decompressed only on access
+    row = db.query(RawPayload).one()
+    assert row.kind == "activity" and row.source_key == "7"
+    assert len(compress_payload(raw_act)[1]) < row.raw_size
+    assert RawArchive(db).get("athlete@example.com", "activity", 7) == raw_act
+
+    # Derived rows can be rebuilt from the archive alone
+    db.query(Activity).update({"summary": {}})
+    db.commit()
+    assert reprocess_activities(db, "athlete@example.com") == 1
+    assert db.query(Activity).one().summary["norm_power"] == 210
+
+    # Reprocessed health days follow the live finality rule: yesterday stays provisional, old days are final
+    from database import HealthDaily
+    from raw_archive import reprocess_health
+    old_day = (datetime.date.today() - datetime.timedelta(days=10)).isoformat()
+    stats = {"restingHeartRate": 48, "bodyBatteryHigh": 80, "averageStressLevel": 25, "sleepScore": 82}
+    for d in (yesterday, old_day):
+        RawArchive(db).store_health_day("athlete@example.com", d, {}, stats)
+    db.commit()
+    assert reprocess_health(db, "athlete@example.com") == 2
+    finals = dict(db.query(HealthDaily.date, HealthDaily.is_final).all())
+    assert finals == {yesterday: 0, old_day: 1}
+
+def test_fit_decoder_streams_records_onto_a_1hz_grid(db, tmp_path, monkeypatch):
+    import struct
+    from fit_ingest import write_fit, decode_fit, StreamStore, FIT_EPOCH
+
+    # Round trip through the writer, with a dropped power sample
+    start = 1700000000
+    fit = write_fit(start, power=[200, None, 220, 230], heart_rate=[120, 121, 122, 123], speed=[10.0] * 4)
+    t0, cols = decode_fit(fit)
+    assert t0 == start
+    assert cols["power"].tolist() == [200, 0, 220, 230]
+    assert cols["heart_rate"].dtype.name == "uint8" and cols["distance"][-1] == 40.0
+
+    # Compressed timestamp headers (5-bit offsets) and a 2 s recording gap
+    ts = start - FIT_EPOCH
+    body = bytes([0x40, 0, 0]) + struct.pack("<HB", 20, 2) + bytes([253, 4, 0x86, 7, 2, 0x84])
+    body += bytes([0x41, 0, 0]) + struct.pack("<HB", 20, 1) + bytes([7, 2, 0x84])
+    body += bytes([0x00]) + struct.pack("<IH", ts, 100)
+    for delta, watts in ((1, 110), (4, 140)):
+        body += bytes([0x80 | (1 << 5) | ((ts + delta) & 0x1F)]) + struct.pack("<H", watts)
+    fit = struct.pack("<BBHI4s", 12, 0x20, 2132, len(body), b".FIT") + body
+    assert decode_fit(fit)[1]["power"].tolist() == [100, 110, 0, 0, 140]
+
+    # Stored as memory-mappable .npy columns
+    store = StreamStore(db, base_dir=str(tmp_path))
+    row = store.ingest("athlete@example.com", 42, write_fit(start, power=[250] * 3600))
+    assert row.n_samples == 3600 and row.columns == ["distance", "power"]
+    power = store.load("athlete@example.com", 42, ["power"])["power"]
+    assert power.filename and int(power.sum()) == 250 * 3600
+
+    # Uploaded before its activity was synced: no sport yet, so the curve waits for the sync
+    import datetime
+    import fit_ingest
+    from activity_store import ActivityStore
+    from power_curve import CurveStore
+    assert CurveStore(db).get("athlete@example.com", "power") is None
+    monkeypatch.setattr(fit_ingest, "STREAMS_DIR", str(tmp_path))
+    day = datetime.date.today().isoformat()
+
+    class FakeGarmin:
+        email = "athlete@example.com"
+        def fetch_activities(self, start_date, end_date):
+            return [{"activityId": 42, "startTimeLocal": f"{day} 07:00:00", "activityType": {"typeKey": "cycling"}, "duration": 3600}]
+
+    assert ActivityStore(db).sync(FakeGarmin(), force=True) == 1
+    assert CurveStore(db).get("athlete@example.com", "power")["values"][0] == 250.0
+
+def test_power_curve_mean_max_incremental_bests_and_ftp(db):
+    import datetime
+    import numpy as np
+    from power_curve import mean_max, CurveStore, CURVE_DURATIONS, ROLLING_DAYS
+
+    rng = np.random.default_rng(3)
+    power = rng.integers(100, 400, 700).astype(np.float64)
+    curve = mean_max(power, [1, 30, 600, 701])
+    for value, d in zip(curve[:3], [1, 30, 600]):
+        brute = max(power[i:i + d].mean() for i in range(len(power) - d + 1))
+        assert abs(value - brute) < 1e-9
+    assert np.isnan(curve[3]) # longer than the stream
+
+    store = CurveStore(db)
+    today = datetime.date.today()
+    old_day = (today - datetime.timedelta(days=ROLLING_DAYS + 10)).isoformat()
+    # Old 300 W ride (outside the 90 day window), recent 250 W ride
+    store.add_activity("rider@example.com", 1, old_day, {"power": np.full(3600, 300, dtype=np.uint16)}, "cycling")
+    store.add_activity("rider@example.com", 2, today.isoformat(), {"power": np.full(3600, 250, dtype=np.uint16)}, "cycling")
+
+    idx = CURVE_DURATIONS.index(1200)
+    all_time = store.get("rider@example.com", "power", "all_time")
+    rolling = store.get("rider@example.com", "power", "rolling_90")
+    assert all_time["values"][idx] == 300.0 and all_time["activity_ids"][idx] == 1
+    assert rolling["values"][idx] == 250.0 and rolling["activity_ids"][idx] == 2
+    assert store.get("rider@example.com", "speed", "all_time") is None # not a run
+
+    # Running power never feeds the power curve
+    assert store.add_activity("rider@example.com", 3, today.isoformat(), {"power": np.full(3600, 400, dtype=np.uint16)}, "running") == []
+    assert store.get("rider@example.com", "power", "all_time")["values"][idx] == 300.0
+
+    # The curve FTP needs FTP_MIN_RIDES stored rides with a 20' best in the window
+    from database import Activity
+    assert store.estimate_ftp("rider@example.com") is None
+    for activity_id, watts in ((2, 250), (4, 240), (5, 230)):
+        db.add(Activity(user_email="rider@example.com", activity_id=activity_id, date=today.isoformat(), activity_type="road_biking"))
+        if activity_id != 2:
+            store.add_activity("rider@example.com", activity_id, today.isoformat(), {"power": np.full(1800, watts, dtype=np.uint16)}, "road_biking")
+    db.commit()
+    assert store.estimate_ftp("rider@example.com") == round(250 * 0.95)
+
+def test_pmc_engine_matches_daily_recursion():
+    import datetime
+    import numpy as np
+    from pmc_engine import ema, compute_training_stats, compute_roster_stats
+
+    rng = np.random.default_rng(5)
+    loads = rng.uniform(0, 150, (3, 1000))
+    for days in (42, 7):
+        expected = np.zeros_like(loads)
+        y = np.zeros(3)
+        for t in range(loads.shape[1]):
+            y = y + (loads[:, t] - y) / days
+            expected[:, t] = y
+        assert np.allclose(ema(loads, days), expected, rtol=1e-10, atol=1e-9)
+
+    end = datetime.date(2024, 6, 30)
+    acts = [
+        {"date": "2024-06-01", "type": "running", "duration_min": 60},
+        {"date": "2024-06-01", "type": "road_cycling", "duration_min": 120, "training_load": 150},
+        {"date": "2024-06-29", "type": "lap_swimming", "duration_min": 45},
+        {"date": "", "type": "running", "duration_min": 30},
+    ]
+    stats = compute_training_stats(acts, days=30, end_date=end)
+    assert len(stats["history"]) == 31
+    assert stats["history"][0]["day"] == "31/05"
+    june1 = stats["history"][1]
+    assert (june1["run"], june1["bike"], june1["swim"]) == (60, 120, 0)
+    assert june1["fitness"] == round((60 * 0.8 + 150) / 42, 1)
+    assert stats["history"][-2]["swim"] == 45
+
+    roster = compute_roster_stats({"a": acts, "b": []}, days=30, end_date=end)
+    assert roster["a"] == stats
+    zero = {"fitness": 0, "fatigue": 0, "form": 0}
+    assert roster["b"]["current"] == {**zero, "readiness": "Good", "by_sport": {s: zero for s in ("swim", "bike", "run")}}
+
+def test_pmc_store_rolls_forward_from_earliest_change(db):
+    import datetime
+    import numpy as np
+    from database import Activity, PmcDaily
+    from pmc_engine import ema
+    from pmc_store import PmcStore
+
+    email = "pmc@example.com"
+    end = datetime.date(2024, 3, 31)
+
+    def add(aid, day, minutes):
+        db.add(Activity(user_email=email, activity_id=aid, date=day, start_time_local=day + " 07:00:00",
+                        activity_type="running", summary={"date": day, "type": "running", "duration_min": minutes}))
+        db.commit()
+
+    add(1, "2024-01-01", 100)
+    add(2, "2024-03-01", 50)
+    store = PmcStore(db)
+    assert store.roll_forward(email, to_date=end) == 91 # full series from the first activity
+    assert store.roll_forward(email, to_date=end) == 0 # nothing new
+
+    # A late-synced activity in February only recomputes from that day
+    add(3, "2024-02-10", 80)
+    assert store.roll_forward(email, datetime.date(2024, 2, 10), to_date=end) == 51
+    # Rows are upserted: a concurrent roll over the same days overwrites instead of hitting the unique key
+    assert PmcStore(db).roll_forward(email, datetime.date(2024, 2, 10), to_date=end) == 51
+    assert db.query(PmcDaily).filter(PmcDaily.user_email == email).count() == 91
+
+    loads = np.zeros(91)
+    for day, minutes in (("2024-01-01", 100), ("2024-03-01", 50), ("2024-02-10", 80)):
+        loads[(datetime.date.fromisoformat(day) - datetime.date(2024, 1, 1)).days] = minutes * 0.8
+    stored = [r[0] for r in db.query(PmcDaily.ctl).filter(PmcDaily.user_email == email).order_by(PmcDaily.date).all()]
+    assert np.allclose(stored, ema(loads, 42))
+
+    stats = store.get_stats(email, days=120, end_date=end)
+    assert len(stats["history"]) == 121
+    assert stats["history"][0]["fitness"] == 0 # before the first activity
+    assert stats["history"][-1]["fitness"] == round(float(ema(loads, 42)[-1]), 1)
+
+    # The payload is cached per window until the series is rewritten
+    from metrics_cache import METRICS_CACHE
+    hits = METRICS_CACHE.hits
+    assert store.get_stats(email, days=120, end_date=end) == stats
+    assert METRICS_CACHE.hits == hits + 1
+    add(4, "2024-03-30", 60)
+    store.roll_forward(email, datetime.date(2024, 3, 30), to_date=end)
+    assert store.get_stats(email, days=120, end_date=end)["history"][-1]["fitness"] > stats["history"][-1]["fitness"]
+
+
+def test_per_sport_load_model_and_time_constants():
+    import datetime
+    import numpy as np
+    from types import SimpleNamespace
+    from pmc_engine import activity_load, athlete_params, compute_training_stats, compute_roster_stats, ema
+
+    user = SimpleNamespace(ftp=250, css="1:40", hr_rest=50, hr_max=190, lactate_threshold_hr=170, ctl_days=28, atl_days=5)
+    params = athlete_params(user)
+    ride = {"type": "road_cycling", "duration_min": 120, "norm_power": 200}
+    swim = {"type": "lap_swimming", "duration_min": 40, "distance_km": 2.4} # 1:40/100m = CSS
+    run = {"type": "running", "duration_min": 60, "avg_hr": 146}
+    assert activity_load(ride, params) == 2 * 0.8 ** 2 * 100 # power TSS
+    assert abs(activity_load(swim, params) - 40 / 60 * 100) < 1e-9 # swim TSS at CSS pace
+    assert abs(activity_load(run, params) - 0.8 ** 2 * 100) < 1e-9 # hrTSS
+    assert activity_load(run) == 48 # no profile: duration heuristic
+
+    end = datetime.date(2024, 6, 30)
+    acts = [dict(a, date="2024-06-20") for a in (ride, swim, run)]
+    stats = compute_training_stats(acts, days=20, end_date=end, params=params)
+    by_sport = stats["history"][-1]["by_sport"]
+    loads = np.zeros(21)
+    loads[10] = 128
+    assert by_sport["bike"]["fitness"] == round(float(ema(loads, 28)[-1]), 1)
+    assert by_sport["swim"]["fitness"] < by_sport["bike"]["fitness"]
+    assert abs(stats["history"][-1]["fitness"] - sum(v["fitness"] for v in by_sport.values())) < 0.2 # rounded parts
+
+    # Roster rows keep their own time constants
+    roster = compute_roster_stats({"a": acts, "b": acts}, days=20, end_date=end,
+                                  params_by_athlete={"a": params, "b": dict(params, ctl_days=42, atl_days=7)})
+    assert roster["a"] == stats
+    assert roster["b"]["current"]["fitness"] < roster["a"]["current"]["fitness"]
+
+def test_downsample_lttb_and_calendar_buckets():
+    import datetime
+    import numpy as np
+    from downsample import lttb, downsample
+    from pmc_engine import stats_payload
+
+    y = np.sin(np.arange(730) / 30.0)
+    y[400] = 5.0 # spike must survive
+    idx = lttb(y, 100)
+    assert len(idx) == 100 and idx[0] == 0 and idx[-1] == 729
+    assert np.all(np.diff(idx) > 0) and 400 in idx
+    assert len(lttb(y, 1000)) == 730
+
+    first = datetime.date(2024, 1, 1) # Monday
+    n = 366 # whole leap year
+    ctl = np.tile(np.arange(n, dtype=float), (4, 1))
+    atl = np.zeros((4, n))
+    volume = np.ones((3, n))
+    w_ctl, _, w_vol, w_off = downsample(ctl, atl, volume, first, bucket="week")
+    # Each point is labelled with the day its values are taken at
+    assert w_off[0] == 6 and w_off[1] == 13 and w_ctl[0, 0] == 6 and w_vol[0, 0] == 7
+    assert (w_ctl[0] == w_off).all()
+    m_ctl, _, m_vol, m_off = downsample(ctl, atl, volume, first, bucket="month")
+    assert len(m_off) == 12 and m_vol[0].tolist()[:3] == [31, 29, 31]
+    assert m_ctl[0, -1] == n - 1 and m_off[-1] == n - 1 # last day kept
+    assert stats_payload(m_ctl, np.zeros_like(m_ctl), m_vol, first, m_off)["history"][0]["date"] == "2024-01-31"
+
+    l_ctl, l_atl, l_vol, l_off = downsample(ctl, atl, volume, first, points=50)
+    assert l_vol.sum() == volume.sum() # volume regrouped, not dropped
+    stats = stats_payload(l_ctl, l_atl, l_vol, first, l_off)
+    assert len(stats["history"]) == 50
+    assert stats["history"][-1]["date"] == "2024-12-31"
+    assert stats["current"]["fitness"] == n - 1
+
+def test_rollups_update_incrementally_and_feed_stats_and_compliance(db):
+    from database import Activity
+    from rollups import RollupStore
+
+    email = "rollup@example.com"
+
+    def add(aid, day, act_type, minutes, km):
+        db.add(Activity(user_email=email, activity_id=aid, date=day, start_time_local=day + " 07:00:00", activity_type=act_type,
+                        summary={"date": day, "type": act_type, "duration_min": minutes, "distance_km": km}))
+        db.commit()
+
+    store = RollupStore(db)
+    add(1, "2024-05-06", "road_biking", 120, 60.0) # Monday
+    add(2, "2024-05-06", "running", 45, 9.0)
+    add(3, "2024-05-12", "lap_swimming", 40, 2.0) # Sunday, same week
+    store.update_days(email, ["2024-05-06", "2024-05-12"])
+
+    week = store.weekly(email, "2024-05-06", "2024-05-06")
+    assert len(week) == 1 and week[0]["sessions"] == 3
+    assert week[0]["bike_distance_km"] == 60.0 and week[0]["run_sessions"] == 1 and week[0]["swim_duration_min"] == 40
+
+    # A late activity only touches its own day and week
+    add(4, "2024-05-08", "virtual_cycling", 60, 45.0)
+    store.update_days(email, ["2024-05-08"])
+    assert [d["date"] for d in store.daily(email, "2024-05-01", "2024-05-31")] == ["2024-05-06", "2024-05-08", "2024-05-12"]
+    assert store.totals(email, "2024-05-06", "2024-05-12")["bike_distance_km"] == 105.0
+    assert store.weekly(email, "2024-05-06", "2024-05-06")[0]["sessions"] == 4
+
+    # Training stats read their daily and weekly volume from the rollups
+    import datetime
+    from pmc_store import PmcStore
+    stats = PmcStore(db).get_stats(email, days=6, end_date=datetime.date(2024, 5, 12))
+    assert [(d["swim"], d["bike"], d["run"]) for d in stats["history"]][:3] == [(0, 120, 45), (0, 0, 0), (0, 60, 0)]
+    assert stats["weekly_volume"] == [{"week_start": "2024-05-06", "sessions": 4, "load": stats["weekly_volume"][0]["load"],
+                                       "swim": 40, "bike": 180, "run": 45}]
+
+    # Compliance counts every session of the planned sport that day (a run split in two)
+    from coach_logic import CoachLogic
+    add(5, "2024-05-06", "running", 15, 3.0)
+    store.update_days(email, ["2024-05-06"])
+    plan = [{"week_number": 1, "start_date": "2024-05-06", "days": {"Mon": {"activity": "Easy run", "sport_type": "run", "duration": 60}}}]
+    runs = [{"activityId": 2, "date": "2024-05-06", "type": "running", "duration_min": 45},
+            {"activityId": 5, "date": "2024-05-06", "type": "running", "duration_min": 15}]
+    assert CoachLogic().analyze_executed_activities(plan, runs)["overall_compliance"] == 75.0
+    daily = store.daily(email, "2024-05-06", "2024-05-12")
+    assert CoachLogic().analyze_executed_activities(plan, runs, daily)["overall_compliance"] == 100.0
+
+
+def test_challenges_single_query_and_catalog_invalidation(db):
+    from sqlalchemy import event
+    from challenge_logic import CHALLENGE_CATALOG
+    from main import get_challenges
+
+    email = "collector@example.com"
+    logic = ChallengeLogic(db)
+    logic.generate_weekly_challenges(email)
+    weekly = CHALLENGE_CATALOG.all(db, "weekly")
+    for i in range(20): # Many completed challenges collected over the past weeks
+        db.add(UserChallenge(user_email=email, challenge_id=weekly[i % len(weekly)].id, status="completed",
+                             start_date=f"2023-01-{i + 1:02d}", end_date=f"2023-01-{i + 7:02d}"))
+    db.commit()
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        get_challenges(email, db)
+        few = len(statements)
+        statements.clear()
+        result = get_challenges(email, db)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert len(result) == 10 and result[0]["title"]
+    assert len(statements) == few <= 2 # active-weekly check + joined read, whatever the history size
+
+    # Editing a definition reloads the catalog on next use
+    loads = CHALLENGE_CATALOG.loads
+    ch = db.query(Challenge).filter(Challenge.id == weekly[0].id).first()
+    ch.target_value = 6
+    db.commit()
+    assert CHALLENGE_CATALOG.get(db, ch.id).target_value == 6
+    assert CHALLENGE_CATALOG.loads == loads + 1
+
+def test_challenge_rules_advance_incrementally(db):
+    from database import TrainingPlan
+    from challenge_rules import ChallengeEngine, CHALLENGE_RULES
+
+    assert {"sessions", "distance_bike", "compliance", "power"} <= set(CHALLENGE_RULES)
+    email = "rules@example.com"
+    db.add(User(email=email, ftp=250))
+    db.add(TrainingPlan(user_email=email, is_active=1, plan_data={"weeks": [{"start_date": "2024-05-06", "days": {
+        "Mon": {"activity": "Endurance ride", "sport_type": "bike", "duration": 120},
+        "Wed": {"activity": "Easy run", "sport_type": "run", "duration": 60},
+        "Sun": {"activity": "Rest", "duration": 0}}}]}))
+    logic = ChallengeLogic(db)
+    logic.seed_default_challenges()
+    for ch in db.query(Challenge).all():
+        db.add(UserChallenge(user_email=email, challenge_id=ch.id, status="active", start_date="2024-05-06", end_date="2024-05-12"))
+    db.commit()
+
+    engine = ChallengeEngine(db)
+    engine.recompute(email, [])
+    by_metric = lambda: {ch.metric: uc for uc, ch in db.query(UserChallenge, Challenge).join(Challenge, UserChallenge.challenge_id == Challenge.id)}
+
+    engine.on_activities(email, [{"date": "2024-05-06", "type": "road_biking", "duration_min": 150, "distance_km": 70, "norm_power": 280}])
+    engine.on_activities(email, [{"date": "2024-05-08", "type": "running", "duration_min": 30, "distance_km": 6},
+                                 {"date": "2024-05-20", "type": "running", "duration_min": 30}]) # outside the window
+    ucs = by_metric()
+    assert ucs["sessions"].current_value == 2
+    assert ucs["distance_bike"].current_value == 70
+    assert ucs["compliance"].current_value == round((120 + 30) / 180 * 100, 1)
+    assert ucs["power"].current_value == round(280 * 0.95 - 250, 1) and ucs["power"].status == "completed"
+
+    # Completed challenges stop advancing; the others keep their state
+    engine.on_activities(email, [{"date": "2024-05-09", "type": "indoor_cycling", "duration_min": 90, "distance_km": 40}])
+    ucs = by_metric()
+    assert ucs["distance_bike"].current_value == 110 and ucs["distance_bike"].status == "completed"
+    assert ucs["sessions"].current_value == 3
+
+def test_challenge_job_bulk_assigns_and_expires(db):
+    import datetime
+    from sqlalchemy import event
+    from jobs import run_challenge_job, seconds_until
+    from main import get_challenges
+
+    for i in range(30):
+        db.add(User(email=f"athlete{i}@example.com"))
+    db.add(UserChallenge(user_email="athlete0@example.com", challenge_id=1, status="active",
+                         start_date="2024-04-29", end_date="2024-05-05"))
+    # Ended yesterday: kept active for the grace day so late-synced activities still count
+    db.add(UserChallenge(user_email="athlete1@example.com", challenge_id=1, status="active",
+                         start_date="2024-05-05", end_date="2024-05-11"))
+    db.commit()
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement.split()[0].upper())
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        sunday = datetime.date(2024, 5, 12)
+        result = run_challenge_job(sunday, db=db) # current week + next week (tomorrow is Monday)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert result == {"expired": 1, "assigned": 60}
+    assert statements.count("UPDATE") == 1
+    # Catalog seed (one multi-row insert per table at most) + one bulk insert per week
+    assert statements.count("INSERT") <= 6
+
+    monday_rows = db.query(UserChallenge).filter(UserChallenge.start_date == "2024-05-13").count()
+    assert monday_rows == 30 * 2
+    assert run_challenge_job(sunday, db=db) == {"expired": 0, "assigned": 0} # idempotent
+    assert db.query(UserChallenge.status).filter(UserChallenge.end_date == "2024-05-11").scalar() == "active"
+
+    # Concurrent workers cannot assign the same challenge twice
+    from sqlalchemy.exc import IntegrityError
+    db.add(UserChallenge(user_email="athlete2@example.com", challenge_id=1, status="active",
+                         start_date="2024-05-13", end_date="2024-05-19"))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+
+    statements.clear()
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        get_challenges("athlete1@example.com", db)
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    assert statements == ["SELECT"] # handlers only read
+
+    assert seconds_until(0, 5, datetime.datetime(2024, 5, 12, 23, 0)) == 65 * 60
+
+
+def test_xp_leaderboard_incremental_and_keyset(db):
+    from challenge_rules import ChallengeEngine
+    from types import SimpleNamespace
+    from leaderboard import XpStore, XP_RANKING
+    from main import get_leaderboard, get_user_xp
+    from fastapi import HTTPException
+
+    logic = ChallengeLogic(db)
+    logic.seed_default_challenges()
+    sessions_id = db.query(Challenge.id).filter(Challenge.metric == "sessions").scalar()
+    for i in range(5):
+        db.add(User(email=f"a{i}@example.com", name=f"Athlete {i}"))
+        db.add(UserChallenge(user_email=f"a{i}@example.com", challenge_id=sessions_id, status="active",
+                             start_date="2024-05-06", end_date="2024-05-12"))
+    db.commit()
+    assert get_user_xp("a0@example.com", db)["rank"] is None
+
+    # a0..a2 complete "5 sessions" (150 XP), a3 and a4 do not
+    week = [{"date": f"2024-05-{d:02d}", "type": "running", "duration_min": 40} for d in range(6, 11)]
+    for i in range(5):
+        assert ChallengeEngine(db).recompute(f"a{i}@example.com", week if i < 3 else week[:2]) == (i < 3)
+    loads = XP_RANKING.loads
+    me = get_user_xp("a1@example.com", db)
+    assert (me["xp"], me["completed"], me["badges"], me["rank"]) == (150, 1, {"ShieldCheck": 1}, 1) # ties share rank
+
+    # Later awards move the in-process rank index without reloading it
+    XpStore(db).award("a2@example.com", [SimpleNamespace(xp_reward=200, badge_icon="Bike")])
+    db.commit()
+    assert get_user_xp("a2@example.com", db)["rank"] == 1
+    assert get_user_xp("a0@example.com", db)["rank"] == 2
+    assert XP_RANKING.loads == loads
+
+    # Keyset pages: xp desc, then id desc; the backfill from user_challenges agrees with the incremental totals
+    page = get_leaderboard(limit=2, db=db)
+    assert [(e["name"], e["rank"]) for e in page["entries"]] == [("Athlete 2", 1), ("Athlete 1", 2)]
+    # The public endpoint never exposes emails, not even inside the cursor
+    assert all("user_email" not in e for e in page["entries"])
+    import base64
+    assert "@" not in base64.urlsafe_b64decode(page["next"] + "=" * (-len(page["next"]) % 4)).decode()
+    page = get_leaderboard(limit=2, after=page["next"], db=db)
+    assert [e["name"] for e in page["entries"]] == ["Athlete 0"] and page["next"] is None
+    with pytest.raises(HTTPException):
+        get_leaderboard(after="not-a-cursor", db=db)
+
+    assert XpStore(db).rebuild() == 3
+    assert [e["xp"] for e in get_leaderboard(db=db)["entries"]] == [150, 150, 150]
+
+
+def test_hot_queries_use_composite_indexes(db):
+    from sqlalchemy import event, text
+    from database import TrainingPlan, ChatMessage, PerformanceHistory, create_missing_indexes
+    from challenge_rules import ChallengeEngine
+    from main import get_training_plan, get_challenges, get_chat_history, get_performance_history
+
+    for i in range(3):
+        email = f"a{i}@example.com"
+        db.add(TrainingPlan(user_email=email, plan_data={"weeks": []}, is_active=1))
+        db.add(ChatMessage(user_email=email, role="user", content="hi"))
+        db.add(PerformanceHistory(user_email=email, metric_type="ftp", value=250, recorded_at="2024-05-01"))
+        db.add(UserChallenge(user_email=email, challenge_id=1, status="active", start_date="2024-05-06", end_date="2024-05-12"))
+    db.commit()
+
+    queries = []
+    listener = lambda conn, cursor, statement, parameters, *args: queries.append((statement, parameters))
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        get_training_plan("a1@example.com", db)
+        get_challenges("a1@example.com", db)
+        get_chat_history("a1@example.com", db=db)
+        get_performance_history("a1@example.com", db)
+        ChallengeEngine(db)._active("a1@example.com")
+        ChallengeLogic(db).expire_challenges()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    hot = ("training_plans", "user_challenges", "chat_messages", "performance_history")
+    checked = 0
+    for statement, parameters in queries:
+        if not statement.startswith(("SELECT", "UPDATE")) or not any(t in statement for t in hot):
+            continue
+        plan = [row[3] for row in db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+        assert all(step.startswith("SEARCH") for step in plan), (statement, plan) # No full table scan
+        assert not any("TEMP B-TREE" in step for step in plan), (statement, plan) # No sort step
+        checked += 1
+    assert checked == 6
+
+    # Leaderboard pages walk the (xp, id) index backwards: no sort of the athletes below the cursor
+    from database import AthleteXP
+    from leaderboard import XpStore
+    db.add_all([AthleteXP(user_email=f"x{i}@example.com", xp=50 * (i % 4), completed=i % 4) for i in range(20)])
+    db.commit()
+    queries.clear()
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        page = XpStore(db).leaderboard(limit=5)
+        XpStore(db).leaderboard(limit=5, after=page["next"])
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    pages = [(st, p) for st, p in queries if "FROM athlete_xp LEFT OUTER JOIN users" in st]
+    assert len(pages) == 2
+    for (statement, parameters), first_step in zip(pages, ("SCAN athlete_xp USING INDEX", "SEARCH athlete_xp USING INDEX")):
+        plan = [row[3] for row in db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)]
+        assert plan[0].startswith(first_step) and "ix_athlete_xp_xp_id" in plan[0], plan
+        assert all(step.startswith("SEARCH") for step in plan[1:]), plan
+        assert not any("TEMP B-TREE" in step for step in plan), plan
+
+    # migrate_db adds indexes declared on tables that already exist
+    db.execute(text("DROP INDEX ix_chat_messages_user_id"))
+    db.commit()
+    assert create_missing_indexes(engine) == ["ix_chat_messages_user_id"]
+    assert create_missing_indexes(engine) == []
+
+
+def test_activity_stream_maps_garmin_errors_and_keeps_tokens(db, monkeypatch):
+    from fastapi import HTTPException
+    from garminconnect import GarminConnectNotFoundError
+    from garmin_sync import GarminManager
+    from main import get_activity_stream
+
+    db.add(User(email="stream@example.com", hashed_password="pw"))
+    db.commit()
+    monkeypatch.setattr(GarminManager, "get_session_tokens", lambda self: "refreshed-tokens")
+
+    def not_found(self, activity_id):
+        raise GarminConnectNotFoundError("404 Not Found")
+    def unreachable(self, activity_id):
+        raise ConnectionError("Garmin down")
+    for download, status in ((not_found, 404), (unreachable, 502), (lambda self, activity_id: b"not a fit file", 502)):
+        monkeypatch.setattr(GarminManager, "download_fit", download)
+        with pytest.raises(HTTPException) as err:
+            get_activity_stream("stream@example.com", 99, db=db)
+        assert err.value.status_code == status
+    assert db.query(User).filter(User.email == "stream@example.com").one().garmin_tokens == "refreshed-tokens"
+
+
+def test_profile_save_keeps_custom_time_constants(db, monkeypatch):
+    import pydantic
+    import pmc_store
+    from main import UserProfileSchema, update_profile
+
+    with pytest.raises(pydantic.ValidationError):
+        UserProfileSchema(email="tc@example.com", ctl_days=-5)
+
+    db.add(User(email="tc@example.com", name="TC", hr_rest=60, hr_max=190, ftp=200, ctl_days=28))
+    db.commit()
+    db.query(User).update({"atl_days": None}) # Row from before the column existed
+    db.commit()
+    rebuilds = []
+    monkeypatch.setattr(pmc_store.PmcStore, "rebuild", lambda self, email: rebuilds.append(email))
+
+    # The profile form does not send the time constants: they stay, and NULL is not a load model change
+    update_profile(UserProfileSchema(email="tc@example.com", name="TC", hr_rest=60, hr_max=190, ftp=200), db)
+    user = db.query(User).filter(User.email == "tc@example.com").one()
+    assert (user.ctl_days, user.atl_days) == (28, None) and rebuilds == []
+
+    update_profile(UserProfileSchema(email="tc@example.com", name="TC", hr_rest=60, hr_max=190, ftp=200, atl_days=10), db)
+    assert db.query(User.atl_days).filter(User.email == "tc@example.com").scalar() == 10 and rebuilds == ["tc@example.com"]
+
+
+def test_training_stats_never_store_future_days(db):
+    import datetime
+    from fastapi import BackgroundTasks, HTTPException, Response
+    from database import Activity, PmcDaily
+    from main import get_training_stats
+    from pmc_store import PmcStore
+
+    email = "future@example.com"
+    today = datetime.date.today()
+    start = (today - datetime.timedelta(days=10)).isoformat()
+    db.add(User(email=email, hashed_password="pw"))
+    db.add(Activity(user_email=email, activity_id=1, date=start, start_time_local=start + " 07:00:00",
+                    activity_type="running", summary={"date": start, "type": "running", "duration_min": 60}))
+    db.commit()
+
+    with pytest.raises(HTTPException) as err:
+        get_training_stats(email, Response(), BackgroundTasks(), end="9999-12-31", db=db)
+    assert err.value.status_code == 400
+
+    # A future window is rolled forward to today only; the days after it decay in memory
+    store = PmcStore(db)
+    stats = store.get_stats(email, days=5, end_date=today + datetime.timedelta(days=30))
+    assert store.last_date(email) == today
+    assert db.query(PmcDaily).count() == 11
+    ctl_today = db.query(PmcDaily.ctl).filter(PmcDaily.date == today.isoformat()).scalar()
+    assert stats["history"][-1]["fitness"] == round(ctl_today * (1 - 1 / 42) ** 30, 1)
+    week = store.get_stats(email, days=7, end_date=today + datetime.timedelta(days=3))
+    assert week["history"][3]["fitness"] == round(ctl_today, 1)
+    assert week["history"][-1]["fitness"] == round(ctl_today * (1 - 1 / 42) ** 3, 1)
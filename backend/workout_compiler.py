@@ -0,0 +1,319 @@
+"""
+Compiles plan/AI workout steps into the Garmin Connect workout JSON
+(ExecutableStepDTO / RepeatGroupDTO). Pure functions: the input steps are never
+mutated and nothing is printed, so compiled step trees can be memoized.
+"""
+import json
+import re
+from functools import lru_cache
+
+# Target extraction from free-text descriptions (e.g. "Run at 5:00/km", "12.5 km/h", "30 sec")
+PACE_RE = re.compile(r'\b([3-7]:[0-5]\d)(?:\s*/?km)?\b')
+SPEED_RE = re.compile(r'\b(\d{1,2}(?:\.\d)?)\s*km/h\b', re.IGNORECASE)
+SECONDS_RE = re.compile(r'\b(\d+)\s*sec', re.IGNORECASE)
+
+SPORT_RUNNING = {"sportTypeId": 1, "sportTypeKey": "running"}
+SPORT_CYCLING = {"sportTypeId": 2, "sportTypeKey": "cycling"}
+SPORT_SWIMMING = {"sportTypeId": 4, "sportTypeKey": "swimming"}
+
+STEP_TYPES = {
+    "warmup": {"stepTypeId": 1, "stepTypeKey": "warmup"},
+    "cooldown": {"stepTypeId": 2, "stepTypeKey": "cooldown"},
+    "recovery": {"stepTypeId": 4, "stepTypeKey": "recovery"},
+}
+
+# Number of distinct (steps, sport) trees kept compiled
+COMPILE_CACHE_SIZE = 512
+
+
+def resolve_sport_type(activity_type):
+    act_upper = str(activity_type).upper()
+    if "SWIM" in act_upper:
+        return dict(SPORT_SWIMMING)
+    if "CYCL" in act_upper or "BIK" in act_upper or "RID" in act_upper:
+        return dict(SPORT_CYCLING)
+    return dict(SPORT_RUNNING)
+
+
+def _pace_from_mmss(text):
+    m, s = map(int, text.split(":"))
+    sec_km = m * 60 + s
+    return 1000.0 / sec_km if sec_km > 0 else None
+
+
+def _resolve_targets(s_data):
+    """Returns a copy of the step with 'target' / description hints turned into pace_ms, power_watts, hr_bpm."""
+    s = dict(s_data)
+
+    # AI sends "target": {"type": "pace", "val": "5:30"}
+    if 'target' in s:
+        tgt = s['target']
+        t_type = tgt.get('type', '').lower()
+        t_val = tgt.get('val')
+
+        if t_type == 'pace' and t_val:
+            # Handle "5:30" or "330" (seconds/km)
+            try:
+                if ":" in str(t_val):
+                    pace = _pace_from_mmss(str(t_val))
+                else:
+                    sec_km = float(t_val)
+                    pace = 1000.0 / sec_km if sec_km > 0 else None
+                if pace:
+                    s['pace_ms'] = pace # m/s
+            except (TypeError, ValueError): pass
+
+        elif t_type == 'power' and t_val:
+            try: s['power_watts'] = int(t_val)
+            except (TypeError, ValueError): pass
+
+        elif t_type == 'hr' and t_val:
+            try: s['hr_bpm'] = int(t_val)
+            except (TypeError, ValueError): pass
+
+    # FALLBACK: Extract from Description if missing (e.g. "Run at 5:00/km" or "12.5 km/h")
+    if 'pace_ms' not in s and 'power_watts' not in s:
+        desc = s.get('description', '')
+
+        # 1. Try Pace (min/km)
+        match_pace = PACE_RE.search(desc)
+        if match_pace:
+            pace = _pace_from_mmss(match_pace.group(1))
+            if pace:
+                s['pace_ms'] = pace
+
+        # 2. Try Speed (km/h) - Common for Treadmill
+        if 'pace_ms' not in s:
+            match_speed = SPEED_RE.search(desc)
+            if match_speed:
+                kmh = float(match_speed.group(1))
+                if kmh > 0:
+                    s['pace_ms'] = kmh / 3.6
+
+    return s
+
+
+def _compile_executable(s, order, is_child, sport_key):
+    # Standard Step Construction - Robust Duration
+    dur_sec_explicit = s.get('duration_sec')
+    if dur_sec_explicit:
+        dur_val = int(dur_sec_explicit)
+    else:
+        # Parse duration_min, handle sub-minute values carefully
+        dur_val = int(float(s.get('duration_min', 0)) * 60)
+        # If duration is 0 but description mentions "X sec", try to recover
+        if dur_val == 0:
+            match_sec = SECONDS_RE.search(s.get('description', ''))
+            if match_sec:
+                dur_val = int(match_sec.group(1))
+
+    dist_val = int(float(s.get('distance_m', 0)))
+
+    step = {
+        "type": "ExecutableStepDTO",
+        "stepId": None,
+        "stepOrder": order,
+        "description": s.get('description', ''),
+        "stepType": {"stepTypeId": 3, "stepTypeKey": "interval"},
+        "endCondition": {"conditionTypeId": 2, "conditionTypeKey": "time"},
+        "endConditionValue": float(dur_val),
+        "targetType": {"workoutTargetTypeId": 1, "workoutTargetTypeKey": "no.target"},
+        "childStepId": 1 if is_child else None
+    }
+
+    # Distance Override
+    if dist_val > 0:
+        step["endCondition"] = {"conditionTypeId": 3, "conditionTypeKey": "distance"}
+        step["endConditionValue"] = float(dist_val)
+
+    stype = STEP_TYPES.get(s.get('type', 'INTERVAL').lower())
+    if stype:
+        step["stepType"] = dict(stype)
+
+    if sport_key == 'swimming':
+        step["strokeType"] = {"strokeTypeId": 1, "strokeTypeKey": "any_stroke"}
+        step["equipmentType"] = {"equipmentTypeId": 0, "equipmentTypeKey": "no_equipment"}
+        if step["stepType"]["stepTypeKey"] == "interval":
+            step["stepType"] = {"stepTypeId": 3, "stepTypeKey": "swim"}
+
+        # FORCE KILOMETER UNIT for meters (from user's working export)
+        if step["endCondition"]["conditionTypeKey"] == "distance":
+            step["preferredEndConditionUnit"] = {"unitId": 2, "unitKey": "kilometer", "factor": 100000.0}
+
+    # Target application logic
+    if s.get('pace_ms') is not None:
+        try:
+            speed = float(s['pace_ms'])
+        except (TypeError, ValueError):
+            speed = None # Invalid pace_ms: skip the target
+
+        if speed is not None:
+            if sport_key == 'swimming':
+                # Use pace.zone (ID 6) and swim.css.offset (ID 17)
+                step["targetType"] = {"workoutTargetTypeId": 6, "workoutTargetTypeKey": "pace.zone"}
+                step["secondaryTargetType"] = {"workoutTargetTypeId": 17, "workoutTargetTypeKey": "swim.css.offset"}
+
+                # Calculate offset from reference CSS
+                ref_css = float(s.get('css_ms') or speed)
+                if ref_css > 0:
+                    step["secondaryTargetValueOne"] = round(100.0 / speed - 100.0 / ref_css, 1)
+                else:
+                    step["secondaryTargetValueOne"] = 0.0
+
+                step["secondaryTargetValueTwo"] = 0.0
+                step["targetValueUnit"] = None
+            else:
+                step["targetType"] = {"workoutTargetTypeId": 6, "workoutTargetTypeKey": "speed.target"}
+
+            # Dynamic range: +/- 5% around the target speed for THIS specific step
+            step["targetValueOne"] = round(speed * 0.95, 3)
+            step["targetValueTwo"] = round(speed * 1.05, 3)
+
+    if 'power_watts' in s and sport_key == 'cycling':
+        watts = int(s['power_watts'])
+        step["targetType"] = {"workoutTargetTypeId": 2, "workoutTargetTypeKey": "power.target"}
+        step["targetValueOne"] = float(watts - 15)
+        step["targetValueTwo"] = float(watts + 15)
+
+        # Add cadence as secondary target if present
+        if 'cadence' in s:
+            cad = int(s['cadence'])
+            step["secondaryTargetType"] = {"workoutTargetTypeId": 3, "workoutTargetTypeKey": "cadence.target"}
+            step["secondaryTargetValueOne"] = float(cad - 5)
+            step["secondaryTargetValueTwo"] = float(cad + 5)
+
+    if 'hr_bpm' in s:
+        bpm = int(s['hr_bpm'])
+        # Heart Rate Target (Custom Range)
+        step["targetType"] = {"workoutTargetTypeId": 4, "workoutTargetTypeKey": "heart.rate.target"}
+        step["targetValueOne"] = float(bpm - 5)
+        step["targetValueTwo"] = float(bpm + 5)
+        step["targetValueUnit"] = {"unitId": 5, "unitKey": "beatsPerMinute", "factor": 1.0}
+
+    return step
+
+
+def _compile(steps_data, sport_key, start_order=1, is_child=False):
+    compiled = []
+    order = start_order
+
+    for s_data in steps_data:
+        # 1. Alias & Shorthand Logic
+        s = s_data
+        if 'repeat' in s and 'repeat_count' not in s:
+            s = dict(s, repeat_count=s['repeat'])
+
+        if s.get('repeat_count', 1) > 1 and 'steps' not in s:
+            rec_min = float(s.get('recovery_dur', 0))
+            if rec_min > 0:
+                work = dict(s, repeat_count=1)
+                work.pop('steps', None)
+                rec = {"type": "RECOVERY", "duration_min": rec_min, "description": "Rec"}
+                s = dict(s, steps=[work, rec])
+
+        # Handle Repeat Blocks (RepeatGroupDTO)
+        if 'steps' in s and s.get('repeat_count', 1) > 1:
+            reps = int(s['repeat_count'])
+            compiled.append({
+                "type": "RepeatGroupDTO",
+                "stepId": None,
+                "stepOrder": order,
+                "description": s.get('description'),
+                "stepType": {"stepTypeId": 6, "stepTypeKey": "repeat"},
+                "childStepId": 1, # Garmin seems to like '1' for structured parts
+                "numberOfIterations": reps,
+                "workoutSteps": _compile(s['steps'], sport_key, start_order=1, is_child=True),
+                "endCondition": {"conditionTypeId": 7, "conditionTypeKey": "iterations"},
+                "endConditionValue": float(reps),
+                "skipLastRestStep": True,
+                "smartRepeat": False
+            })
+        else:
+            compiled.append(_compile_executable(_resolve_targets(s), order, is_child, sport_key))
+
+        order += 1
+    return compiled
+
+
+@lru_cache(maxsize=COMPILE_CACHE_SIZE)
+def _compile_cached(steps_key, sport_key):
+    return json.dumps(_compile(json.loads(steps_key), sport_key))
+
+
+def compile_steps(steps, sport_key):
+    """
+    Compiles a plan/AI step tree into Garmin workoutSteps for the given sportTypeKey.
+    Identical trees are compiled once; every call returns a fresh structure.
+    """
+    steps_key = json.dumps(steps, sort_keys=True, default=str)
+    return json.loads(_compile_cached(steps_key, sport_key))
+
+
+def estimate_duration(steps_list):
+    """Estimated seconds (mandatory for the Garmin API). Distance steps count 1000m as 5 minutes."""
+    total = 0
+    for s in steps_list:
+        if s.get("type") in ["RepeatStepDTO", "RepeatGroupDTO"]:
+            reps = s.get("repeatCount") or s.get("numberOfIterations") or 1
+            total += estimate_duration(s["workoutSteps"]) * reps
+        elif s["endCondition"]["conditionTypeKey"] == "time":
+            total += s["endConditionValue"]
+        elif s["endCondition"]["conditionTypeKey"] == "distance":
+            total += (s["endConditionValue"] / 1000.0) * 300.0
+    return total
+
+
+def estimate_distance(steps_list):
+    total = 0
+    for s in steps_list:
+        if s.get("type") in ["RepeatStepDTO", "RepeatGroupDTO"]:
+            reps = s.get("repeatCount") or s.get("numberOfIterations") or 1
+            total += estimate_distance(s["workoutSteps"]) * reps
+        elif s["endCondition"]["conditionTypeKey"] == "distance":
+            total += s["endConditionValue"]
+    return total
+
+
+def build_workout_payload(name, description, duration_min, activity_type="RUNNING", steps=None, pool_length=25.0):
+    """Full Garmin workout JSON, mimicking what the garminconnect workout classes produce."""
+    sport_type = resolve_sport_type(activity_type)
+    is_swim = sport_type['sportTypeKey'] == 'swimming'
+
+    if steps:
+        workout_steps = compile_steps(steps, sport_type['sportTypeKey'])
+    else:
+        # Default single step
+        dur_secs = float(duration_min) * 60.0 if duration_min else 1800.0
+        workout_steps = [{
+            "type": "ExecutableStepDTO",
+            "stepId": None,
+            "stepOrder": 1,
+            "description": "Main Part",
+            "stepType": {"stepTypeId": 3, "stepTypeKey": "interval"},
+            "endCondition": {"conditionTypeId": 2, "conditionTypeKey": "time"},
+            "endConditionValue": dur_secs
+        }]
+
+    total_dur = int(estimate_duration(workout_steps))
+    total_dist = estimate_distance(workout_steps)
+
+    return {
+        "workoutName": name,
+        "description": description or name,
+        "sportType": sport_type,
+        "workoutSegments": [
+            {
+                "segmentOrder": 1,
+                "sportType": sport_type,
+                "workoutSteps": workout_steps,
+                "poolLength": None,
+                "poolLengthUnit": None,
+            }
+        ],
+        "estimatedDurationInSecs": total_dur,
+        "estimatedDistanceInMeters": float(total_dist) if total_dist > 0 else None,
+        "estimateType": "DISTANCE_ESTIMATED" if total_dist > 0 else None,
+        "estimatedDistanceUnit": {"unitId": None, "unitKey": None, "factor": None} if is_swim else None,
+        "poolLength": float(pool_length) if is_swim else None,
+        "poolLengthUnit": {"unitId": 2, "unitKey": "kilometer", "factor": 100000.0} if is_swim else None,
+    }
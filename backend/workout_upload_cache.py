@@ -0,0 +1,97 @@
+import hashlib
+import json
+import threading
+import datetime
+from sqlalchemy.orm import Session
+from database import WorkoutUpload
+
+
+def payload_hash(payload):
+    """Canonical hash of a Garmin workout payload (key order and whitespace independent)."""
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class WorkoutUploadCache:
+    """
+    Per-athlete map: payload hash -> Garmin workout id (+ dates it is already scheduled on).
+    Loaded with one query, safe to use from the upload worker threads, and written back
+    by the request thread with flush().
+    """
+
+    def __init__(self, db: Session, user_email: str):
+        self.user_email = user_email
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = set()
+        self._forgotten = set()
+        self._hash_locks = {}
+        for row in db.query(WorkoutUpload).filter(WorkoutUpload.user_email == user_email).all():
+            self._entries[row.payload_hash] = {
+                "workout_id": row.workout_id,
+                "dates": set(row.scheduled_dates or [])
+            }
+
+    def in_flight(self, p_hash):
+        """
+        Lock to hold around lookup + upload of one payload: identical workouts uploaded in parallel
+        by one batch then upload once, the others find the first upload and only reschedule it.
+        """
+        with self._lock:
+            return self._hash_locks.setdefault(p_hash, threading.Lock())
+
+    def lookup(self, p_hash):
+        """(workout_id, scheduled_dates) for an identical workout already in Garmin, or None."""
+        with self._lock:
+            entry = self._entries.get(p_hash)
+            if not entry:
+                return None
+            return entry["workout_id"], set(entry["dates"])
+
+    def record(self, p_hash, workout_id, date_str=None):
+        with self._lock:
+            entry = self._entries.get(p_hash)
+            if not entry or entry["workout_id"] != workout_id:
+                entry = self._entries[p_hash] = {"workout_id": workout_id, "dates": set()}
+            if date_str:
+                entry["dates"].add(date_str)
+            self._dirty.add(p_hash)
+            self._forgotten.discard(p_hash)
+
+    def forget(self, p_hash):
+        """Drops a mapping whose workout no longer exists in Garmin Connect."""
+        with self._lock:
+            self._entries.pop(p_hash, None)
+            self._dirty.discard(p_hash)
+            self._forgotten.add(p_hash)
+
+    def flush(self, db: Session):
+        """Persists new/changed mappings. Call from the request thread once uploads are done."""
+        with self._lock:
+            dirty = {h: self._entries[h] for h in self._dirty}
+            forgotten = set(self._forgotten)
+            self._dirty.clear()
+            self._forgotten.clear()
+
+        if not dirty and not forgotten:
+            return
+
+        now = datetime.datetime.now().isoformat()
+        rows = {r.payload_hash: r for r in db.query(WorkoutUpload).filter(
+            WorkoutUpload.user_email == self.user_email,
+            WorkoutUpload.payload_hash.in_(list(dirty) + list(forgotten))
+        ).all()}
+
+        for h in forgotten:
+            if h in rows and h not in dirty:
+                db.delete(rows[h])
+
+        for h, entry in dirty.items():
+            row = rows.get(h)
+            if not row:
+                row = WorkoutUpload(user_email=self.user_email, payload_hash=h, created_at=now)
+                db.add(row)
+            row.workout_id = entry["workout_id"]
+            row.scheduled_dates = sorted(entry["dates"])
+            row.updated_at = now
+        db.commit()